@@ -1,10 +1,60 @@
 from django.contrib import admin
-from .models import Post, Category,Comment
+from django.utils.text import Truncator
+from .models import Post, Category,Comment, OutgoingEmail
+from .pagination import EstimatedCountPaginator
+from . import search
 
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
     # automatically create the post's slug from its title
     prepopulated_fields = {'slug': ('title',)}
+    list_display = ('title', 'pub_date', 'comment_count', 'reply_count')
+    date_hierarchy = 'pub_date'
+    # the posts' full-text index, see get_search_results
+    search_fields = ('title',)
+    autocomplete_fields = ('categories',)
+    ordering = ('-pub_date', '-id')
 
-admin.site.register(Category)
-admin.site.register(Comment)
+    def get_search_results(self, request, queryset, search_term):
+        # search through blog.search instead of the LIKE '%term%' scans of search_fields,
+        # the comments' autocomplete widget searches here too
+        if not search_term:
+            return queryset, False
+        return queryset.filter(id__in=search.search_posts(search_term).values('id')), False
+
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    # there are a handful of categories, the posts' autocomplete widget searches them
+    search_fields = ('name',)
+
+@admin.register(Comment)
+class CommentAdmin(admin.ModelAdmin):
+    '''
+    Built for a table of millions of comments: no <select> of every comment or
+    recipient on the change form, one query for the changelist's rows, searches
+    and orderings that use an index, and no COUNT(*) of the whole table.
+    '''
+    list_display = ('name', 'email', 'short_comment', 'post', 'parent_comment_id', 'created_on')
+    list_select_related = ('post',)
+    # the newest first, blog_comment_created_id_idx read backwards
+    ordering = ('-created_on', '-id')
+    date_hierarchy = 'created_on'
+    # exact lookups on blog_comment_email_idx, a LIKE '%term%' would scan the whole table
+    search_fields = ('email__exact',)
+    autocomplete_fields = ('post',)
+    raw_id_fields = ('parent_comment', 'recipients')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_readonly_fields(self, request, obj=None):
+        # a comment's place in its thread, its path, is set when it's written, see blog.threads
+        return ('parent_comment',) if obj else ()
+
+    @admin.display(description='comment')
+    def short_comment(self, comment):
+        return Truncator(comment.comment).chars(80)
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'created_on', 'sent_on')
+    list_filter = ('status',)
@@ -0,0 +1,184 @@
+'''
+Seed realistic volumes of blog data and measure the public views against them.
+
+Used by `manage.py benchmark_views`, which runs it in a throwaway test
+database. seed() builds the rows with the factories in blog.factories
+and writes them with bulk_create, run() requests every scenario through the
+test client and reports its latency percentiles, queries and peak memory.
+'''
+import gc
+import time
+import tracemalloc
+from collections import namedtuple
+from itertools import chain
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from . import counters, search, threads
+from .models import Post, Category, Comment, Recipient
+from .text import make_excerpt, render_body
+from .tokens import make_unsubscribe_token
+from .factories import PostFactory, CategoryFactory, CommentFactory, ReplyFactory, RecipientFactory
+
+BATCH_SIZE = 5000
+CATEGORIES_PER_POST = 3
+# the commenters come back, there's one Recipient per distinct email
+COMMENTERS = 10000
+BODY = "\n\n".join(["Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor "
+                    "incididunt ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud "
+                    "exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat."] * 12)
+
+Scenario = namedtuple('Scenario', 'name method url data prepare')
+Scenario.__new__.__defaults__ = (None, None)
+
+
+def seed(posts, categories, comments, replies, busy_post_comments=0, log=print):
+    ''' Write the given numbers of rows, the comments are spread over the posts and the replies over the comments '''
+    body_excerpt, body_html = make_excerpt(BODY), render_body(BODY)
+
+    log(f"Seeding {categories} categories")
+    Category.objects.bulk_create(CategoryFactory.build(name=f"category_{i}") for i in range(categories))
+    category_ids = list(Category.objects.values_list('id', flat=True))
+
+    log(f"Seeding {posts} posts")
+    for start in range(0, posts, BATCH_SIZE):
+        batch = PostFactory.build_batch(min(BATCH_SIZE, posts - start), body=BODY)
+        for post in batch:
+            # bulk_create skips Post.save(), which computes these
+            post.excerpt, post.body_html = body_excerpt, body_html
+        Post.objects.bulk_create(batch)
+    post_ids = list(Post.objects.order_by('id').values_list('id', flat=True))
+    links = (Post.categories.through(post_id=post_id, category_id=category_ids[(i + j) % len(category_ids)])
+             for i, post_id in enumerate(post_ids) for j in range(min(CATEGORIES_PER_POST, len(category_ids))))
+    bulk_create_in_batches(Post.categories.through, links)
+    search.rebuild_index()
+
+    log(f"Seeding {COMMENTERS} recipients")
+    emails = [f"reader{i}@email.com" for i in range(COMMENTERS)]
+    Recipient.objects.bulk_create(RecipientFactory.build(recipient_email=email) for email in emails)
+
+    log(f"Seeding {comments} comments and {busy_post_comments} more on the busy post")
+    spread = (post_ids[i % len(post_ids)] for i in range(comments if post_ids else 0))
+    busy = (post_ids[-1] for _ in range(busy_post_comments if post_ids else 0))
+    bulk_create_in_batches(Comment, (CommentFactory.build(post=Post(id=post_id), email=emails[i % COMMENTERS])
+                                     for i, post_id in enumerate(chain(spread, busy))))
+    # every commenter is subscribed to their comment
+    recipient_ids = dict(Recipient.objects.values_list('recipient_email', 'id'))
+    bulk_create_in_batches(Comment.recipients.through, (
+        Comment.recipients.through(comment_id=comment_id, recipient_id=recipient_ids[email])
+        for comment_id, email in Comment.objects.values_list('id', 'email').iterator(chunk_size=BATCH_SIZE)
+    ))
+
+    log(f"Seeding {replies} replies")
+    parent_ids = list(Comment.objects.filter(parent_comment=None).order_by('id').values_list('id', flat=True)[:replies])
+    bulk_create_in_batches(Comment, (ReplyFactory.build(parent_comment=Comment(id=parent_ids[i % len(parent_ids)]),
+                                                        email=emails[(i + 1) % COMMENTERS])
+                                     for i in range(replies if parent_ids else 0)))
+    # bulk_create skips Comment.save(), which gives the replies their post and path,
+    # and the signals that count them
+    threads.fill_paths(Comment)
+    counters.recount()
+
+def bulk_create_in_batches(model, objects):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) == BATCH_SIZE:
+            model.objects.bulk_create(batch)
+            batch = []
+    model.objects.bulk_create(batch)
+
+def get_scenarios():
+    ''' One scenario per public view, run against the seeded data '''
+    busy_post = Post.objects.get(id=busy_post_id())
+    post = Post.objects.order_by('-pub_date', '-id').exclude(id=busy_post.id).first()
+    category = Category.objects.annotate(count=Count('posts')).order_by('-count').first()
+    comment = Comment.objects.filter(post=post).order_by('id').first()
+    email = comment.email
+
+    def resubscribe():
+        Recipient.objects.subscribe(comment, email)
+
+    return [
+        Scenario('base_view', 'get', reverse('base_view')),
+        Scenario('index_view', 'get', reverse('blog:index_view')),
+        Scenario('index_view_last_page', 'get', reverse('blog:index_view') + f"?page={last_page(Post.objects.count())}"),
+        Scenario('category_index_view', 'get', category.get_absolute_url()),
+        Scenario('post_detail_view', 'get', post.get_absolute_url()),
+        Scenario('post_detail_view_busy_post', 'get', busy_post.get_absolute_url()),
+        Scenario('post_comments_view_busy_post', 'get', reverse('blog:post_comments_view', args=[busy_post.slug])),
+        Scenario('post_detail_view_comment', 'post', post.get_absolute_url(),
+                 {"name": "Benchmark", "email": "benchmark@email.com", "comment": "I am a comment."}),
+        Scenario('post_detail_view_reply', 'post', post.get_absolute_url(),
+                 {"name": "Benchmark", "email": "benchmark@email.com", "comment": "I am a reply.",
+                  "parent_comment_id": comment.id}),
+        Scenario('unsubscribe_from_comment', 'post', reverse('blog:unsubscribe_from_post_view', args=[comment.id]),
+                 {"email": email}, resubscribe),
+        Scenario('unsubscribe_from_all_posts', 'post', reverse('blog:unsubscribe_from_all_posts_view'),
+                 {"email": email}, resubscribe),
+        Scenario('one_click_unsubscribe', 'post',
+                 reverse('blog:one_click_unsubscribe_view', args=[make_unsubscribe_token(email, comment.id)]),
+                 None, resubscribe),
+    ]
+
+def busy_post_id():
+    ''' The post with the most comments '''
+    return (Comment.objects.filter(parent_comment=None).values('post')
+                           .annotate(count=Count('id')).order_by('-count')
+                           .values_list('post', flat=True).first())
+
+def last_page(count, per_page=5):
+    return max(1, -(-count // per_page))
+
+def run(scenarios, requests=100, warmup=5, profiled=5, log=print):
+    ''' Return {scenario name: its measurements} '''
+    client = Client()
+    results = {}
+    for scenario in scenarios:
+        log(f"Benchmarking {scenario.name}")
+        send = lambda: getattr(client, scenario.method)(scenario.url, scenario.data or {})
+        for _ in range(warmup):
+            request(scenario, send)
+
+        timings = [request(scenario, send) for _ in range(requests)]
+
+        # queries and memory are measured apart, capturing them slows the requests down
+        queries, peak_memory = [], []
+        for _ in range(profiled):
+            if scenario.prepare:
+                scenario.prepare()
+            gc.collect()
+            tracemalloc.start()
+            with CaptureQueriesContext(connection) as captured:
+                status = send().status_code
+            peak_memory.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            queries.append(len(captured))
+
+        timings.sort()
+        results[scenario.name] = {
+            'url': scenario.url,
+            'method': scenario.method.upper(),
+            'status': status,
+            'requests': requests,
+            'p50_ms': round(percentile(timings, 50) * 1000, 3),
+            'p99_ms': round(percentile(timings, 99) * 1000, 3),
+            'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+            'queries': max(queries),
+            'peak_memory_kib': round(max(peak_memory) / 1024, 1),
+        }
+    return results
+
+def request(scenario, send):
+    if scenario.prepare:
+        scenario.prepare()
+    start = time.perf_counter()
+    send()
+    return time.perf_counter() - start
+
+def percentile(sorted_values, percent):
+    ''' The nearest-rank percentile '''
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[rank - 1]
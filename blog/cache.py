@@ -0,0 +1,188 @@
+'''
+Cache the rendered blog pages under versioned keys.
+
+Every cached page belongs to a scope ('index', 'category:<name>' or
+'post:<slug>') and its cache key embeds the current version of that scope.
+The signal handlers in blog.signals bump the version of exactly the scopes a
+write affects, which orphans their cached pages without touching the rest.
+
+The pages are shared by every visitor, so their forms are cached with a
+placeholder for the CSRF token and each visitor's own token is filled in as
+the page is sent.
+'''
+import hashlib
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.cache import cache_page
+from django.middleware.csrf import get_token
+from django.views.decorators.http import condition
+from .metrics import PAGE_CACHE_LOOKUPS
+
+INDEX = 'index'
+HITS, MISSES = 'blog:cache:hits', 'blog:cache:misses'
+CSRF_TOKEN_PLACEHOLDER = 'blog-cache-csrf-token'
+
+
+def category_scope(name):
+    return f'category:{name.lower()}'
+
+def post_scope(slug):
+    return f'post:{slug}'
+
+def version_key(scope):
+    return 'blog:cache:version:' + hashlib.md5(scope.encode()).hexdigest()
+
+def get_versions(scopes):
+    ''' Return the current version of every scope, starting the missing ones '''
+    keys = {version_key(scope): scope for scope in scopes}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        # a fresh random version can't collide with pages cached before the old one was evicted
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+def invalidate(*scopes):
+    ''' Orphan every page cached in these scopes '''
+    cache.set_many({version_key(scope): uuid.uuid4().hex for scope in scopes}, timeout=None)
+
+def count(key):
+    PAGE_CACHE_LOOKUPS.labels('hit' if key == HITS else 'miss').inc()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+def get_stats():
+    ''' Return the hits and misses of the page cache since it was last cleared '''
+    hits, misses = cache.get(HITS, 0), cache.get(MISSES, 0)
+    return {'hits': hits, 'misses': misses, 'hit_ratio': hits / (hits + misses) if hits + misses else 0.0}
+
+
+class CacheScopesMixin:
+    ''' The versions of the scopes a view's response depends on, fetched once per request '''
+    def get_cache_scopes(self):
+        raise NotImplementedError(f"{type(self).__name__} must define get_cache_scopes()")
+
+    def get_cache_versions(self):
+        if not hasattr(self, '_cache_versions'):
+            self._cache_versions = get_versions(self.get_cache_scopes())
+        return self._cache_versions
+
+
+class ConditionalGetMixin(CacheScopesMixin):
+    '''
+    Answer a GET with 304 Not Modified, before the page is rendered or even looked up
+    in the cache, when the browser's copy is still current.
+
+    Views define get_last_modified() with one cheap query, and the ETag embeds
+    the versions of their cache scopes as well, so that writes without a
+    timestamp, like a deleted comment or a renamed category, change it too.
+    '''
+    def get_last_modified(self):
+        raise NotImplementedError("ConditionalGetMixin views must define get_last_modified()")
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        self.last_modified = last_modified = self.get_last_modified()
+        if last_modified is None:
+            # nothing to validate against, most likely a 404
+            return super().dispatch(request, *args, **kwargs)
+
+        etag = hashlib.md5(':'.join([*self.get_cache_versions(), last_modified.isoformat()]).encode()).hexdigest()
+        view = condition(etag_func=lambda *args, **kwargs: etag,
+                         last_modified_func=lambda *args, **kwargs: last_modified)(super().dispatch)
+        return view(request, *args, **kwargs)
+
+
+class CachedResponseMixin(CacheScopesMixin):
+    '''
+    Serve a view's GET responses from the cache for settings.BLOG_CACHE_TIMEOUT seconds,
+    or until one of the scopes returned by get_cache_scopes() is invalidated.
+    '''
+    def dispatch(self, request, *args, **kwargs):
+        timeout = getattr(settings, 'BLOG_CACHE_TIMEOUT', 0)
+        if request.method not in ('GET', 'HEAD') or not timeout:
+            return super().dispatch(request, *args, **kwargs)
+
+        self.caches_response = True
+        key_prefix = hashlib.md5(':'.join(self.get_cache_versions()).encode()).hexdigest()
+        view = cache_page(timeout, key_prefix=f'blog.{key_prefix}')(super().dispatch)
+        response = view(request, *args, **kwargs)
+        hit = request._cache_update_cache is False
+        count(HITS if hit else MISSES)
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        if hasattr(response, 'render') and callable(response.render) and not response.is_rendered:
+            # after cache_page's own callback, the page is cached with the placeholder
+            response.add_post_render_callback(self.revalidate)
+            response.add_post_render_callback(self.fill_csrf_token)
+        else:
+            self.revalidate(response)
+            self.fill_csrf_token(response)
+        return response
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if getattr(self, 'caches_response', False):
+            # {% csrf_token %} renders the placeholder, the page doesn't depend on the visitor's cookie
+            context['csrf_token'] = CSRF_TOKEN_PLACEHOLDER
+        return context
+
+    def fill_csrf_token(self, response):
+        placeholder = CSRF_TOKEN_PLACEHOLDER.encode()
+        if placeholder in response.content:
+            # get_token() has CsrfViewMiddleware set the visitor's CSRF cookie along with it
+            response.content = response.content.replace(placeholder, get_token(self.request).encode())
+
+    @staticmethod
+    def revalidate(response):
+        # the cache is invalidated on writes but browsers can't know that,
+        # so they have to check back instead of trusting the cache timeout
+        if 'Expires' in response:
+            del response['Expires']
+        patch_cache_control(response, max_age=0)
+
+
+class CachedStreamMixin(CacheScopesMixin):
+    '''
+    The page cache for views that stream their response, which cache_page won't store.
+    The chunks are cached as they're sent, and served as one response afterwards.
+    '''
+    content_type = None
+
+    def stream(self):
+        raise NotImplementedError(f"{type(self).__name__} must define stream()")
+
+    def get(self, request, *args, **kwargs):
+        timeout = getattr(settings, 'BLOG_CACHE_TIMEOUT', 0)
+        if not timeout:
+            return StreamingHttpResponse(self.stream(), content_type=self.content_type)
+
+        # the streams are full of absolute urls, the host is part of the key
+        key = hashlib.md5(':'.join([*self.get_cache_versions(), request.build_absolute_uri()]).encode()).hexdigest()
+        key = f'blog.stream.{key}'
+        content = cache.get(key)
+        if content is not None:
+            count(HITS)
+            response = HttpResponse(content, content_type=self.content_type)
+        else:
+            count(MISSES)
+            response = StreamingHttpResponse(self.cache_chunks(key, self.stream(), timeout),
+                                             content_type=self.content_type)
+        response['X-Cache'] = 'HIT' if content is not None else 'MISS'
+        patch_cache_control(response, max_age=0)
+        return response
+
+    @staticmethod
+    def cache_chunks(key, chunks, timeout):
+        # nothing is cached if the client goes away before the last chunk
+        sent = []
+        for chunk in chunks:
+            sent.append(chunk)
+            yield chunk
+        cache.set(key, ''.join(sent), timeout)
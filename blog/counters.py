@@ -0,0 +1,30 @@
+'''
+The comment_count and reply_count columns of Post.
+
+blog.signals adds a comment to them when it's saved and takes it off when it's
+deleted, with one UPDATE ... SET comment_count = comment_count + 1 in the same
+transaction, so concurrent comments can't lose a count. The comments deleted
+along with their post aren't taken off, the post is gone. Rows written around
+the signals, by bulk_create() or update(), are counted again by recount().
+'''
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from .models import Post, Comment
+
+
+def add(post_id, comment, amount):
+    ''' Add amount to the count of comment's kind, top-level comments or replies, of the post '''
+    field = 'reply_count' if comment.parent_comment_id else 'comment_count'
+    # a count that drifted below what's deleted stays at 0 until it's recounted
+    Post.objects.filter(id=post_id).update(**{field: Greatest(F(field) + amount, Value(0))})
+
+def recount(posts=None):
+    ''' Count the comments and replies of posts, all of them by default, in one UPDATE; return how many posts '''
+    def count(comments, post):
+        return Coalesce(Subquery(comments.order_by().values(post).annotate(count=Count('id')).values('count')), 0)
+
+    posts = Post.objects.all() if posts is None else posts
+    return posts.update(
+        comment_count=count(Comment.objects.filter(post=OuterRef('pk'), parent_comment=None), 'post'),
+        reply_count=count(Comment.objects.filter(post=OuterRef('pk')).exclude(parent_comment=None), 'post'),
+    )
@@ -14,7 +14,7 @@ class PostFactory(factory.DjangoModelFactory):
     title="post title"
     body="this is the body of a post"
     pub_date= datetime.now()
-    slug="post-title" 
+    slug=factory.Sequence(lambda n: f"post-title-{n}")
     
     @factory.post_generation
     def categories(self, create, extracted, **kwargs):
@@ -60,5 +60,6 @@ class ReplyFactory(factory.DjangoModelFactory):
 class RecipientFactory(factory.DjangoModelFactory):
     class Meta:
         model = Recipient
+        django_get_or_create = ('recipient_email',)
     recipient_email = "recipient@email.com"    
    
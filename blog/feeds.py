@@ -0,0 +1,242 @@
+'''
+RSS/Atom feeds of the posts and the blog's sitemap, streamed as they're written.
+
+django.contrib.syndication writes a whole feed into one string before sending
+it, so the feeds here drive Django's feed generators one post at a time instead.
+'''
+import io
+from django.db.models import Max
+from django.http import Http404
+from django.urls import reverse
+from django.utils import feedgenerator
+from django.utils.xmlutils import SimplerXMLGenerator
+from django.views import generic
+from . import cache
+from .models import Post, Category
+
+BLOG_TITLE = "Broken Magic Wand"
+
+
+class XMLStream:
+    ''' An XML writer whose output is taken out in chunks '''
+    def __init__(self):
+        self.out = io.StringIO()
+        self.handler = SimplerXMLGenerator(self.out, 'utf-8', short_empty_elements=True)
+
+    def flush(self):
+        chunk = self.out.getvalue()
+        self.out.seek(0)
+        self.out.truncate()
+        return chunk
+
+
+class StreamingFeedMixin:
+    def __init__(self, *args, last_modified=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_modified = last_modified
+
+    def latest_post_date(self):
+        # the items are never all in self.items at once
+        return self.last_modified or super().latest_post_date()
+
+    def stream(self, items):
+        ''' Yield the feed in chunks, one per item of items, the keyword arguments of add_item() '''
+        xml = XMLStream()
+        self.write_start(xml.handler)
+        yield xml.flush()
+        for item in items:
+            self.add_item(**item)
+            item = self.items.pop()
+            xml.handler.startElement(self.item_element, self.item_attributes(item))
+            self.add_item_elements(xml.handler, item)
+            xml.handler.endElement(self.item_element)
+            yield xml.flush()
+        self.write_end(xml.handler)
+        yield xml.flush()
+
+
+class RssFeed(StreamingFeedMixin, feedgenerator.Rss201rev2Feed):
+    item_element = 'item'
+
+    def write_start(self, handler):
+        handler.startDocument()
+        handler.startElement('rss', self.rss_attributes())
+        handler.startElement('channel', self.root_attributes())
+        self.add_root_elements(handler)
+
+    def write_end(self, handler):
+        self.endChannelElement(handler)
+        handler.endElement('rss')
+
+
+class AtomFeed(StreamingFeedMixin, feedgenerator.Atom1Feed):
+    item_element = 'entry'
+
+    def write_start(self, handler):
+        handler.startDocument()
+        handler.startElement('feed', self.root_attributes())
+        self.add_root_elements(handler)
+
+    def write_end(self, handler):
+        handler.endElement('feed')
+
+
+class PostFeed(cache.ConditionalGetMixin, cache.CachedStreamMixin, generic.View):
+    ''' The newest posts on the blog, as RSS or Atom depending on feed_class '''
+    feed_class = RssFeed
+    limit = 50
+
+    @property
+    def content_type(self):
+        return self.feed_class.content_type
+
+    def get_cache_scopes(self):
+        return [cache.INDEX]
+
+    def get_posts(self):
+        return Post.objects.all()
+
+    def get_last_modified(self):
+        # like the listings, edits bump the ETag's cache version instead
+        return self.get_posts().aggregate(Max('pub_date'))['pub_date__max']
+
+    def get_feed(self):
+        return self.feed_class(title=BLOG_TITLE,
+                               link=self.request.build_absolute_uri(reverse('blog:index_view')),
+                               description="The newest posts on Voila's blog.",
+                               feed_url=self.request.build_absolute_uri(),
+                               language='en',
+                               last_modified=getattr(self, 'last_modified', None))
+
+    def stream(self):
+        posts = (self.get_posts().defer('body', 'body_html')
+                                 .prefetch_related('categories')
+                                 .order_by('-pub_date', '-id')[:self.limit])
+        return self.get_feed().stream(self.get_item(post) for post in posts)
+
+    def get_item(self, post):
+        link = self.request.build_absolute_uri(post.get_absolute_url())
+        return {
+            'title': post.title,
+            'link': link,
+            'unique_id': link,
+            'description': post.excerpt,
+            'pubdate': post.pub_date,
+            'updateddate': post.updated_on,
+            'categories': [category.name for category in post.categories.all()],
+        }
+
+
+class CategoryFeed(PostFeed):
+    ''' The newest posts that have <category> in their set of categories '''
+    def get_cache_scopes(self):
+        return [cache.category_scope(self.kwargs['category'])]
+
+    def get_posts(self):
+        return Post.objects.filter(categories__name__iexact = self.kwargs['category'])
+
+    def get_feed(self):
+        category = self.kwargs['category']
+        return self.feed_class(title=f"{BLOG_TITLE} #{category}",
+                               link=self.request.build_absolute_uri(reverse('blog:category_index_view', args=[category])),
+                               description=f"The newest #{category} posts on Voila's blog.",
+                               feed_url=self.request.build_absolute_uri(),
+                               language='en',
+                               last_modified=getattr(self, 'last_modified', None))
+
+
+class SitemapView(cache.ConditionalGetMixin, cache.CachedStreamMixin, generic.View):
+    '''
+    sitemap.xml of the blog, the listing, every post and every hashtag that has posts.
+
+    A sitemap holds at most 50,000 urls. Past that, like django.contrib.sitemaps,
+    sitemap.xml is a <sitemapindex> of its pages, sitemap.xml?p=<page>.
+    '''
+    content_type = 'application/xml; charset=utf-8'
+    chunk_size = 500
+    limit = 50000
+
+    def get(self, request, *args, **kwargs):
+        page = request.GET.get('p')
+        self.page = int(page) if page and page.isdigit() else None
+        if page is not None and not self.page:
+            raise Http404("Invalid sitemap page.")
+        # the first page is never empty, it has the listing
+        if self.page and self.page > 1 and self.count_urls() <= (self.page - 1) * self.limit:
+            raise Http404("No such sitemap page.")
+        return super().get(request, *args, **kwargs)
+
+    def get_cache_scopes(self):
+        return [cache.INDEX]
+
+    def get_last_modified(self):
+        return Post.objects.aggregate(Max('pub_date'))['pub_date__max']
+
+    def get_sections(self):
+        ''' The sitemap's urls, as (rows of (key, last modified), the path of a key) in the order they're listed '''
+        posts = (Post.objects.exclude(slug=None)
+                             .order_by('-pub_date', '-id')
+                             .values_list('slug', 'updated_on'))
+        categories = (Category.objects.annotate(newest_post=Max('posts__pub_date'))
+                                      .exclude(newest_post=None)
+                                      .order_by('name')
+                                      .values_list('name', 'newest_post'))
+        return [
+            ([(None, getattr(self, 'last_modified', None))], lambda key: reverse('blog:index_view')),
+            (posts, lambda slug: reverse('blog:post_detail_view', args=[slug])),
+            (categories, lambda name: reverse('blog:category_index_view', args=[name])),
+        ]
+
+    def count_urls(self):
+        return sum(len(rows) if isinstance(rows, list) else rows.count() for rows, path in self.get_sections())
+
+    def get_urls(self, start, stop):
+        ''' Yield the (path, last modified) of the sitemap's urls from start to stop '''
+        for rows, path in self.get_sections():
+            if stop <= 0:
+                break
+            count = len(rows) if isinstance(rows, list) else rows.count()
+            if start < count:
+                rows = rows[max(start, 0):stop]
+                if not isinstance(rows, list):
+                    rows = rows.iterator(chunk_size=self.chunk_size)
+                for key, last_modified in rows:
+                    yield path(key), last_modified
+            start, stop = start - count, stop - count
+
+    def stream(self):
+        if self.page is None:
+            count = self.count_urls()
+            if count > self.limit:
+                return self.stream_index(pages=-(-count // self.limit))
+        page = self.page or 1
+        return self.stream_urls(self.get_urls((page - 1) * self.limit, page * self.limit))
+
+    def stream_index(self, pages):
+        xml = XMLStream()
+        xml.handler.startDocument()
+        xml.handler.startElement('sitemapindex', {'xmlns': 'http://www.sitemaps.org/schemas/sitemap/0.9'})
+        for page in range(1, pages + 1):
+            xml.handler.startElement('sitemap', {})
+            xml.handler.addQuickElement('loc', self.request.build_absolute_uri(f"{reverse('blog:sitemap')}?p={page}"))
+            xml.handler.endElement('sitemap')
+        xml.handler.endElement('sitemapindex')
+        yield xml.flush()
+
+    def stream_urls(self, urls):
+        xml = XMLStream()
+        xml.handler.startDocument()
+        xml.handler.startElement('urlset', {'xmlns': 'http://www.sitemaps.org/schemas/sitemap/0.9'})
+        for i, (path, last_modified) in enumerate(urls, 1):
+            self.add_url(xml.handler, path, last_modified)
+            if i % self.chunk_size == 0:
+                yield xml.flush()
+        xml.handler.endElement('urlset')
+        yield xml.flush()
+
+    def add_url(self, handler, path, last_modified):
+        handler.startElement('url', {})
+        handler.addQuickElement('loc', self.request.build_absolute_uri(path))
+        if last_modified:
+            handler.addQuickElement('lastmod', last_modified.date().isoformat())
+        handler.endElement('url')
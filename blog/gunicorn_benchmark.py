@@ -0,0 +1,23 @@
+'''
+gunicorn config for `manage.py benchmark_concurrency`.
+
+A local database answers in microseconds, which hides what a worker does while
+it waits on a real one. BLOG_BENCHMARK_DB_LATENCY_MS adds that wait to every query.
+'''
+import os
+import time
+
+
+def post_worker_init(worker):
+    delay = float(os.environ.get('BLOG_BENCHMARK_DB_LATENCY_MS', 0)) / 1000
+    if not delay:
+        return
+    from django.db.backends.signals import connection_created
+
+    def wait_for_database(execute, sql, params, many, context):
+        time.sleep(delay)
+        return execute(sql, params, many, context)
+
+    def add_latency(sender, connection, **kwargs):
+        connection.execute_wrappers.append(wait_for_database)
+    connection_created.connect(add_latency, weak=False)
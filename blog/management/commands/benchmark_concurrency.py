@@ -0,0 +1,133 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.urls import reverse
+from django.utils import timezone
+from blog.benchmarks import percentile
+from blog.management.commands.benchmark_views import Command as BenchmarkViewsCommand
+from blog.models import Post, Category
+
+# the Procfile's setup
+SERVER = ['voila.wsgi', '-k', 'sync']
+# `python -m gunicorn` only works from gunicorn 20.1 on
+GUNICORN = [sys.executable, '-c', 'from gunicorn.app.wsgiapp import run; run()']
+
+
+class Command(BaseCommand):
+    help = ("Serve the blog with gunicorn's sync workers, send it concurrent load and write its throughput "
+            "and latency percentiles as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--concurrency', type=int, default=64, help="Requests in flight at once.")
+        parser.add_argument('--requests', type=int, default=2000, help="Timed requests per server.")
+        parser.add_argument('--path', action='append', dest='paths',
+                            help="Request this path, repeat for more (default: the index, a category and a post).")
+        parser.add_argument('--db-latency-ms', type=float, default=0,
+                            help="Add this much latency to every query, as a database on another host would.")
+        parser.add_argument('--with-cache', action='store_true',
+                            help="Leave the page cache on, by default every request reaches the database.")
+        parser.add_argument('--output', help="Where to write the JSON (default: concurrency-<commit>.json).")
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or self.get_default_paths()
+        env = {
+            **os.environ,
+            'BLOG_BENCHMARK_DB_LATENCY_MS': str(options['db_latency_ms']),
+            'VOILA_TIMING_ENABLED': '',
+        }
+        # the benchmark doesn't write, the workers' local memory caches can't go stale
+        env['BLOG_CACHE_TIMEOUT'] = str(60 * 60) if options['with_cache'] else '0'
+
+        port = get_free_port()
+        process = subprocess.Popen(
+            [*GUNICORN, *SERVER, '--bind', f'127.0.0.1:{port}',
+             '--workers', str(options['workers']), '--config', 'python:blog.gunicorn_benchmark'],
+            env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_for_port(port)
+            urls = [f'http://localhost:{port}{path}' for path in paths]
+            # warm up every worker's connections and caches
+            load(urls, options['concurrency'], options['concurrency'])
+            result = load(urls, options['requests'], options['concurrency'])
+        finally:
+            process.terminate()
+            process.wait()
+
+        commit = BenchmarkViewsCommand.get_commit()
+        report = {
+            'commit': commit,
+            'created_on': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'settings': {key: options[key] for key in
+                         ('workers', 'concurrency', 'requests', 'db_latency_ms', 'with_cache')},
+            'paths': paths,
+            'result': result,
+        }
+        output = options['output'] or f"concurrency-{commit or 'unknown'}.json"
+        with open(output, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        self.stdout.write(f"Wrote {output}")
+        self.stdout.write(f"{result['requests_per_second']:.1f} req/s  p50 {result['p50_ms'] or 0:.2f}ms  "
+                          f"p99 {result['p99_ms'] or 0:.2f}ms  {result['errors']} errors")
+
+    def get_default_paths(self):
+        post = Post.objects.order_by('-pub_date', '-id').first()
+        category = Category.objects.annotate(count=Count('posts')).order_by('-count').first()
+        if post is None or category is None:
+            raise CommandError("There are no posts to request, seed some or pass --path.")
+        return [reverse('blog:index_view'), category.get_absolute_url(), post.get_absolute_url()]
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise CommandError(f"The server didn't start listening on port {port} in {timeout}s.")
+
+def load(urls, requests, concurrency):
+    ''' Send requests GETs, cycling through urls, with concurrency of them in flight at once '''
+    def fetch(i):
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(urls[i % len(urls)], timeout=60) as response:
+                response.read()
+            ok = True
+        except (urllib.error.URLError, OSError):
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        responses = list(executor.map(fetch, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    timings = sorted(duration for duration, ok in responses if ok)
+    return {
+        'requests': requests,
+        'errors': sum(not ok for _, ok in responses),
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(timings, 50) * 1000, 3) if timings else None,
+        'p99_ms': round(percentile(timings, 99) * 1000, 3) if timings else None,
+    }
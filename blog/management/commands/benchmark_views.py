@@ -0,0 +1,77 @@
+import json
+import subprocess
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import (override_settings, setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+from django.utils import timezone
+from blog import benchmarks
+from blog.models import Post, Category, Comment, Recipient
+
+
+class Command(BaseCommand):
+    help = ("Seed a throwaway test database with realistic volumes and write the latency percentiles, "
+            "queries and peak memory of every public view as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=50000)
+        parser.add_argument('--categories', type=int, default=500)
+        parser.add_argument('--comments', type=int, default=500000, help="Top level comments, spread over the posts.")
+        parser.add_argument('--replies', type=int, default=500000, help="Replies, spread over the comments.")
+        parser.add_argument('--busy-post-comments', type=int, default=10000,
+                            help="Extra comments on one post, benchmarked on its own.")
+        parser.add_argument('--requests', type=int, default=100, help="Timed requests per view.")
+        parser.add_argument('--with-cache', action='store_true',
+                            help="Leave the page cache on, by default the views are measured without it.")
+        parser.add_argument('--keepdb', action='store_true',
+                            help="Keep the test database and its rows for the next run (set a TEST NAME on SQLite).")
+        parser.add_argument('--output', help="Where to write the JSON (default: benchmark-<commit>.json).")
+
+    def handle(self, *args, **options):
+        log = lambda message: self.stdout.write(message) if options['verbosity'] else None
+        setup_test_environment(debug=False)
+        databases = setup_databases(verbosity=options['verbosity'], interactive=False, keepdb=options['keepdb'])
+        try:
+            if not Post.objects.exists():
+                benchmarks.seed(options['posts'], options['categories'], options['comments'], options['replies'],
+                                options['busy_post_comments'], log=log)
+            volumes = self.count_rows()
+            with override_settings(BLOG_CACHE_TIMEOUT=60 * 60 if options['with_cache'] else 0):
+                results = benchmarks.run(benchmarks.get_scenarios(), requests=options['requests'], log=log)
+        finally:
+            teardown_databases(databases, verbosity=options['verbosity'], keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        commit = self.get_commit()
+        report = {
+            'commit': commit,
+            'created_on': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'page_cache': options['with_cache'],
+            'volumes': volumes,
+            'views': results,
+        }
+        output = options['output'] or f"benchmark-{commit or 'unknown'}.json"
+        with open(output, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        self.stdout.write(f"Wrote {output}")
+        for name, result in results.items():
+            self.stdout.write(f"{name:<30} p50 {result['p50_ms']:>9.2f}ms  p99 {result['p99_ms']:>9.2f}ms  "
+                              f"{result['queries']:>3} queries  {result['peak_memory_kib']:>9.1f}KiB")
+
+    def count_rows(self):
+        return {
+            'posts': Post.objects.count(),
+            'categories': Category.objects.count(),
+            'comments': Comment.objects.filter(parent_comment=None).count(),
+            'replies': Comment.objects.exclude(parent_comment=None).count(),
+            'recipients': Recipient.objects.count(),
+        }
+
+    @staticmethod
+    def get_commit():
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
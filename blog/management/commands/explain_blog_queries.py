@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from blog import threads
+from blog.models import Post, Comment, Category, Recipient
+from blog.views import IndexView, CategoryIndexView, PostDetailView
+
+
+class Command(BaseCommand):
+    help = "Print the EXPLAIN plan of every query the blog views run, to check that they use the indexes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--slug', help="The post to explain PostDetailView with (default: the newest post).")
+        parser.add_argument('--category', help="The hashtag to explain CategoryIndexView with (default: the first category).")
+        parser.add_argument('--email', default="someone@email.com", help="The email to explain the unsubscribe lookups with.")
+        parser.add_argument('--analyze', action='store_true', help="Run the queries too and show the actual timings (PostgreSQL only).")
+
+    def handle(self, *args, **options):
+        self.explain_options = {'analyze': True} if options['analyze'] and connection.vendor == 'postgresql' else {}
+        request = RequestFactory().get('/')
+        newest_post = Post.objects.order_by('-pub_date', '-id').first()
+        slug = options['slug'] or (newest_post.slug if newest_post else "")
+        category = options['category'] or Category.objects.values_list('name', flat=True).first() or ""
+        email = options['email']
+
+        index_view = IndexView()
+        index_view.setup(request)
+        posts = index_view.get_queryset()
+        self.explain("IndexView: a page of posts", posts[:index_view.paginate_by])
+        self.explain("IndexView: the page's categories", Category.objects.filter(posts__in=[post.id for post in posts[:index_view.paginate_by]]))
+
+        category_view = CategoryIndexView()
+        category_view.setup(request, category=category)
+        self.explain(f"CategoryIndexView: a page of #{category} posts", category_view.get_queryset()[:category_view.paginate_by])
+
+        detail_view = PostDetailView()
+        detail_view.setup(request, slug=slug)
+        self.explain(f"PostDetailView: the post {slug!r}", detail_view.get_queryset())
+        post = detail_view.get_queryset().first()
+        comments = Comment.objects.filter(post=post, parent_comment=None).order_by('created_on', 'id')
+        page = list(comments[:settings.BLOG_COMMENTS_PER_PAGE])
+        comment_ids = [comment.id for comment in page]
+        self.explain("PostDetailView: the post's comments", comments[:settings.BLOG_COMMENTS_PER_PAGE + 1])
+        if page:
+            self.explain("PostDetailView: the threads of replies under them", threads.replies_under(post, page))
+
+        self.explain("unsubscribe_from_all_posts: the recipient lookup", Recipient.objects.filter(recipient_email=email))
+        self.explain("unsubscribe_from_comment: the recipient lookup",
+                     Comment.recipients.through.objects.filter(comment_id=comment_ids[0] if comment_ids else 0,
+                                                               recipient__recipient_email=email))
+
+    def explain(self, title, queryset):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        self.stdout.write(str(queryset.query))
+        self.stdout.write(queryset.explain(**self.explain_options))
+        self.stdout.write("")
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from blog import search
+
+
+class Command(BaseCommand):
+    help = "Reindex every post for full-text search, e.g. after posts were written with bulk_create() or update()."
+
+    def handle(self, *args, **options):
+        search.rebuild_index()
+        self.stdout.write("The search index has been rebuilt.")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from blog import counters, threads
+from blog.models import Comment
+
+
+class Command(BaseCommand):
+    help = ("Count the comments and replies of every post again, e.g. after comments were written "
+            "with bulk_create() or deleted with a raw query. The comments written without save() "
+            "get their thread paths first.")
+
+    def handle(self, *args, **options):
+        threads.fill_paths(Comment)
+        posts = counters.recount()
+        self.stdout.write(f"The comments of {posts} posts have been recounted.")
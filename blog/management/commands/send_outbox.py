@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from blog import notifications, outbox
+
+
+class Command(BaseCommand):
+    help = ("Send the emails waiting in the outbox, in batches over one SMTP connection per batch. "
+            "Every pass first queues the reply digests that are due.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="How many emails to send per SMTP connection.")
+        parser.add_argument('--loop', action='store_true', help="Keep polling the outbox instead of exiting once it's drained.")
+        parser.add_argument('--interval', type=float, default=5, help="Seconds to wait between polls of a drained outbox.")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            digests = notifications.queue_digests()
+            if digests:
+                self.stdout.write(f"Queued {digests} digest(s).")
+            sent, failed = outbox.send_pending(batch_size=options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f"Sent {sent} email(s), {failed} failed.")
+            elif options['loop']:
+                time.sleep(options['interval'])
+            else:
+                return
@@ -0,0 +1,29 @@
+'''
+The blog's Prometheus metrics, served by voila.metrics at /metrics.
+
+The page cache's hit ratio is
+rate(blog_page_cache_lookups_total{result="hit"}[5m]) / rate(blog_page_cache_lookups_total[5m]).
+
+The outbox is sent and the digests queued by the worker dyno, whose counters
+/metrics can't see. OutboxCollector reads them from the database instead, when
+/metrics is scraped, see settings.VOILA_METRICS_COLLECTORS.
+'''
+from django.db.models import Count
+from prometheus_client import Counter
+from prometheus_client.core import GaugeMetricFamily
+from .models import OutgoingEmail, ReplyNotification
+
+PAGE_CACHE_LOOKUPS = Counter('blog_page_cache_lookups', "Lookups of the blog's page cache.", ['result'])
+COMMENTS_WRITTEN = Counter('blog_comments_written', "Comments and replies posted.", ['kind'])
+
+
+class OutboxCollector:
+    def collect(self):
+        emails = GaugeMetricFamily('blog_outbox_emails', "Emails in the outbox, by status.", labels=['status'])
+        # an index only scan of blog_outgoingemail_due_idx
+        counts = dict(OutgoingEmail.objects.order_by().values_list('status').annotate(Count('id')))
+        for status, _ in OutgoingEmail.STATUS_CHOICES:
+            emails.add_metric([status], counts.get(status, 0))
+        yield emails
+        yield GaugeMetricFamily('blog_pending_notifications', "Replies waiting for their recipient's digest.",
+                                value=ReplyNotification.objects.count())
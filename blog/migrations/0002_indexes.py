@@ -0,0 +1,71 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:43
+#
+# Needs Django 3.2 or later: blog_category_name_upper_idx is an expression index,
+# models.Index(Upper('name')), which Django 3.0 can't declare. It can't be
+# migrated with the Django 3.0.3 of the commits before requirements.txt's upgrade.
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.functions.text
+
+
+def deduplicate_slugs(apps, schema_editor):
+    ''' Suffix every repeated slug with its post's id so slug can become unique '''
+    Post = apps.get_model('blog', 'Post')
+    duplicates = (Post.objects.values('slug')
+                              .exclude(slug=None)
+                              .annotate(count=models.Count('id'))
+                              .filter(count__gt=1)
+                              .values_list('slug', flat=True))
+    for slug in list(duplicates):
+        # the oldest post keeps its slug and its url
+        for post in Post.objects.filter(slug=slug).order_by('id')[1:]:
+            post.slug = f"{slug}-{post.id}"
+            post.save(update_fields=['slug'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-pub_date', '-id'], name='blog_post_pub_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created_on'], name='blog_comment_post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['parent_comment', 'created_on'], name='blog_comment_reply_created_idx'),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='parent_comment',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='blog.Comment'),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='post',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='blog.Post'),
+        ),
+        migrations.RunPython(deduplicate_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='post',
+            name='slug',
+            field=models.SlugField(null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='recipient',
+            name='recipient_email',
+            field=models.EmailField(db_index=True, max_length=254),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(django.db.models.functions.text.Upper('name'), name='blog_category_name_upper_idx'),
+        ),
+    ]
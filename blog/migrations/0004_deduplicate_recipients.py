@@ -0,0 +1,48 @@
+# Generated by Django 3.0.3 on 2026-10-18 17:46
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+from django.db.models.functions import Lower
+
+
+def collapse_duplicate_recipients(apps, schema_editor):
+    '''
+    Keep the oldest Recipient of every (lowercased) email, move the
+    subscriptions of its duplicates over to it and delete the duplicates.
+    '''
+    Recipient = apps.get_model('blog', 'Recipient')
+    Subscription = apps.get_model('blog', 'Comment').recipients.through
+    duplicated_emails = (Recipient.objects.annotate(email=Lower('recipient_email'))
+                                          .values('email')
+                                          .annotate(keeper_id=Min('id'), count=Count('id'))
+                                          .filter(count__gt=1)
+                                          .order_by())
+    for group in duplicated_emails.iterator():
+        duplicates = (Recipient.objects.annotate(email=Lower('recipient_email'))
+                                       .filter(email=group['email'])
+                                       .exclude(id=group['keeper_id']))
+        comment_ids = Subscription.objects.filter(recipient__in=duplicates).values_list('comment_id', flat=True)
+        Subscription.objects.bulk_create(
+            [Subscription(comment_id=comment_id, recipient_id=group['keeper_id']) for comment_id in set(comment_ids)],
+            ignore_conflicts=True,
+        )
+        Subscription.objects.filter(recipient__in=duplicates).delete()
+        Recipient.objects.filter(id__in=duplicates.values('id')).delete()
+    # every email left is unique regardless of its case, store it lowercased
+    Recipient.objects.exclude(recipient_email=Lower('recipient_email')).update(recipient_email=Lower('recipient_email'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0003_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.RunPython(collapse_duplicate_recipients, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='recipient',
+            name='recipient_email',
+            field=models.EmailField(max_length=254, unique=True),
+        ),
+    ]
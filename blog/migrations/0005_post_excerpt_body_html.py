@@ -0,0 +1,37 @@
+# Generated by Django 3.0.3 on 2026-10-18 17:52
+
+from django.db import migrations, models
+from blog.text import make_excerpt, render_body
+
+
+def backfill_excerpt_and_body_html(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    batch = []
+    for post in Post.objects.only('id', 'body').iterator(chunk_size=500):
+        post.excerpt, post.body_html = make_excerpt(post.body), render_body(post.body)
+        batch.append(post)
+        if len(batch) == 500:
+            Post.objects.bulk_update(batch, ['excerpt', 'body_html'])
+            batch = []
+    Post.objects.bulk_update(batch, ['excerpt', 'body_html'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_deduplicate_recipients'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='body_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=400),
+        ),
+        migrations.RunPython(backfill_excerpt_and_body_html, migrations.RunPython.noop),
+    ]
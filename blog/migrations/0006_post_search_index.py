@@ -0,0 +1,55 @@
+from django.db import migrations
+
+POSTGRESQL_FORWARDS = [
+    "ALTER TABLE blog_post ADD COLUMN search_vector tsvector",
+    """
+    CREATE FUNCTION blog_post_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := setweight(to_tsvector('pg_catalog.english', coalesce(NEW.title, '')), 'A') ||
+                             setweight(to_tsvector('pg_catalog.english', coalesce(NEW.body, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER blog_post_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, body ON blog_post
+    FOR EACH ROW EXECUTE PROCEDURE blog_post_search_vector_update()
+    """,
+    "UPDATE blog_post SET title = title",
+    "CREATE INDEX blog_post_search_vector_idx ON blog_post USING GIN (search_vector)",
+]
+POSTGRESQL_BACKWARDS = [
+    "DROP TRIGGER blog_post_search_vector_trigger ON blog_post",
+    "DROP FUNCTION blog_post_search_vector_update()",
+    "ALTER TABLE blog_post DROP COLUMN search_vector",
+]
+SQLITE_FORWARDS = [
+    "CREATE VIRTUAL TABLE blog_post_fts USING fts5(title, body, tokenize = 'porter unicode61')",
+    "INSERT INTO blog_post_fts (rowid, title, body) SELECT id, title, body FROM blog_post",
+]
+SQLITE_BACKWARDS = [
+    "DROP TABLE blog_post_fts",
+]
+
+
+def run(statements_by_vendor):
+    def operation(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+    ''' The full-text index behind blog.search, it isn't part of the Post model '''
+
+    dependencies = [
+        ('blog', '0005_post_excerpt_body_html'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'postgresql': POSTGRESQL_FORWARDS, 'sqlite': SQLITE_FORWARDS}),
+            run({'postgresql': POSTGRESQL_BACKWARDS, 'sqlite': SQLITE_BACKWARDS}),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.0.3 on 2026-10-18 17:57
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_updated_on(apps, schema_editor):
+    # the existing posts haven't been edited as far as anyone can tell
+    Post = apps.get_model('blog', 'Post')
+    Post.objects.update(updated_on=F('pub_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_post_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_updated_on, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:43
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_comments(apps, schema_editor):
+    # the same as blog.counters.recount(), with the models of this migration
+    Post = apps.get_model('blog', 'Post')
+    Comment = apps.get_model('blog', 'Comment')
+
+    def count(comments, post):
+        return Coalesce(Subquery(comments.order_by().values(post).annotate(count=Count('id')).values('count')), 0)
+
+    Post.objects.update(
+        comment_count=count(Comment.objects.filter(post=OuterRef('pk'), parent_comment=None), 'post'),
+        reply_count=count(Comment.objects.filter(parent_comment__post=OuterRef('pk')), 'parent_comment__post'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_post_updated_on'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_post_comment_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipient',
+            name='digest_frequency',
+            field=models.CharField(choices=[('immediate', 'An email per reply'), ('hourly', 'An hourly digest'), ('daily', 'A daily digest')], default='immediate', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='ReplyNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_notifications', to='blog.recipient')),
+                ('reply', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.comment')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='replynotification',
+            index=models.Index(fields=['recipient', 'created_on'], name='blog_replynotif_recipient_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:02
+
+from django.db import migrations, models
+from django.db.models import CharField, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Concat, LPad
+
+
+def fill_paths(apps, schema_editor):
+    # the same as blog.threads.fill_paths(), with the models of this migration
+    Comment = apps.get_model('blog', 'Comment')
+    own_segment = LPad(Cast('id', CharField()), 10, Value('0'))
+    Comment.objects.filter(parent_comment=None, path='').update(path=own_segment, depth=0)
+    parents = Comment.objects.filter(id=OuterRef('parent_comment_id'))
+    while True:
+        filled = (Comment.objects.filter(path='').exclude(parent_comment=None).exclude(parent_comment__path='')
+                                 .update(path=Concat(Subquery(parents.values('path')), own_segment),
+                                         depth=Subquery(parents.values('depth')) + 1,
+                                         post=Subquery(parents.values('post'))))
+        if not filled:
+            return
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_comment_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='blog_comment_post_path_idx'),
+        ),
+    ]
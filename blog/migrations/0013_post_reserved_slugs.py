@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:51
+
+import blog.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_outgoingemail_headers'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='slug',
+            field=models.SlugField(null=True, unique=True, validators=[blog.models.validate_slug_is_free]),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0013_post_reserved_slugs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-updated_on'], name='blog_post_updated_on_idx'),
+        ),
+    ]
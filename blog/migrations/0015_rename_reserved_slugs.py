@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:12
+
+from django.db import migrations
+
+# blog.models.RESERVED_SLUGS when this was written, the model's set may grow later
+RESERVED_SLUGS = {'search', 'sitemap.xml', 'feed', 'hashtag', 'unsubscribe', 'notifications'}
+
+
+def rename_reserved_slugs(apps, schema_editor):
+    ''' Suffix the slugs that blog/urls.py routes elsewhere with -post, the posts were unreachable at them '''
+    Post = apps.get_model('blog', 'Post')
+    for post in Post.objects.filter(slug__in=RESERVED_SLUGS).order_by('id'):
+        slug = f"{post.slug.replace('.', '-')}-post"
+        if Post.objects.filter(slug=slug).exists():
+            slug = f"{slug}-{post.id}"
+        post.slug = slug
+        post.save(update_fields=['slug'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0014_post_updated_on_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_reserved_slugs, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,94 @@
-from django.db import models
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.core.exceptions import ValidationError
+from django.core.mail import EmailMultiAlternatives
+from django.db import models, router, transaction
+from django.db.models.functions import Upper
 from django.urls import reverse
-  
+from django.utils import timezone
+from . import threads
+from .text import EXCERPT_LENGTH, make_excerpt, render_body
+
+# the ids of the posts being deleted, blog.signals doesn't uncount their comments one by one
+deleting_posts = ContextVar('deleting_posts', default=frozenset())
+
+@contextmanager
+def deleting(post_ids):
+    token = deleting_posts.set(deleting_posts.get() | set(post_ids))
+    try:
+        yield
+    finally:
+        deleting_posts.reset(token)
+
+# the blog's urls that come before <slug> in blog/urls.py, a post with one of these
+# slugs, or with a slug that starts one of their paths, would never be reached
+RESERVED_SLUGS = {'search', 'sitemap.xml', 'feed', 'hashtag', 'unsubscribe', 'notifications'}
+
+def validate_slug_is_free(slug):
+    if slug in RESERVED_SLUGS:
+        raise ValidationError("%(slug)s is the address of another page of the blog.", params={'slug': slug})
+
+class PostQuerySet(models.QuerySet):
+    def delete(self):
+        with deleting(self.values_list('id', flat=True)):
+            return super().delete()
+
 class Post(models.Model):
     title    = models.CharField(max_length=120)
     body     = models.TextField()
     pub_date = models.DateTimeField(auto_now_add=True)
+    updated_on = models.DateTimeField(auto_now=True)
     # each post has a set of categories 
     categories = models.ManyToManyField('Category',
                                          related_name= 'posts')
-    slug = models.SlugField(null=True)
+    slug = models.SlugField(null=True, unique=True, validators=[validate_slug_is_free])
+    # computed from body on save so that pages don't have to load or render the whole body
+    excerpt = models.CharField(max_length=EXCERPT_LENGTH, blank=True, editable=False)
+    body_html = models.TextField(blank=True, editable=False)
+    # kept up to date by blog.signals so that pages don't have to count the comments, see blog.counters
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    reply_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # the listings are ordered newest first and paged by (pub_date, id)
+            models.Index(fields=['-pub_date', '-id'], name='blog_post_pub_date_id_idx'),
+            # the listings' Last-Modified is the newest updated_on, on every request
+            models.Index(fields=['-updated_on'], name='blog_post_updated_on_idx'),
+        ]
 
     def __str__(self):
         return self.slug
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        post = super().from_db(db, field_names, values)
+        # the body excerpt and body_html were rendered from, unless it was deferred
+        post._rendered_body = values[field_names.index('body')] if 'body' in field_names else None
+        return post
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            body_changed = 'body' in update_fields
+        else:
+            # a deferred body is left alone by save(), and isn't loaded to find that out
+            body_changed = 'body' not in self.get_deferred_fields() and self.body != getattr(self, '_rendered_body', None)
+        if body_changed:
+            self.excerpt, self.body_html = make_excerpt(self.body), render_body(self.body)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'excerpt', 'body_html'}
+        super().save(*args, **kwargs)
+        if body_changed:
+            self._rendered_body = self.body
+
+    def delete(self, *args, **kwargs):
+        # the comments are deleted first, before the post's own pre_delete is sent
+        with deleting([self.id]):
+            return super().delete(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse('blog:post_detail_view', kwargs={'slug': self.slug})    
 
@@ -20,9 +96,11 @@ class Comment(models.Model):
     name  = models.CharField(max_length=60)
     email = models.EmailField()
     comment  = models.TextField()
-    # each comment has a post object which it belogs to.
+    # each comment has a post object which it belogs to,
+    # the replies too, at any depth, they belong to their thread's post
     post = models.ForeignKey('Post', 
                               null=True, 
+                              db_index=False,
                               on_delete=models.CASCADE)                         
     created_on = models.DateTimeField(auto_now_add=True)
     # when it's a reply parent_comment must hold the parent comment's id,
@@ -31,28 +109,127 @@ class Comment(models.Model):
                                         null=True, 
                                         blank=True, 
                                         related_name='replies', 
+                                        db_index=False,
                                         on_delete=models.CASCADE,)
     # each comment has a list of recipients so when someone one comments on a post.
     # they get added to the recipients list so that they get notified,
     # when someone replies to thier comment,
     recipients = models.ManyToManyField('Recipient', 
                                         related_name= 'comments',) 
+    # the ids from the thread's top-level comment down to this one, see blog.threads
+    path = models.CharField(max_length=255, blank=True, editable=False)
+    # 0 for a comment, 1 for a reply to it, 2 for a reply to that reply...
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ('created_on',)
+        # these cover the post and parent_comment foreign keys on their own,
+        # and the comments/replies of one post are always read in created_on order
+        indexes = [
+            models.Index(fields=['post', 'created_on'], name='blog_comment_post_created_idx'),
+            models.Index(fields=['parent_comment', 'created_on'], name='blog_comment_reply_created_idx'),
+            # the admin's changelist: newest first, its date hierarchy and its search by email
+            models.Index(fields=['created_on', 'id'], name='blog_comment_created_id_idx'),
+            models.Index(fields=['email'], name='blog_comment_email_idx'),
+            # a post's threads, depth first
+            models.Index(fields=['post', 'path'], name='blog_comment_post_path_idx'),
+        ]
      
     def __str__(self):
         return self.comment
 
+    def save(self, *args, **kwargs):
+        if self.parent_comment_id and not self.post_id:
+            self.post_id = self.parent_comment.post_id
+        if self.path:
+            return super().save(*args, **kwargs)
+        using = kwargs.get('using') or router.db_for_write(Comment, instance=self)
+        with transaction.atomic(using=using):
+            if self.id is None:
+                # the path ends with the id, taking it first lets the INSERT write the path
+                self.id = threads.next_id(Comment, using)
+                if self.id is not None:
+                    kwargs['force_insert'] = True
+            if self.id is not None:
+                self.fill_path()
+                return super().save(*args, **kwargs)
+            # a database without a sequence to take the id from
+            super().save(*args, **kwargs)
+            self.fill_path()
+            Comment.objects.using(using).filter(id=self.id).update(path=self.path, depth=self.depth)
+
+    def fill_path(self):
+        parent_path = self.parent_comment.path if self.parent_comment_id else ''
+        self.path = parent_path + threads.segment(self.id)
+        self.depth = self.parent_comment.depth + 1 if self.parent_comment_id else 0
+
+    @property
+    def can_be_replied_to(self):
+        return self.depth < threads.MAX_DEPTH
+
+class RecipientManager(models.Manager):
+    def subscribe(self, comment, email):
+        ''' Add email to the comment's recipients, it's a no-op if it's already there '''
+        recipient, _ = self.get_or_create(recipient_email=email.lower())
+        Comment.recipients.through.objects.bulk_create(
+            [Comment.recipients.through(comment_id=comment.id, recipient_id=recipient.id)],
+            ignore_conflicts=True,
+        )
+        return recipient
+
+    def unsubscribe(self, email, comment_id=None):
+        '''
+        Remove email from the recipients of one comment, or of every comment when comment_id is None.
+        Return whether it was subscribed.
+        '''
+        if comment_id is None:
+            deleted, _ = self.filter(recipient_email=email.lower()).delete()
+        else:
+            deleted, _ = Comment.recipients.through.objects.filter(comment_id=comment_id,
+                                                                   recipient__recipient_email=email.lower()).delete()
+            # and the replies to it that are waiting for their digest
+            ReplyNotification.objects.filter(recipient__recipient_email=email.lower(),
+                                             reply__parent_comment_id=comment_id).delete()
+        return bool(deleted)
+
 class Recipient(models.Model):
-    recipient_email = models.EmailField()
+    IMMEDIATE, HOURLY, DAILY = 'immediate', 'hourly', 'daily'
+    DIGEST_CHOICES = ((IMMEDIATE, 'An email per reply'), (HOURLY, 'An hourly digest'), (DAILY, 'A daily digest'))
+
+    # one row per (lowercased) email, shared by every comment it's subscribed to
+    recipient_email = models.EmailField(unique=True)
+    # how the replies to their comments are emailed, see blog.notifications
+    digest_frequency = models.CharField(max_length=10, choices=DIGEST_CHOICES, default=IMMEDIATE)
+
+    objects = RecipientManager()
 
     def __str__(self):
         return self.recipient_email
 
+class ReplyNotification(models.Model):
+    ''' A reply that a recipient gets in their next digest, it's deleted once the digest is queued '''
+    recipient = models.ForeignKey(Recipient, related_name='pending_notifications', on_delete=models.CASCADE)
+    reply = models.ForeignKey(Comment, related_name='+', on_delete=models.CASCADE)
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # a digest is due once a recipient's oldest notification is older than their window
+            models.Index(fields=['recipient', 'created_on'], name='blog_replynotif_recipient_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.reply} for {self.recipient}"
+
 class Category(models.Model):
     name = models.CharField(max_length=60)
 
+    class Meta:
+        indexes = [
+            # the category pages look name up with iexact, which compares UPPER(name)
+            models.Index(Upper('name'), name='blog_category_name_upper_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -60,3 +237,38 @@ class Category(models.Model):
         return reverse('blog:category_index_view', kwargs={'category':self.name})    
   
 
+
+class OutgoingEmail(models.Model):
+    ''' An email waiting in the outbox until the send_outbox worker delivers it '''
+    PENDING, SENT, FAILED = 'pending', 'sent', 'failed'
+    STATUS_CHOICES = ((PENDING, 'Pending'), (SENT, 'Sent'), (FAILED, 'Failed'))
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.EmailField()
+    to = models.EmailField()
+    # extra headers, like the notifications' List-Unsubscribe
+    headers = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    created_on = models.DateTimeField(auto_now_add=True)
+    # when it's due, it's pushed back after every failed attempt
+    send_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    sent_on = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # the worker only ever asks for the pending emails that are due
+            models.Index(fields=['status', 'send_after'], name='blog_outgoingemail_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {self.to}"
+
+    def as_email_message(self):
+        message = EmailMultiAlternatives(self.subject, self.body, self.from_email, [self.to], headers=self.headers)
+        if self.html_body:
+            message.attach_alternative(self.html_body, "text/html")
+        return message
@@ -0,0 +1,100 @@
+'''
+The emails that tell commenters someone replied to them.
+
+A recipient gets an email per reply, or opts into an hourly or daily digest
+with the links in those emails. A reply to a digest recipient is kept as a
+ReplyNotification, and queue_digests, which the send_outbox worker runs on
+every pass, turns all of a recipient's notifications into one email once the
+oldest of them is older than their window. So nobody gets more than one
+digest per window, and a quiet recipient isn't sent empty ones.
+'''
+from datetime import timedelta
+from itertools import groupby
+from operator import attrgetter
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min, Q
+from django.template import loader
+from django.urls import reverse
+from django.utils import timezone
+from . import outbox
+from .models import OutgoingEmail, Recipient, ReplyNotification
+from .tokens import make_digest_token, make_unsubscribe_token
+
+# how long a recipient's notifications wait for more, the ones left behind
+# by someone who went back to an email per reply are sent right away
+DIGEST_WINDOWS = {
+    Recipient.IMMEDIATE: timedelta(0),
+    Recipient.HOURLY: timedelta(hours=1),
+    Recipient.DAILY: timedelta(days=1),
+}
+
+
+def reply_email(email, replies):
+    ''' Return an unsaved OutgoingEmail telling email about replies, a list of (reply, post) '''
+    html_template = loader.get_template('blog/email-template.html')
+    context = {
+        "replies": [{
+            "name": reply.name,
+            "post": post,
+            "reply_id": reply.id,
+            # every reply links to the unsubscribe of the comment it answers
+            "unsubscribe_token": make_unsubscribe_token(email, reply.parent_comment_id),
+        } for reply, post in replies],
+        "unsubscribe_all_token": make_unsubscribe_token(email),
+        "digest_token": make_digest_token(email),
+        "VOILA_HOST": settings.VOILA_HOST,
+    }
+    if len(replies) == 1:
+        subject, text_content = "A new reply from Voila", "Someone replied to your comment."
+    else:
+        subject, text_content = f"{len(replies)} new replies from Voila", f"{len(replies)} people replied to your comments."
+    # the mail client's own unsubscribe button, it POSTs to the link (RFC 8058)
+    unsubscribe_url = settings.VOILA_HOST + reverse('blog:one_click_unsubscribe_view',
+                                                    args=[context['unsubscribe_all_token']])
+    headers = {'List-Unsubscribe': f'<{unsubscribe_url}>', 'List-Unsubscribe-Post': 'List-Unsubscribe=One-Click'}
+    return OutgoingEmail(subject=subject, body=text_content, html_body=html_template.render(context),
+                         from_email=settings.MY_EMAIL, to=email, headers=headers)
+
+def notify_of_reply(recipients, reply, post):
+    ''' Queue an email for the recipients who want one per reply, and keep the reply for the others' digests '''
+    ReplyNotification.objects.bulk_create(ReplyNotification(recipient=recipient, reply=reply)
+                                          for recipient in recipients
+                                          if recipient.digest_frequency != Recipient.IMMEDIATE)
+    return outbox.enqueue(*[reply_email(recipient.recipient_email, [(reply, post)])
+                            for recipient in recipients
+                            if recipient.digest_frequency == Recipient.IMMEDIATE])
+
+def queue_digests(now=None):
+    ''' Put a digest in the outbox for every recipient whose window is over, return how many '''
+    now = now or timezone.now()
+    # the recipients whose oldest notification is past their window, grouped on the
+    # (recipient, created_on) index rather than going through every Recipient
+    due = Q()
+    for frequency, window in DIGEST_WINDOWS.items():
+        due |= Q(recipient__digest_frequency=frequency, oldest__lte=now - window)
+    due_ids = list(ReplyNotification.objects.values('recipient_id', 'recipient__digest_frequency')
+                                            .annotate(oldest=Min('created_on'))
+                                            .filter(due)
+                                            .values_list('recipient_id', flat=True))
+    if not due_ids:
+        return 0
+
+    with transaction.atomic():
+        # claim them, skipping the ones another worker has claimed, so that all of a
+        # recipient's notifications go in the same digest. A NO KEY lock doesn't hold
+        # up the replies adding notifications for them meanwhile.
+        recipients = {recipient.id: recipient for recipient in Recipient.objects.filter(id__in=due_ids)
+                                                                  .select_for_update(skip_locked=True, no_key=True)}
+        if not recipients:
+            return 0
+        # their notifications, with what their emails need, in one query
+        notifications = list(ReplyNotification.objects.filter(recipient_id__in=recipients)
+                                                      .select_related('reply__post')
+                                                      .order_by('recipient_id', 'created_on'))
+        emails = [reply_email(recipients[recipient_id].recipient_email,
+                              [(notification.reply, notification.reply.post) for notification in group])
+                  for recipient_id, group in groupby(notifications, key=attrgetter('recipient_id'))]
+        outbox.enqueue(*emails)
+        ReplyNotification.objects.filter(id__in=[notification.id for notification in notifications]).delete()
+    return len(emails)
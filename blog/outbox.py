@@ -0,0 +1,84 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+from django.utils import timezone
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(*emails):
+    '''
+    Put unsaved OutgoingEmail objects in the outbox with a single INSERT.
+
+    Call it inside the transaction that writes whatever the emails are about,
+    so that they're only sent if that write is committed.
+    '''
+    return OutgoingEmail.objects.bulk_create(emails)
+
+def send_pending(batch_size=100):
+    '''
+    Send up to batch_size due emails over one SMTP connection, return how many were sent and how many failed.
+
+    The batch is claimed first, in a transaction of its own: its send_after is
+    pushed settings.BLOG_OUTBOX_CLAIM_TIMEOUT ahead, so the other workers skip
+    it, and no row stays locked while the SMTP server is talked to. Each email
+    is then marked sent or failed as soon as it's through. A worker that dies
+    mid-batch only leaves the emails it hadn't sent yet, and they're due again
+    once the claim runs out.
+
+    A failed email is retried later with an exponential backoff, and marked
+    as failed once it has used up settings.BLOG_OUTBOX_MAX_ATTEMPTS.
+    '''
+    max_attempts = getattr(settings, 'BLOG_OUTBOX_MAX_ATTEMPTS', 5)
+    retry_delay = getattr(settings, 'BLOG_OUTBOX_RETRY_DELAY', 60)
+    batch = claim(batch_size, getattr(settings, 'BLOG_OUTBOX_CLAIM_TIMEOUT', 10 * 60))
+    if not batch:
+        return 0, 0
+
+    sent = 0
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as error:
+        # the mail server is unreachable, the whole batch has to wait for the next attempt
+        for email in batch:
+            record_failure(email, error, max_attempts, retry_delay)
+        return 0, len(batch)
+    try:
+        for email in batch:
+            try:
+                connection.send_messages([email.as_email_message()])
+            except Exception as error:
+                record_failure(email, error, max_attempts, retry_delay)
+            else:
+                email.attempts += 1
+                email.status, email.sent_on, email.last_error = OutgoingEmail.SENT, timezone.now(), ""
+                email.save(update_fields=['status', 'attempts', 'sent_on', 'last_error'])
+                sent += 1
+    finally:
+        connection.close()
+    return sent, len(batch) - sent
+
+def claim(batch_size, timeout):
+    ''' Return up to batch_size due emails, pushed timeout seconds ahead so that no other worker sends them meanwhile '''
+    with transaction.atomic():
+        # skip the rows another worker is claiming right now
+        batch = list(OutgoingEmail.objects.select_for_update(skip_locked=True)
+                                          .filter(status=OutgoingEmail.PENDING, send_after__lte=timezone.now())
+                                          .order_by('send_after')[:batch_size])
+        OutgoingEmail.objects.filter(id__in=[email.id for email in batch]).update(
+            send_after=timezone.now() + timedelta(seconds=timeout))
+    return batch
+
+def record_failure(email, error, max_attempts, retry_delay):
+    email.attempts += 1
+    email.last_error = str(error)
+    logger.warning("Sending outbox email %s failed (attempt %s): %s", email.id, email.attempts, error)
+    if email.attempts >= max_attempts:
+        email.status = OutgoingEmail.FAILED
+    else:
+        email.send_after = timezone.now() + timedelta(seconds=retry_delay * 2 ** (email.attempts - 1))
+    email.save(update_fields=['status', 'attempts', 'send_after', 'last_error'])
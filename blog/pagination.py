@@ -0,0 +1,134 @@
+import base64
+import binascii
+import json
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(obj, field='pub_date'):
+    ''' Return an opaque, url safe cursor that points at obj's (pub_date, id), or (<field>, id) '''
+    return encode_key(getattr(obj, field), obj.id)
+
+def encode_key(date, pk):
+    ''' Return the cursor that points at (date, pk), which needn't be a row's '''
+    key = f"{date.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    ''' Return the (date, id) pair a cursor points at, raise ValueError if it's malformed '''
+    try:
+        key = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        pub_date, post_id = key.split("|")
+        pub_date, post_id = parse_datetime(pub_date), int(post_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    if pub_date is None:
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return pub_date, post_id
+
+def page_after(queryset, field, cursor, page_size):
+    ''' Return the page_size rows after cursor in (<field>, id) order, and whether there are more of them '''
+    if cursor:
+        value, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': pk}))
+    rows = list(queryset.order_by(field, 'id')[:page_size + 1])
+    return rows[:page_size], len(rows) > page_size
+
+
+class KeysetPage:
+    ''' A page of posts that knows the cursors of its neighbours instead of its number '''
+    is_keyset = True
+
+    def __init__(self, object_list, has_newer, has_older):
+        self.object_list = object_list
+        self.has_newer, self.has_older = has_newer, has_older
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_newer or self.has_older
+
+    @property
+    def newer_cursor(self):
+        return encode_cursor(self.object_list[0]) if self.has_newer else None
+
+    @property
+    def older_cursor(self):
+        return encode_cursor(self.object_list[-1]) if self.has_older else None
+
+
+class KeysetPaginationMixin:
+    '''
+    Let a ListView of posts page through (pub_date, id) cursors instead of OFFSET.
+
+    It's opt-in through settings.BLOG_KEYSET_PAGINATION. A page never counts the
+    whole queryset, so the 1000th page costs the same as the first one.
+    '''
+    newer_kwarg, older_kwarg = 'newer', 'older'
+
+    def paginate_queryset(self, queryset, page_size):
+        if not getattr(settings, 'BLOG_KEYSET_PAGINATION', False):
+            return super().paginate_queryset(queryset, page_size)
+
+        newer = self.request.GET.get(self.newer_kwarg)
+        older = self.request.GET.get(self.older_kwarg)
+        try:
+            if newer:
+                pub_date, post_id = decode_cursor(newer)
+                # walk forward in time from the cursor then flip the rows back to newest first
+                posts = list(queryset.filter(Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, id__gt=post_id))
+                                     .order_by('pub_date', 'id')[:page_size + 1])
+                has_newer, has_older = len(posts) > page_size, True
+                posts = posts[:page_size][::-1]
+            else:
+                if older:
+                    pub_date, post_id = decode_cursor(older)
+                    queryset = queryset.filter(Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=post_id))
+                posts = list(queryset.order_by('-pub_date', '-id')[:page_size + 1])
+                has_newer, has_older = bool(older), len(posts) > page_size
+                posts = posts[:page_size]
+        except ValueError:
+            raise Http404("Invalid page.")
+
+        page = KeysetPage(posts, has_newer=has_newer and bool(posts), has_older=has_older and bool(posts))
+        return (None, page, page.object_list, page.has_other_pages())
+
+
+class EstimatedCountPaginator(Paginator):
+    '''
+    A Paginator for the admin's changelists of big tables that doesn't COUNT(*) them.
+
+    On PostgreSQL it takes the planner's estimate of the queryset's rows, and only
+    counts them when that's under exact_count_limit. The number of pages of a
+    huge changelist can be a bit off, the rows on them never are.
+    '''
+    exact_count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            estimate = self.estimate_count(queryset, connection)
+            if estimate >= self.exact_count_limit:
+                return estimate
+        return super().count
+
+    def estimate_count(self, queryset, connection):
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        # psycopg2 decodes the json column on its own
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
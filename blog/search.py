@@ -0,0 +1,70 @@
+'''
+Full-text search over the posts' titles and bodies.
+
+On PostgreSQL the blog_post.search_vector tsvector column is kept up to date
+by a trigger and indexed with GIN. Local SQLite databases use an FTS5 table,
+blog_post_fts, that the Post signal handlers keep in sync instead, because
+SQLite drops a table's triggers whenever a migration rebuilds it.
+'''
+import re
+from django.db import connections, router
+from django.db.models.expressions import RawSQL
+from .models import Post
+
+
+def search_posts(query):
+    ''' Return the posts that match query, the best matches first '''
+    if connections[router.db_for_read(Post)].vendor == 'postgresql':
+        # psycopg2 is only installed where PostgreSQL is used
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+        # the column isn't a model field, the trigger fills it
+        vector = RawSQL('blog_post.search_vector', [], output_field=SearchVectorField())
+        search_query = SearchQuery(query, config='pg_catalog.english')
+        return (Post.objects.alias(search_vector=vector)
+                            .filter(search_vector=search_query)
+                            .annotate(rank=SearchRank(vector, search_query))
+                            .order_by('-rank', '-pub_date', '-id'))
+
+    match = fts5_query(query)
+    if not match:
+        return Post.objects.none()
+    # bm25() is lower for better matches and titles weigh more than bodies
+    rank = RawSQL("SELECT -bm25(blog_post_fts, 4.0, 1.0) FROM blog_post_fts "
+                  "WHERE blog_post_fts MATCH %s AND blog_post_fts.rowid = blog_post.id", (match,))
+    return (Post.objects.filter(id__in=RawSQL("SELECT rowid FROM blog_post_fts WHERE blog_post_fts MATCH %s", (match,)))
+                        .annotate(rank=rank)
+                        .order_by('-rank', '-pub_date', '-id'))
+
+def fts5_query(query):
+    ''' Quote every word of query so FTS5 doesn't parse the user's input as its query syntax '''
+    return " ".join('"%s"' % word for word in re.findall(r"\w+", query))
+
+def index_connection():
+    ''' The connection of the database the posts are written to, where their index is '''
+    return connections[router.db_for_write(Post)]
+
+def index_post(post):
+    ''' Replace post's row in the FTS5 table, PostgreSQL's trigger does it on its own '''
+    connection = index_connection()
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM blog_post_fts WHERE rowid = %s", [post.id])
+            cursor.execute("INSERT INTO blog_post_fts (rowid, title, body) VALUES (%s, %s, %s)",
+                           [post.id, post.title, post.body])
+
+def unindex_post(post_id):
+    connection = index_connection()
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM blog_post_fts WHERE rowid = %s", [post_id])
+
+def rebuild_index():
+    ''' Reindex every post, for posts written without going through Post.save() '''
+    connection = index_connection()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # setting title to itself fires the trigger
+            cursor.execute("UPDATE blog_post SET title = title")
+        else:
+            cursor.execute("DELETE FROM blog_post_fts")
+            cursor.execute("INSERT INTO blog_post_fts (rowid, title, body) SELECT id, title, body FROM blog_post")
@@ -0,0 +1,135 @@
+'''
+Keep the search index and the comment counts in sync with the posts and
+comments, and invalidate the cached blog pages that a write makes stale, and
+only those:
+
+- a post busts the listings, its own page and the hashtag pages of its categories
+- a comment or reply busts the page of the post it's on, and also the index
+  and the hashtag pages of that post's categories, see below
+- a category busts its hashtag pages and the pages of the posts it's on,
+  which show its name
+
+A comment busts more than its post's page on purpose: the listings show each
+post's comment count, which is rendered into their cached pages. The index
+and a few hashtag pages are rendered again after a comment, rather than
+filling the counts in on every cache hit, which would cost a query per hit
+and leave the listings' ETag unchanged when a comment is deleted.
+
+The versions are bumped once the write is committed. Bumped before that, a
+page rendered from the old rows in the meantime would be cached under the
+new versions and outlive the write.
+'''
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete, m2m_changed
+from django.dispatch import receiver
+from . import cache, counters, search
+from .models import Post, Comment, Category, deleting_posts
+
+
+def invalidate(*scopes):
+    # the scopes are worked out now, the rows they're read from may be gone after the commit
+    transaction.on_commit(lambda: cache.invalidate(*scopes))
+
+def post_scopes(slugs):
+    return [cache.post_scope(slug) for slug in slugs if slug]
+
+def category_scopes(names):
+    return [cache.category_scope(name) for name in names]
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Category)
+def remember_previous_name(sender, instance, **kwargs):
+    ''' Keep the slug/name the instance is saved over, the page at the old url is stale too '''
+    field = 'slug' if sender is Post else 'name'
+    instance._previous_name = (sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+                               if instance.pk else None)
+
+@receiver(pre_delete, sender=Post)
+@receiver(pre_delete, sender=Category)
+def remember_related(sender, instance, **kwargs):
+    # the links between posts and categories are gone by the time post_delete is sent
+    if sender is Post:
+        instance._category_names = list(instance.categories.values_list('name', flat=True))
+    else:
+        instance._post_slugs = list(instance.posts.values_list('slug', flat=True))
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post(sender, instance, **kwargs):
+    names = getattr(instance, '_category_names', None)
+    if names is None:
+        names = instance.categories.values_list('name', flat=True) if instance.pk else []
+    invalidate(cache.INDEX,
+               *post_scopes({instance.slug, getattr(instance, '_previous_name', None)}),
+               *category_scopes(names))
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    slugs = getattr(instance, '_post_slugs', None)
+    if slugs is None:
+        slugs = [] if kwargs.get('created') else instance.posts.values_list('slug', flat=True)
+    names = {instance.name, getattr(instance, '_previous_name', None) or instance.name}
+    invalidate(cache.INDEX, *category_scopes(names), *post_scopes(slugs))
+
+@receiver(m2m_changed, sender=Post.categories.through)
+def invalidate_post_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # pk_set is None on clear, remember what's about to be cleared
+        related = instance.posts if reverse else instance.categories
+        instance._cleared_ids = set(related.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    ids = pk_set if action != 'post_clear' else getattr(instance, '_cleared_ids', set())
+    if reverse:
+        # category.posts.add(...), the instance is the category
+        slugs = Post.objects.filter(id__in=ids).values_list('slug', flat=True)
+        names = [instance.name]
+    else:
+        slugs = [instance.slug]
+        names = Category.objects.filter(id__in=ids).values_list('name', flat=True)
+    invalidate(cache.INDEX, *post_scopes(slugs), *category_scopes(names))
+
+def comment_post_id(comment):
+    ''' The post a comment is on, a reply is on its parent comment's post '''
+    if comment.post_id:
+        return comment.post_id
+    return Comment.objects.filter(id=comment.parent_comment_id).values_list('post_id', flat=True).first()
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        instance._post_id = comment_post_id(instance)
+        counters.add(instance._post_id, instance, 1)
+
+@receiver(pre_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    # a reply's parent may be deleted along with it, by the time post_delete is sent it's gone
+    instance._post_id = comment_post_id(instance)
+    if instance._post_id not in deleting_posts.get():
+        counters.add(instance._post_id, instance, -1)
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment(sender, instance, **kwargs):
+    post_id = getattr(instance, '_post_id', None) or comment_post_id(instance)
+    if post_id in deleting_posts.get():
+        # the post's own invalidate_post() busts its pages and listings
+        return
+    if Comment.post.is_cached(instance):
+        # the comment form's view already has the post
+        slugs = [instance.post.slug]
+    else:
+        slugs = Post.objects.filter(id=post_id).values_list('slug', flat=True)
+    # the listings show the comment counts of their posts, they're stale too, see the module's docstring
+    names = Category.objects.filter(posts__id=post_id).values_list('name', flat=True)
+    invalidate(cache.INDEX, *post_scopes(slugs), *category_scopes(names))
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    search.index_post(instance)
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.unindex_post(instance.id)
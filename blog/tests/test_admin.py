@@ -0,0 +1,84 @@
+from unittest import mock
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from blog.models import Post, Comment, Recipient
+from blog.pagination import EstimatedCountPaginator
+
+class TestCommentAdmin(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("admin", "admin@email.com", "password")
+        cls.post = Post.objects.create(title="A Post", body="I am a post about admin pages.", slug="a-post")
+        cls.comment = Comment.objects.create(name="Someone", email="someone@email.com", comment="I am a comment.",
+                                             post=cls.post)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def add_comments(self, count):
+        comments = Comment.objects.bulk_create(Comment(name=f"Person {i}", email=f"person{i}@email.com",
+                                                       comment="I am a comment.", post=self.post) for i in range(count))
+        Recipient.objects.bulk_create(Recipient(recipient_email=f"person{i}@email.com") for i in range(count))
+        return comments
+
+    def count_queries(self, url):
+        # the first request caches the content types
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_change_form_does_not_list_every_comment_and_recipient(self):
+        url = reverse('admin:blog_comment_change', args=[self.comment.id])
+        before = self.count_queries(url)
+        self.add_comments(50)
+        response = self.client.get(url)
+        self.assertNotContains(response, "Person 1")
+        self.assertNotContains(response, "person1@email.com")
+        self.assertNotContains(response, '<select name="parent_comment"')
+        self.assertEqual(self.count_queries(url), before)
+
+    def test_changelist_queries_do_not_depend_on_the_number_of_comments(self):
+        url = reverse('admin:blog_comment_changelist')
+        before = self.count_queries(url)
+        self.add_comments(50)
+        self.assertEqual(self.count_queries(url), before)
+
+    def test_search_by_exact_email(self):
+        self.add_comments(3)
+        response = self.client.get(reverse('admin:blog_comment_changelist'), {'q': "person1@email.com"})
+        self.assertEqual([comment.email for comment in response.context['cl'].result_list], ["person1@email.com"])
+        response = self.client.get(reverse('admin:blog_comment_changelist'), {'q': "person"})
+        self.assertEqual(len(response.context['cl'].result_list), 0)
+
+    def test_post_autocomplete_searches_the_full_text_index(self):
+        Post.objects.create(title="Another Post", body="I am about something else.", slug="another-post")
+        response = self.client.get(reverse('admin:autocomplete'), {'term': "admin", 'app_label': 'blog',
+                                                                  'model_name': 'comment', 'field_name': 'post'})
+        self.assertEqual([result['id'] for result in response.json()['results']], [str(self.post.id)])
+
+
+class TestEstimatedCountPaginator(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Post.objects.bulk_create(Post(title=f"Post {i}", body="I am a post.", slug=f"post-{i}") for i in range(3))
+
+    def test_counts_without_an_estimate(self):
+        paginator = EstimatedCountPaginator(Post.objects.order_by('id'), 2)
+        self.assertEqual(paginator.count, 3)
+
+    def test_uses_postgresqls_estimate_for_big_querysets(self):
+        paginator = EstimatedCountPaginator(Post.objects.order_by('id'), 2)
+        with mock.patch.object(connection, 'vendor', 'postgresql'), \
+             mock.patch.object(EstimatedCountPaginator, 'estimate_count', return_value=1000000):
+            self.assertEqual(paginator.count, 1000000)
+
+    def test_counts_small_querysets_on_postgresql(self):
+        paginator = EstimatedCountPaginator(Post.objects.order_by('id'), 2)
+        with mock.patch.object(connection, 'vendor', 'postgresql'), \
+             mock.patch.object(EstimatedCountPaginator, 'estimate_count', return_value=4):
+            self.assertEqual(paginator.count, 3)
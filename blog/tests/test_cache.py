@@ -0,0 +1,207 @@
+import re
+from datetime import timedelta
+from django.core.cache import cache
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from blog import cache as page_cache
+from blog.models import Post, Category, Comment
+
+@override_settings(BLOG_CACHE_TIMEOUT=60 * 60)
+class TestPageCache(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.python = Category.objects.create(name="python")
+        cls.django = Category.objects.create(name="django")
+        cls.post = Post.objects.create(title="A Post", body="I am a post.", slug="a-post")
+        cls.post.categories.add(cls.python)
+        cls.another_post = Post.objects.create(title="Another Post", body="I am another post.", slug="another-post")
+        cls.another_post.categories.add(cls.django)
+        cls.comment = Comment.objects.create(name="Person", email="person@email.com", comment="I am a comment", post=cls.post)
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, url, client=None):
+        response = (client or self.client).get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['X-Cache']
+
+    def warm_up(self, *urls):
+        for url in urls:
+            self.get(url)
+            self.assertEqual(self.get(url), 'HIT')
+
+    def test_listing_pages_are_served_from_the_cache(self):
+        self.assertEqual(self.get(reverse('blog:index_view')), 'MISS')
+        self.assertEqual(self.get(reverse('blog:index_view')), 'HIT')
+        self.assertEqual(self.get(self.python.get_absolute_url()), 'MISS')
+        self.assertEqual(self.get(self.python.get_absolute_url()), 'HIT')
+        self.assertEqual(page_cache.get_stats(), {'hits': 2, 'misses': 2, 'hit_ratio': 0.5})
+
+    def test_cached_pages_must_be_revalidated_by_browsers(self):
+        self.get(reverse('blog:index_view'))
+        response = self.client.get(reverse('blog:index_view'))
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertIn('max-age=0', response['Cache-Control'])
+        self.assertFalse(response.has_header('Expires'))
+
+    def test_a_new_post_busts_the_listings(self):
+        self.warm_up(reverse('blog:index_view'), self.python.get_absolute_url(), self.django.get_absolute_url())
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(title="A New Post", body="I am new.", slug="a-new-post").categories.add(self.python)
+        self.assertEqual(self.get(reverse('blog:index_view')), 'MISS')
+        self.assertEqual(self.get(self.python.get_absolute_url()), 'MISS')
+        self.assertEqual(self.get(self.django.get_absolute_url()), 'HIT')
+
+    def test_a_new_comment_also_busts_the_listings_because_they_show_its_count(self):
+        self.warm_up(self.post.get_absolute_url(), self.another_post.get_absolute_url(), reverse('blog:index_view'),
+                     self.python.get_absolute_url(), self.django.get_absolute_url())
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(name="Someone", email="someone@email.com", comment="I am new", post=self.post)
+        self.assertEqual(self.get(self.post.get_absolute_url()), 'MISS')
+        self.assertEqual(self.get(reverse('blog:index_view')), 'MISS')
+        self.assertEqual(self.get(self.python.get_absolute_url()), 'MISS')
+        self.assertEqual(self.get(self.another_post.get_absolute_url()), 'HIT')
+        self.assertEqual(self.get(self.django.get_absolute_url()), 'HIT')
+
+    def test_a_new_reply_busts_its_post_page(self):
+        self.warm_up(self.post.get_absolute_url())
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(name="Someone", email="someone@email.com", comment="I am a reply",
+                                   parent_comment=self.comment)
+        self.assertEqual(self.get(self.post.get_absolute_url()), 'MISS')
+
+    def test_pages_are_busted_once_the_write_is_committed(self):
+        self.warm_up(self.post.get_absolute_url())
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(name="Someone", email="someone@email.com", comment="I am new", post=self.post)
+            # a page rendered before the commit would be cached under the new version
+            self.assertEqual(self.get(self.post.get_absolute_url()), 'HIT')
+        self.assertEqual(self.get(self.post.get_absolute_url()), 'MISS')
+
+    def test_a_category_edit_busts_its_hashtag_pages_only(self):
+        self.warm_up(self.python.get_absolute_url(), self.django.get_absolute_url(), self.another_post.get_absolute_url())
+        python = Category.objects.get(id=self.python.id)
+        python.name = "python3"
+        with self.captureOnCommitCallbacks(execute=True):
+            python.save()
+        self.assertEqual(self.get(self.python.get_absolute_url()), 'MISS')
+        self.assertEqual(self.get(python.get_absolute_url()), 'MISS')
+        self.assertEqual(self.get(self.django.get_absolute_url()), 'HIT')
+        self.assertEqual(self.get(self.another_post.get_absolute_url()), 'HIT')
+
+    def test_removing_a_category_from_a_post_busts_both_pages(self):
+        self.warm_up(self.python.get_absolute_url(), self.post.get_absolute_url(), self.another_post.get_absolute_url())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.categories.remove(self.python)
+        self.assertEqual(self.get(self.python.get_absolute_url()), 'MISS')
+        self.assertEqual(self.get(self.post.get_absolute_url()), 'MISS')
+        self.assertEqual(self.get(self.another_post.get_absolute_url()), 'HIT')
+
+    def test_a_post_page_is_shared_between_visitors_with_their_own_csrf_tokens(self):
+        url = self.post.get_absolute_url()
+        self.assertEqual(self.get(url, Client(HTTP_COOKIE='_ga=GA1.1.1')), 'MISS')
+        visitor = Client(enforce_csrf_checks=True)
+        response = visitor.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertNotContains(response, page_cache.CSRF_TOKEN_PLACEHOLDER)
+        token = re.search(r'name="csrfmiddlewaretoken" value="(\w+)"', response.content.decode())[1]
+        response = visitor.post(url, {'name': "Someone", 'email': "someone@email.com", 'comment': "I am new",
+                                      'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 302)
+
+class TestConditionalGet(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.python = Category.objects.create(name="python")
+        cls.post = Post.objects.create(title="A Post", body="I am a post.", slug="a-post")
+        cls.post.categories.add(cls.python)
+        cls.comment = Comment.objects.create(name="Person", email="person@email.com", comment="I am a comment", post=cls.post)
+
+    def setUp(self):
+        cache.clear()
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_pages_send_validators(self):
+        for url in (reverse('blog:index_view'), self.python.get_absolute_url(), self.post.get_absolute_url()):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.has_header('ETag'))
+            self.assertTrue(response.has_header('Last-Modified'))
+
+    def test_an_unchanged_post_is_not_rendered_again(self):
+        url = self.post.get_absolute_url()
+        response = self.client.get(url)
+        # only the validators' query, no post, no comments and no template
+        with self.assertNumQueries(1):
+            response = self.revalidate(url, response)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response.templates, [])
+
+    def test_unchanged_listings_are_not_rendered_again(self):
+        for url in (reverse('blog:index_view'), self.python.get_absolute_url()):
+            response = self.client.get(url)
+            # only the validators' query, no posts, no counts and no template
+            with self.assertNumQueries(1):
+                response = self.revalidate(url, response)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.templates, [])
+
+    def test_if_modified_since_is_honoured(self):
+        url = self.post.get_absolute_url()
+        response = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_new_comments_and_replies_change_the_post_validators(self):
+        url = self.post.get_absolute_url()
+        response = self.client.get(url)
+        Comment.objects.create(name="Someone", email="someone@email.com", comment="I am new", post=self.post)
+        fresh = self.revalidate(url, response)
+        self.assertEqual(fresh.status_code, 200)
+        Comment.objects.create(name="Someone", email="someone@email.com", comment="I am a reply", parent_comment=self.comment)
+        self.assertEqual(self.revalidate(url, fresh).status_code, 200)
+
+    def test_a_deleted_comment_changes_the_post_etag(self):
+        url = self.post.get_absolute_url()
+        response = self.client.get(url)
+        Comment.objects.get(id=self.comment.id).delete()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_a_new_post_changes_the_listings_validators(self):
+        index, hashtag = reverse('blog:index_view'), self.python.get_absolute_url()
+        responses = self.client.get(index), self.client.get(hashtag)
+        Post.objects.create(title="A New Post", body="I am new.", slug="a-new-post").categories.add(self.python)
+        self.assertEqual(self.revalidate(index, responses[0]).status_code, 200)
+        self.assertEqual(self.revalidate(hashtag, responses[1]).status_code, 200)
+
+    def test_an_edited_post_changes_the_listing_etag(self):
+        index = reverse('blog:index_view')
+        response = self.client.get(index)
+        post = Post.objects.get(id=self.post.id)
+        post.title = "An Edited Post"
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        self.assertEqual(self.revalidate(index, response).status_code, 200)
+
+    def test_edits_and_comments_change_the_listings_last_modified(self):
+        urls = reverse('blog:index_view'), self.python.get_absolute_url()
+        responses = [self.client.get(url) for url in urls]
+        # Last-Modified is to the second, the edit and the comment are a minute apart
+        Post.objects.filter(id=self.post.id).update(updated_on=timezone.now() + timedelta(minutes=1))
+        responses = [self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                     for url, response in zip(urls, responses)]
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        comment = Comment.objects.create(name="Someone", email="someone@email.com", comment="I am new", post=self.post)
+        Comment.objects.filter(id=comment.id).update(created_on=timezone.now() + timedelta(minutes=2))
+        responses = [self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                     for url, response in zip(urls, responses)]
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+
+    def test_an_unknown_post_is_still_404(self):
+        response = self.client.get(reverse('blog:post_detail_view', kwargs={'slug': 'no-such-post'}))
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,213 @@
+from io import StringIO
+from datetime import timedelta
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from blog import benchmarks, notifications, outbox, search
+from blog.models import OutgoingEmail, Post, Category, Comment, Recipient, ReplyNotification
+from blog.factories import PostFactory, CategoryFactory, CommentFactory
+
+class TestExplainBlogQueriesCommand(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = PostFactory(categories=[CategoryFactory(name="explained")])
+        CommentFactory(post=cls.post)
+
+    def test_explains_the_queries_of_every_blog_view(self):
+        out = StringIO()
+        call_command("explain_blog_queries", stdout=out)
+        output = out.getvalue()
+        for title in ("IndexView", "CategoryIndexView: a page of #explained posts",
+                      f"PostDetailView: the post '{self.post.slug}'", "unsubscribe_from_all_posts"):
+            self.assertIn(title, output)
+
+@override_settings(BLOG_CACHE_TIMEOUT=0)
+class TestBenchmarks(TestCase):
+    def test_seeds_the_requested_volumes(self):
+        benchmarks.seed(posts=20, categories=4, comments=60, replies=30, busy_post_comments=10, log=lambda message: None)
+        self.assertEqual(Post.objects.count(), 20)
+        self.assertEqual(Category.objects.count(), 4)
+        self.assertEqual(Comment.objects.filter(parent_comment=None).count(), 70)
+        self.assertEqual(Comment.objects.exclude(parent_comment=None).count(), 30)
+        self.assertEqual(Post.categories.through.objects.count(), 20 * benchmarks.CATEGORIES_PER_POST)
+        self.assertEqual(Recipient.objects.count(), benchmarks.COMMENTERS)
+        self.assertTrue(all(post.excerpt and post.body_html for post in Post.objects.all()))
+        self.assertEqual(search.search_posts("lorem").count(), 20)
+
+    def test_measures_every_public_view(self):
+        benchmarks.seed(posts=20, categories=4, comments=60, replies=30, busy_post_comments=10, log=lambda message: None)
+        results = benchmarks.run(benchmarks.get_scenarios(), requests=3, warmup=1, profiled=1, log=lambda message: None)
+        self.assertEqual(set(results), {
+            'base_view', 'index_view', 'index_view_last_page', 'category_index_view',
+            'post_detail_view', 'post_detail_view_busy_post', 'post_comments_view_busy_post', 'post_detail_view_comment', 'post_detail_view_reply',
+            'unsubscribe_from_comment', 'unsubscribe_from_all_posts', 'one_click_unsubscribe',
+        })
+        for name, result in results.items():
+            # comments and replies redirect to the post's page
+            self.assertEqual(result['status'], 302 if name in ('post_detail_view_comment', 'post_detail_view_reply') else 200, name)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['peak_memory_kib'], 0)
+        self.assertGreater(results['index_view']['queries'], 0)
+
+    def test_percentile_is_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmarks.percentile(values, 50), 50)
+        self.assertEqual(benchmarks.percentile(values, 99), 99)
+        self.assertEqual(benchmarks.percentile([7], 99), 7)
+
+class TestRebuildSearchIndexCommand(TestCase):
+    def test_reindexes_posts_written_without_save(self):
+        Post.objects.bulk_create([Post(title="Bulk created", body="I skipped the signals.", slug="bulk-created")])
+        self.assertFalse(search.search_posts("skipped").exists())
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual([post.slug for post in search.search_posts("skipped")], ["bulk-created"])
+
+class TestRepairCommentCountsCommand(TestCase):
+    def test_recounts_comments_written_without_save(self):
+        post, other_post = PostFactory(), PostFactory()
+        Comment.objects.bulk_create(CommentFactory.build_batch(3, post=post))
+        Comment.objects.bulk_create([Comment(name="Replier", email="replier@email.com", comment="I am a reply",
+                                             parent_comment=Comment.objects.filter(post=post).first())])
+        Post.objects.filter(id=other_post.id).update(comment_count=7)
+        out = StringIO()
+        call_command("repair_comment_counts", stdout=out)
+        self.assertIn("2 posts", out.getvalue())
+        self.assertEqual(Post.objects.values_list('comment_count', 'reply_count').get(id=post.id), (3, 1))
+        self.assertEqual(Post.objects.values_list('comment_count', 'reply_count').get(id=other_post.id), (0, 0))
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionRefusedError("The mail server is down.")
+
+class WorkerKilled(BaseException):
+    pass
+
+class DyingEmailBackend(BaseEmailBackend):
+    ''' Sends one email and then the worker is killed, like a dyno restarted mid-batch '''
+    def send_messages(self, email_messages):
+        if mail.outbox:
+            raise WorkerKilled
+        mail.outbox.extend(email_messages)
+        return len(email_messages)
+
+class TestSendOutboxCommand(TestCase):
+    def queue_emails(self, count):
+        return outbox.enqueue(*[
+            OutgoingEmail(subject="Hello", body="I am queued.", from_email="voila@email.com", to=f"person{i}@email.com")
+            for i in range(count)
+        ])
+
+    def test_sends_due_emails_in_batches_and_marks_them_sent(self):
+        self.queue_emails(5)
+        call_command("send_outbox", "--batch-size=2", stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [f"person{i}@email.com" for i in range(5)])
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.SENT).count(), 5)
+        # a second run has nothing left to send
+        call_command("send_outbox", stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_emails_that_are_not_due_yet_wait(self):
+        OutgoingEmail.objects.create(subject="Later", body="I am not due yet.", from_email="voila@email.com",
+                                     to="person@email.com", send_after=timezone.now() + timedelta(hours=1))
+        call_command("send_outbox", stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+
+    @override_settings(EMAIL_BACKEND="blog.tests.test_commands.FailingEmailBackend", BLOG_OUTBOX_RETRY_DELAY=60)
+    def test_failed_emails_are_retried_with_backoff_then_given_up(self):
+        self.queue_emails(1)
+        with self.assertLogs("blog.outbox", "WARNING"):
+            call_command("send_outbox", stdout=StringIO())
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.status, OutgoingEmail.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertIn("The mail server is down.", email.last_error)
+        self.assertGreater(email.send_after, timezone.now() + timedelta(seconds=50))
+
+        OutgoingEmail.objects.update(send_after=timezone.now(), attempts=4)
+        with self.assertLogs("blog.outbox", "WARNING"):
+            call_command("send_outbox", stdout=StringIO())
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutgoingEmail.FAILED)
+        self.assertEqual(email.attempts, 5)
+
+    def test_a_worker_killed_mid_batch_leaves_what_it_sent_sent(self):
+        self.queue_emails(3)
+        with override_settings(EMAIL_BACKEND="blog.tests.test_commands.DyingEmailBackend"):
+            with self.assertRaises(WorkerKilled):
+                outbox.send_pending()
+        self.assertEqual(OutgoingEmail.objects.get(status=OutgoingEmail.SENT).to, mail.outbox[0].to[0])
+        # the rest are still claimed, no other worker sends them meanwhile
+        self.assertEqual(outbox.send_pending(), (0, 0))
+        OutgoingEmail.objects.filter(status=OutgoingEmail.PENDING).update(send_after=timezone.now())
+        self.assertEqual(outbox.send_pending(), (2, 0))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [f"person{i}@email.com" for i in range(3)])
+
+    def test_the_claim_commits_before_the_emails_are_sent(self):
+        self.queue_emails(2)
+        with CaptureQueriesContext(connection) as queries:
+            outbox.send_pending()
+        sql = [query['sql'] for query in queries]
+        # the claim's own transaction, then an UPDATE per email outside of it
+        release = next(i for i, statement in enumerate(sql) if statement.startswith('RELEASE SAVEPOINT'))
+        self.assertEqual(len([statement for statement in sql[release:] if statement.startswith('UPDATE')]), 2)
+
+class TestReplyDigests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = PostFactory(title="A Post")
+        cls.comments = [CommentFactory(post=cls.post) for i in range(2)]
+        cls.hourly = Recipient.objects.create(recipient_email="hourly@email.com", digest_frequency=Recipient.HOURLY)
+        cls.daily = Recipient.objects.create(recipient_email="daily@email.com", digest_frequency=Recipient.DAILY)
+
+    def notify(self, recipient, count, age):
+        for i in range(count):
+            reply = Comment.objects.create(name=f"Replier {i}", email="replier@email.com", comment="I am a reply.",
+                                           parent_comment=self.comments[i % 2])
+            notification = ReplyNotification.objects.create(recipient=recipient, reply=reply)
+            ReplyNotification.objects.filter(id=notification.id).update(created_on=timezone.now() - age)
+
+    def test_queues_one_email_per_recipient_once_their_window_is_over(self):
+        self.notify(self.hourly, 3, timedelta(minutes=61))
+        self.notify(self.daily, 2, timedelta(hours=2))
+        # the due recipients, their locks, their notifications with the replies and posts, the emails,
+        # the deletion, and the savepoint around them
+        with self.assertNumQueries(7):
+            self.assertEqual(notifications.queue_digests(), 1)
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.to, "hourly@email.com")
+        self.assertEqual(email.subject, "3 new replies from Voila")
+        self.assertEqual(email.html_body.count("has replied to your comment on"), 3)
+        self.assertEqual(email.html_body.count("A Post"), 3)
+        # the daily recipient's replies keep waiting
+        self.assertEqual(ReplyNotification.objects.get(reply__name="Replier 0").recipient, self.daily)
+        self.assertEqual(ReplyNotification.objects.count(), 2)
+
+    def test_recipients_without_notifications_are_not_read(self):
+        Recipient.objects.bulk_create([Recipient(recipient_email=f"quiet{i}@email.com", digest_frequency=Recipient.DAILY)
+                                       for i in range(20)])
+        # the pending notifications only, grouped by recipient
+        with self.assertNumQueries(1):
+            self.assertEqual(notifications.queue_digests(), 0)
+
+    def test_a_window_starts_with_its_oldest_notification(self):
+        self.notify(self.hourly, 1, timedelta(minutes=30))
+        self.assertEqual(notifications.queue_digests(), 0)
+        self.assertEqual(notifications.queue_digests(now=timezone.now() + timedelta(minutes=31)), 1)
+        self.assertFalse(ReplyNotification.objects.exists())
+
+    def test_switching_back_to_an_email_per_reply_sends_what_was_waiting(self):
+        self.notify(self.daily, 2, timedelta(minutes=1))
+        Recipient.objects.filter(id=self.daily.id).update(digest_frequency=Recipient.IMMEDIATE)
+        self.assertEqual(notifications.queue_digests(), 1)
+
+    def test_send_outbox_sends_the_due_digests(self):
+        self.notify(self.hourly, 2, timedelta(hours=2))
+        out = StringIO()
+        call_command("send_outbox", stdout=out)
+        self.assertIn("Queued 1 digest(s).", out.getvalue())
+        self.assertEqual([message.to for message in mail.outbox], [["hourly@email.com"]])
@@ -0,0 +1,124 @@
+from unittest import mock
+from xml.etree import ElementTree
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from blog.feeds import SitemapView
+from blog.models import Post, Category
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+SITEMAP = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+
+class TestFeeds(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.python = Category.objects.create(name="python")
+        cls.django = Category.objects.create(name="django")
+        for i in range(3):
+            post = Post.objects.create(title=f"Post no.{i}", body=f"I am the body of post no.{i}", slug=f"post-no-{i}")
+            post.categories.add(cls.python if i else cls.django)
+
+    def setUp(self):
+        cache.clear()
+
+    def content(self, response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_rss_feed_lists_the_newest_posts_first(self):
+        response = self.client.get(reverse('blog:rss_feed'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('application/rss+xml'))
+        channel = ElementTree.fromstring(self.content(response)).find('channel')
+        items = channel.findall('item')
+        self.assertEqual([item.findtext('title') for item in items], ["Post no.2", "Post no.1", "Post no.0"])
+        self.assertEqual(items[0].findtext('link'), "http://testserver/blog/post-no-2")
+        self.assertEqual(items[0].findtext('category'), "python")
+        self.assertEqual(items[0].findtext('description'), "I am the body of post no.2")
+
+    def test_atom_feed_of_a_category(self):
+        response = self.client.get(reverse('blog:category_atom_feed', args=["python"]))
+        self.assertTrue(response['Content-Type'].startswith('application/atom+xml'))
+        feed = ElementTree.fromstring(self.content(response))
+        self.assertEqual([entry.findtext(f'{ATOM}title') for entry in feed.findall(f'{ATOM}entry')],
+                         ["Post no.2", "Post no.1"])
+
+    def test_feeds_are_streamed(self):
+        response = self.client.get(reverse('blog:rss_feed'))
+        self.assertIsInstance(response, StreamingHttpResponse)
+        # the head of the feed, one chunk per post and the end of the feed
+        self.assertEqual(len(list(response.streaming_content)), 5)
+
+    @override_settings(BLOG_CACHE_TIMEOUT=60 * 60)
+    def test_feeds_are_cached_until_a_post_is_saved(self):
+        url = reverse('blog:rss_feed')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        # the feed is cached once it's been sent in full
+        self.content(response)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertIn(b"Post no.2", self.content(response))
+        post = Post.objects.get(slug="post-no-2")
+        post.title = "An Edited Post"
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn(b"An Edited Post", self.content(response))
+
+    @override_settings(BLOG_CACHE_TIMEOUT=0)
+    def test_feeds_still_stream_without_the_cache(self):
+        response = self.client.get(reverse('blog:atom_feed'))
+        self.assertFalse(response.has_header('X-Cache'))
+        self.assertIn(b"Post no.0", self.content(response))
+
+    def test_polling_an_unchanged_feed_costs_one_query(self):
+        url = reverse('blog:category_rss_feed', args=["python"])
+        response = self.client.get(url)
+        self.content(response)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_a_new_post_changes_the_feed_etag(self):
+        url = reverse('blog:rss_feed')
+        response = self.client.get(url)
+        Post.objects.create(title="A New Post", body="I am new.", slug="a-new-post")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_sitemap_covers_posts_and_hashtags(self):
+        Category.objects.create(name="empty")
+        response = self.client.get(reverse('blog:sitemap'))
+        self.assertEqual(response.status_code, 200)
+        urlset = ElementTree.fromstring(self.content(response))
+        self.assertEqual([url.findtext(f'{SITEMAP}loc') for url in urlset], [
+            "http://testserver/blog/",
+            "http://testserver/blog/post-no-2",
+            "http://testserver/blog/post-no-1",
+            "http://testserver/blog/post-no-0",
+            "http://testserver/blog/hashtag/django",
+            "http://testserver/blog/hashtag/python",
+        ])
+        self.assertTrue(all(url.findtext(f'{SITEMAP}lastmod') for url in urlset))
+
+    def test_a_sitemap_over_the_limit_is_split_into_pages_listed_by_an_index(self):
+        url = reverse('blog:sitemap')
+        # the listing, 3 posts and 2 hashtags
+        with mock.patch.object(SitemapView, 'limit', 4):
+            sitemapindex = ElementTree.fromstring(self.content(self.client.get(url)))
+            self.assertEqual(sitemapindex.tag, f'{SITEMAP}sitemapindex')
+            self.assertEqual([sitemap.findtext(f'{SITEMAP}loc') for sitemap in sitemapindex],
+                             ["http://testserver/blog/sitemap.xml?p=1", "http://testserver/blog/sitemap.xml?p=2"])
+            pages = [ElementTree.fromstring(self.content(self.client.get(url, {'p': page}))) for page in (1, 2)]
+            self.assertEqual([[url.findtext(f'{SITEMAP}loc') for url in urlset] for urlset in pages], [
+                ["http://testserver/blog/", "http://testserver/blog/post-no-2",
+                 "http://testserver/blog/post-no-1", "http://testserver/blog/post-no-0"],
+                ["http://testserver/blog/hashtag/django", "http://testserver/blog/hashtag/python"],
+            ])
+            self.assertEqual(self.client.get(url, {'p': 3}).status_code, 404)
+            self.assertEqual(self.client.get(url, {'p': 'x'}).status_code, 404)
+
+    def test_listing_pages_link_to_their_feeds(self):
+        self.assertContains(self.client.get(reverse('blog:index_view')), 'href="/blog/feed/atom"')
+        self.assertContains(self.client.get(self.python.get_absolute_url()), 'href="/blog/hashtag/python/rss"')
@@ -1,6 +1,6 @@
 from django.test import TestCase
 from blog.forms import CommentForm, ReplyForm, UnsubscribeForm 
-from .factories import CommentFactory, ReplyFactory
+from blog.factories import CommentFactory, ReplyFactory
 
 class TestCommentForm(TestCase):
     def test_comment_form_is_valid_when_valid_data(self):
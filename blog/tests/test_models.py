@@ -1,7 +1,13 @@
-from blog.models import Post, Category, Comment, Recipient
-from .factories import PostFactory, CategoryFactory, CommentFactory, RecipientFactory, ReplyFactory
+from blog import threads, urls
+from blog.models import RESERVED_SLUGS, Post, Category, Comment, Recipient
+from blog.factories import PostFactory, CategoryFactory, CommentFactory, RecipientFactory, ReplyFactory
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models.signals import post_save
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from datetime import datetime
+from unittest import mock
 
 class TestPostModel(TestCase):
 
@@ -51,6 +57,56 @@ class TestPostModel(TestCase):
         self.assertEqual(comments.count(), 0)                      
 
 
+    def test_excerpt_and_body_html_are_computed_on_save(self):
+        post = PostFactory(body="<b>Hello</b>\nWorld " + "a" * 500)
+        self.assertEqual(post.excerpt, post.body[:400])
+        self.assertTrue(post.body_html.startswith("b&gt;Hello&lt;/b&gt;<br>World "))
+
+        post.body = "Edited"
+        post.save(update_fields=['body'])
+        post.refresh_from_db()
+        self.assertEqual(post.excerpt, "Edited")
+        self.assertEqual(post.body_html, "dited")
+
+    def test_the_slugs_of_the_blogs_other_pages_are_rejected(self):
+        post = PostFactory()
+        for slug in ('search', 'hashtag'):
+            post.slug = slug
+            with self.assertRaises(ValidationError):
+                post.full_clean()
+
+    def test_every_url_before_the_posts_has_its_slug_reserved(self):
+        routes = [str(pattern.pattern) for pattern in urls.urlpatterns]
+        for route in routes[:routes.index('<slug>')]:
+            first = route.split('/')[0]
+            if first and not first.startswith('<'):
+                self.assertIn(first, RESERVED_SLUGS)
+        # and those after it whose first segment could be a slug
+        for route in routes[routes.index('<slug>'):]:
+            if route.count('/') and not route.startswith('<'):
+                self.assertIn(route.split('/')[0], RESERVED_SLUGS)
+
+    def test_the_body_is_only_rendered_again_when_it_changes(self):
+        post = PostFactory(body="Hello")
+        Post.objects.filter(id=post.id).update(body_html="stale")
+        post = Post.objects.get(id=post.id)
+        post.title = "Edited"
+        post.save()
+        self.assertEqual(Post.objects.get(id=post.id).body_html, "stale")
+        post.body = "Hello again"
+        post.save()
+        self.assertEqual(Post.objects.get(id=post.id).body_html, "ello again")
+
+    def test_saving_a_post_without_its_body_does_not_load_it(self):
+        post = Post.objects.defer('body').get(id=PostFactory(body="Hello").id)
+        post.title = "Edited"
+        with mock.patch('blog.models.render_body') as render_body:
+            post.save()
+        render_body.assert_not_called()
+        post = Post.objects.get(id=post.id)
+        self.assertEqual((post.title, post.body, post.excerpt), ("Edited", "Hello", "Hello"))
+
+
 class TestCategoryModel(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -123,6 +179,104 @@ class TestCommentModel(TestCase):
         self.assertEqual(Comment.objects.filter(parent_comment=self.comment).count(), 4)
     
            
+class TestCommentCounters(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = PostFactory(slug="counted-post")
+        cls.comment = CommentFactory(post=cls.post)
+        ReplyFactory.create_batch(2, parent_comment=cls.comment)
+
+    def counts(self):
+        self.post.refresh_from_db(fields=['comment_count', 'reply_count'])
+        return self.post.comment_count, self.post.reply_count
+
+    def test_comments_and_replies_are_counted_when_written(self):
+        self.assertEqual(self.counts(), (1, 2))
+        CommentFactory(post=self.post)
+        self.assertEqual(self.counts(), (2, 2))
+
+    def test_editing_a_comment_does_not_count_it_again(self):
+        self.comment.comment = "I was edited"
+        self.comment.save()
+        self.assertEqual(self.counts(), (1, 2))
+
+    def test_deleting_a_comment_uncounts_it_and_its_replies(self):
+        Comment.objects.filter(parent_comment=self.comment).first().delete()
+        self.assertEqual(self.counts(), (1, 1))
+        self.comment.delete()
+        self.assertEqual(self.counts(), (0, 0))
+
+    def test_deleting_a_post_does_not_uncount_its_comments_one_by_one(self):
+        busy_post = PostFactory(slug="busy-post")
+        for comment in CommentFactory.create_batch(2, post=busy_post):
+            ReplyFactory(parent_comment=comment)
+        with CaptureQueriesContext(connection) as few:
+            Post.objects.filter(id=busy_post.id).delete()
+        busy_post = PostFactory(slug="busy-post")
+        for comment in CommentFactory.create_batch(20, post=busy_post):
+            ReplyFactory(parent_comment=comment)
+        with self.assertNumQueries(len(few)):
+            Post.objects.filter(id=busy_post.id).delete()
+        self.assertFalse(Comment.objects.filter(post=busy_post).exists())
+        self.assertEqual(self.counts(), (1, 2))
+
+    def test_deleting_a_post_instance_does_not_uncount_its_comments_either(self):
+        quiet_post, busy_post = PostFactory(slug="quiet-post"), PostFactory(slug="busy-post")
+        CommentFactory(post=quiet_post)
+        CommentFactory.create_batch(20, post=busy_post)
+        with CaptureQueriesContext(connection) as few:
+            quiet_post.delete()
+        with self.assertNumQueries(len(few)):
+            busy_post.delete()
+
+    def test_counts_are_updated_in_the_database_not_from_a_stale_instance(self):
+        stale = Post.objects.get(id=self.post.id)
+        CommentFactory(post=self.post)
+        CommentFactory(post=stale)
+        self.assertEqual(self.counts(), (3, 2))
+
+class TestCommentPaths(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = PostFactory()
+        cls.comment = CommentFactory(post=cls.post)
+        cls.reply = ReplyFactory(parent_comment=cls.comment)
+        cls.deeper = ReplyFactory(parent_comment=cls.reply)
+
+    def test_paths_are_the_ids_from_the_top_of_the_thread(self):
+        self.assertEqual(self.comment.path, threads.segment(self.comment.id))
+        self.assertEqual(self.deeper.path, self.reply.path + threads.segment(self.deeper.id))
+        self.assertEqual([self.comment.depth, self.reply.depth, self.deeper.depth], [0, 1, 2])
+        self.deeper.refresh_from_db()
+        self.assertEqual((self.deeper.path, self.deeper.depth, self.deeper.post), (self.reply.path + threads.segment(self.deeper.id), 2, self.post))
+
+    def test_the_post_save_receivers_see_the_path(self):
+        seen = []
+        def receiver(sender, instance, created, **kwargs):
+            seen.append((instance.path, Comment.objects.filter(id=instance.id).values_list('path', flat=True).first()))
+        post_save.connect(receiver, sender=Comment)
+        self.addCleanup(post_save.disconnect, receiver, sender=Comment)
+        with self.assertNumQueries(0):
+            # a reply's parent is already there
+            reply = Comment(name="Replier", email="replier@email.com", comment="I am a reply", parent_comment=self.deeper)
+        reply.save()
+        self.assertEqual(seen, [(self.deeper.path + threads.segment(reply.id),) * 2])
+
+    def test_a_subtree_range_holds_the_comment_and_everything_under_it(self):
+        lowest, highest = threads.subtree_range(self.reply.path)
+        other = ReplyFactory(parent_comment=self.comment)
+        in_range = Comment.objects.filter(path__gte=lowest, path__lt=highest).order_by('path')
+        self.assertEqual(list(in_range), [self.reply, self.deeper])
+        self.assertNotIn(other, in_range)
+
+    def test_fill_paths_fills_in_the_comments_written_without_save(self):
+        expected = list(Comment.objects.order_by('id').values_list('path', 'depth', 'post'))
+        # as the comments written before the paths existed, or with bulk_create
+        Comment.objects.update(path='', depth=0)
+        Comment.objects.exclude(parent_comment=None).update(post=None)
+        threads.fill_paths(Comment)
+        self.assertEqual(list(Comment.objects.order_by('id').values_list('path', 'depth', 'post')), expected)
+
 class TestRecipientModel(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -133,3 +287,18 @@ class TestRecipientModel(TestCase):
         self.assertTrue(isinstance(recipient, Recipient))
         self.assertEqual(recipient.recipient_email, "recipient@email.com")
         self.assertEqual(recipient.__str__(), recipient.recipient_email)
+
+    def test_subscribe_reuses_one_recipient_per_lowercased_email(self):
+        comment, another_comment = CommentFactory(), CommentFactory()
+        first = Recipient.objects.subscribe(comment, "Someone@Email.com")
+        second = Recipient.objects.subscribe(another_comment, "someone@email.com")
+        self.assertEqual(first, second)
+        self.assertEqual(first.recipient_email, "someone@email.com")
+        self.assertEqual(Recipient.objects.filter(recipient_email="someone@email.com").count(), 1)
+        self.assertEqual(first.comments.count(), 2)
+
+    def test_subscribing_twice_to_the_same_comment_is_a_no_op(self):
+        comment = CommentFactory()
+        Recipient.objects.subscribe(comment, "someone@email.com")
+        Recipient.objects.subscribe(comment, "someone@email.com")
+        self.assertEqual(comment.recipients.filter(recipient_email="someone@email.com").count(), 1)
@@ -1,8 +1,18 @@
-from django.test import TestCase
+import re
+from io import StringIO
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.urls import reverse
-from blog.models import Post, Category, Comment, Recipient
+from blog.models import Post, Category, Comment, Recipient, OutgoingEmail, ReplyNotification
 from blog.forms import CommentForm, ReplyForm, UnsubscribeForm
+from blog import counters, threads
+from blog.pagination import encode_cursor
+from blog.tokens import make_digest_token, make_unsubscribe_token, read_unsubscribe_token
 from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.conf import settings
 from voila.settings import MY_EMAIL as my_email
 
 class TestIndexView(TestCase):
@@ -17,6 +27,10 @@ class TestIndexView(TestCase):
         response = self.client.get('/blog/')
         self.assertEqual(response.status_code, 200)
 
+    def setUp(self):
+        # a page cached by another test may be stale for this one
+        cache.clear()
+
     def test_correct_template_is_used_when_rendering_index_view(self):
         response = self.client.get(reverse('blog:index_view'))
         self.assertEqual(response.status_code, 200) 
@@ -37,6 +51,33 @@ class TestIndexView(TestCase):
         self.assertTrue(response.context['is_paginated'] == True)
         self.assertEqual(len(response.context['posts']), 4)    
 
+    def test_index_view_query_count_does_not_depend_on_categories(self):
+        for post in Post.objects.all():
+            for category_id in range(1, 6):
+                post.categories.add(Category.objects.create(name=f"category_{category_id}"))
+        # the Last-Modified date, the page count, the page of posts and their prefetched categories
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('blog:index_view'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "#category_5", count=5)
+
+    def test_index_view_shows_the_stored_comment_counts(self):
+        post = Post.objects.order_by('-pub_date', '-id').first()
+        comment = Comment.objects.create(name="Person", email="person@email.com", comment="I am a comment", post=post)
+        Comment.objects.create(name="Replier", email="replier@email.com", comment="I am a reply", parent_comment=comment)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('blog:index_view'))
+        self.assertContains(response, "2 comments")
+        self.assertContains(response, "0 comments", count=4)
+        # only Last-Modified looks at the comments, for the newest one
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries if '"blog_comment"' in query['sql']))
+
+    def test_index_view_does_not_load_post_bodies(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('blog:index_view'))
+        self.assertContains(response, " am the body of post no.9")
+        self.assertFalse(any('"blog_post"."body"' in query['sql'] for query in queries))
+
 class TestCategoryIndexView(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -46,6 +87,10 @@ class TestCategoryIndexView(TestCase):
             Post.objects.create(title=f"Post No. {post_id}", 
                                 body=f"I am the body of post no.{post_id}").categories.add(cls.category)
 
+    def setUp(self):
+        # a page cached by another test may be stale for this one
+        cache.clear()
+
     def test_category_index_view_url_path(self):
         response = self.client.get(self.category.get_absolute_url())
         self.assertEqual(response.status_code, 200)
@@ -71,6 +116,72 @@ class TestCategoryIndexView(TestCase):
         self.assertTrue(response.context['is_paginated'] == True)
         self.assertEqual(len(response.context['posts']), 4)    
 
+    def test_category_index_view_query_count_does_not_depend_on_categories(self):
+        for post in Post.objects.all():
+            for category_id in range(1, 6):
+                post.categories.add(Category.objects.create(name=f"category_{category_id}"))
+        # the Last-Modified date, the page count, the page of posts and their prefetched categories
+        with self.assertNumQueries(4):
+            response = self.client.get(self.category.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['posts']), 5)
+
+@override_settings(BLOG_KEYSET_PAGINATION=True)
+class TestKeysetPagination(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="keyset")
+        cls.posts = [Post.objects.create(title=f"Post No. {post_id}", body=f"I am the body of post no.{post_id}")
+                     for post_id in range(1, 13)]
+        for post in cls.posts:
+            post.categories.add(cls.category)
+        cls.newest_first = cls.posts[::-1]
+
+    def setUp(self):
+        # a page cached by another test may be stale for this one
+        cache.clear()
+
+    def get_page(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_walking_older_then_newer_pages(self):
+        url = reverse('blog:index_view')
+        first = self.get_page(url)
+        self.assertEqual(list(first.context['posts']), self.newest_first[:5])
+        self.assertFalse(first.context['page_obj'].has_newer)
+
+        second = self.get_page(url, older=first.context['page_obj'].older_cursor)
+        self.assertEqual(list(second.context['posts']), self.newest_first[5:10])
+
+        last = self.get_page(url, older=second.context['page_obj'].older_cursor)
+        self.assertEqual(list(last.context['posts']), self.newest_first[10:])
+        self.assertFalse(last.context['page_obj'].has_older)
+
+        back = self.get_page(url, newer=last.context['page_obj'].newer_cursor)
+        self.assertEqual(list(back.context['posts']), self.newest_first[5:10])
+        back = self.get_page(url, newer=back.context['page_obj'].newer_cursor)
+        self.assertEqual(list(back.context['posts']), self.newest_first[:5])
+        self.assertFalse(back.context['page_obj'].has_newer)
+
+    def test_category_index_view_pages_with_cursors(self):
+        first = self.get_page(self.category.get_absolute_url())
+        second = self.get_page(self.category.get_absolute_url(), older=first.context['page_obj'].older_cursor)
+        self.assertEqual(list(second.context['posts']), self.newest_first[5:10])
+        self.assertContains(second, "?newer=")
+        self.assertContains(second, "?older=")
+
+    def test_deep_pages_do_not_count_posts(self):
+        first = self.get_page(reverse('blog:index_view'))
+        # the Last-Modified date, the page of posts and their prefetched categories, no COUNT(*)
+        with self.assertNumQueries(3):
+            self.get_page(reverse('blog:index_view'), older=first.context['page_obj'].older_cursor)
+
+    def test_invalid_cursor_is_404(self):
+        response = self.client.get(reverse('blog:index_view'), {"older": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
 class TestPostDetailView(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -87,6 +198,10 @@ class TestPostDetailView(TestCase):
         cls.recipient = Recipient.objects.create(recipient_email=cls.comment.email)
         cls.comment.recipients.add(cls.recipient)                       
 
+    def setUp(self):
+        # a page cached by another test may be stale for this one
+        cache.clear()
+
     def test_post_detail_view_url_path(self):
         response = self.client.get('/blog/new-post-for-tests')
         self.assertEqual(response.status_code, 200)                                
@@ -158,15 +273,17 @@ class TestPostDetailView(TestCase):
         response = self.client.post(post.get_absolute_url(), {"name":"Someone", 
                                                               "email":email, 
                                                               "comment":"this is a new comment",})
-        self.assertEqual(response.status_code, 200)
-        self.assertTemplateUsed(response, "blog/post-detail.html")
         # the comment has been added
         self.assertEqual(Comment.objects.filter(post=post).count(), 2)
+        new_comment = Comment.objects.get(comment="this is a new comment")
+        # and the page redirects to it, so refreshing it doesn't post the comment again
+        self.assertRedirects(response, f"{post.get_absolute_url()}#comment-{new_comment.id}", fetch_redirect_response=False)
         # and the commenter's email has been added to the recipients
         self.assertTrue(email in [recipient.recipient_email for recipient in Recipient.objects.all()])
 
-        response = self.client.post(post.get_absolute_url())
+        response = self.client.get(response.url)
         self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f'id="comment-{new_comment.id}"')
         # the comment gets rendered with post
         self.assertEqual(response.context['comments_count'], 2)
         self.assertEqual(response.context['comments'][1].comment, "this is a new comment")
@@ -182,7 +299,8 @@ class TestPostDetailView(TestCase):
                                                               "email":email,
                                                               "comment":"I am a reply.",
                                                               "parent_comment_id":comment.id,})
-        self.assertEqual(response.status_code, 200)
+        reply = comment.replies.get()
+        self.assertRedirects(response, f"{post.get_absolute_url()}#comment-{reply.id}", fetch_redirect_response=False)
         
         response = self.client.get(post.get_absolute_url())
         self.assertEqual(response.status_code, 200)
@@ -192,12 +310,29 @@ class TestPostDetailView(TestCase):
         # and a new email has been added to the recipients list
         self.assertTrue(email in [recipient.recipient_email for recipient in comment.recipients.all()])
 
+    def test_commenting_and_replying_with_the_same_email_keeps_one_recipient(self):
+        post = self.post
+        for _ in range(3):
+            self.client.post(post.get_absolute_url(), {"name":"Person", 
+                                                       "email":"Regular@email.com",
+                                                       "comment":"I comment a lot.",})
+            self.client.post(post.get_absolute_url(), {"name":"Person", 
+                                                       "email":"regular@email.com",
+                                                       "comment":"I reply a lot.",
+                                                       "parent_comment_id": self.comment.id,})
+        self.assertEqual(Recipient.objects.filter(recipient_email="regular@email.com").count(), 1)
+        self.assertEqual(self.comment.recipients.filter(recipient_email="regular@email.com").count(), 1)
+
     def test_sendding_email_to_my_email_when_someone_comments_on_post(self):
         post = self.post
         response = self.client.post(post.get_absolute_url(), {"name":"Person", 
                                                               "email":"commenter@email.com",
                                                               "comment":"I am a comment.",})
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.status_code, 302)
+        # the email is only queued while handling the request
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.PENDING).count(), 1)
+        call_command("send_outbox", stdout=StringIO())
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, "A new comment from Voila")
         self.assertEqual(mail.outbox[0].body, f"Someone commented on {post.get_absolute_url()}")
@@ -206,7 +341,8 @@ class TestPostDetailView(TestCase):
         response = self.client.post(post.get_absolute_url(), {"name":"Another Person", 
                                                               "email":"anotherp@email.come",
                                                               "comment":"I am another comment.",})
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.status_code, 302)
+        call_command("send_outbox", stdout=StringIO())
         self.assertEqual(len(mail.outbox), 2)
 
     def test_notify_recipients_of_new_reply_is_added(self):
@@ -216,21 +352,225 @@ class TestPostDetailView(TestCase):
                                                               "email":"newemail@email.com",
                                                               "comment":"I am a reply.", 
                                                               "parent_comment_id": comment.id,})
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.status_code, 302)
         self.assertEqual(comment.replies.all().count(), 1)
         self.assertEqual(comment.recipients.all().count(), 2)
         # an email is sent to the comment's owner to notify them of the new reply
+        call_command("send_outbox", stdout=StringIO())
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, "A new reply from Voila")
         self.assertEqual(mail.outbox[0].to[0], comment.email)
         self.assertTemplateUsed(response, 'blog/email-template.html')
    
 
+    def test_invalid_comment_renders_the_page_again_with_the_errors(self):
+        post = self.post
+        response = self.client.post(post.get_absolute_url(), {"name":"Someone", "email":"not an email",
+                                                              "comment":"I keep what I typed",})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "blog/post-detail.html")
+        self.assertTrue(response.context['comment_form'].errors['email'])
+        self.assertContains(response, "I keep what I typed")
+        self.assertEqual(Comment.objects.filter(post=post).count(), 1)
+
+    def test_invalid_reply_opens_the_reply_form_of_its_comment(self):
+        response = self.client.post(self.post.get_absolute_url(), {"name":"Someone", "email":"someone@email.com",
+                                                                   "comment":"", "parent_comment_id": self.comment.id,})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['reply_form'].errors['comment'])
+        self.assertContains(response, f'id="comment{self.comment.id}" class="collapse reply-form show"')
+        self.assertEqual(self.comment.replies.count(), 0)
+
+    def test_posting_a_comment_looks_the_post_up_once(self):
+        queries = CaptureQueriesContext(connection)
+        with queries:
+            self.client.post(self.post.get_absolute_url(), {"name":"Someone", "email":"someone@email.com",
+                                                            "comment":"I am a comment.",})
+        post_lookups = [query for query in queries if 'FROM "blog_post"' in query['sql']
+                                                     and query['sql'].lstrip().startswith('SELECT')]
+        self.assertEqual(len(post_lookups), 1)
+
+    def test_posting_to_a_post_that_does_not_exist_is_404(self):
+        response = self.client.post("/blog/no-such-post", {"name":"Someone", "email":"someone@email.com",
+                                                           "comment":"I am a comment.",})
+        self.assertEqual(response.status_code, 404)
+
+class TestSearchView(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.title_match = Post.objects.create(title="Running Django on Heroku", body="A post about deployment.", slug="heroku")
+        cls.body_match = Post.objects.create(title="Deployment notes", body="Then I ran Django with gunicorn.", slug="notes")
+        cls.no_match = Post.objects.create(title="Hello", body="Nothing to see here.", slug="hello")
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('blog:search_view'), {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'blog/search-results.html')
+        return response
+
+    def test_title_matches_rank_above_body_matches(self):
+        response = self.search("django")
+        self.assertEqual(list(response.context['posts']), [self.title_match, self.body_match])
+        self.assertEqual(response.context['search_query'], "django")
+
+    def test_words_are_stemmed(self):
+        response = self.search("runs")
+        self.assertEqual(list(response.context['posts']), [self.title_match])
+
+    def test_query_syntax_in_user_input_is_searched_as_words(self):
+        response = self.search('"django" OR (hello')
+        self.assertEqual(list(response.context['posts']), [])
+
+    def test_empty_query_has_no_results(self):
+        response = self.search("  ")
+        self.assertEqual(list(response.context['posts']), [])
+        self.assertContains(response, "Search the posts")
+
+    def test_edited_and_deleted_posts_are_reindexed(self):
+        self.no_match.body = "Now I talk about Django too."
+        self.no_match.save()
+        self.assertIn(self.no_match, self.search("django").context['posts'])
+        self.no_match.delete()
+        self.assertEqual(len(self.search("django").context['posts']), 2)
+
+    def test_results_are_paginated_and_keep_the_query(self):
+        for post_id in range(6):
+            Post.objects.create(title=f"Paginated post {post_id}", body="I am about pagination.", slug=f"paginated-{post_id}")
+        response = self.search("pagination")
+        self.assertEqual(len(response.context['posts']), 5)
+        self.assertContains(response, "?q=pagination&amp;page=2")
+        self.assertEqual(len(self.search("pagination", page=2).context['posts']), 1)
+
+class TestPostDetailViewQueries(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = Post.objects.create(title="A Busy Post",
+                                       body="I am a post with lots of comments.",
+                                       slug="a-busy-post",)
+
+    def setUp(self):
+        # a page cached by another test may be stale for this one
+        cache.clear()
+
+    def add_comments_with_replies(self, count):
+        comments = Comment.objects.bulk_create(
+            Comment(name="Person", email="person@email.com", comment="I am a comment", post=self.post)
+            for _ in range(count)
+        )
+        if not comments[0].id:
+            # not every backend returns the ids of bulk inserted rows
+            comments = Comment.objects.filter(post=self.post).order_by('-id')[:count]
+        Comment.objects.bulk_create(
+            Comment(name="Replier", email="replier@email.com", comment="I am a reply", parent_comment=comment)
+            for comment in comments
+        )
+        # bulk_create skips Comment.save(), which gives the replies their post and path, and the signals that count them
+        threads.fill_paths(Comment)
+        counters.recount()
+
+    def test_query_count_stays_flat_as_comments_grow(self):
+        self.add_comments_with_replies(30)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.post.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['comments_count'], 30)
+
+        self.add_comments_with_replies(9970)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(self.post.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['comments_count'], 10000)
+        self.assertEqual(len(response.context['comments'][-1].thread), 1)
+
+    def test_query_count_stays_flat_as_threads_get_deeper(self):
+        comment = Comment.objects.create(name="Person", email="person@email.com", comment="I am a comment", post=self.post)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.post.get_absolute_url())
+        parent = comment
+        for depth in range(1, 11):
+            parent = Comment.objects.create(name="Replier", email="replier@email.com", comment=f"reply {depth}",
+                                            parent_comment=parent)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(self.post.get_absolute_url())
+        self.assertEqual([reply.depth for reply in response.context['comments'][0].thread], list(range(1, 11)))
+
+    @override_settings(BLOG_COMMENTS_PER_PAGE=20)
+    def test_only_the_first_page_of_comments_is_rendered(self):
+        self.add_comments_with_replies(50)
+        response = self.client.get(self.post.get_absolute_url())
+        self.assertEqual(len(response.context['comments']), 20)
+        self.assertContains(response, 'id="load-more-comments"')
+        self.assertContains(response, f'data-next="{response.context["comments_cursor"]}"')
+
+class TestPostCommentsView(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = Post.objects.create(title="A Busy Post", body="I am a post with lots of comments.", slug="a-busy-post")
+        cls.comments = [Comment.objects.create(name="Person", email="person@email.com", comment=f"comment {i}", post=cls.post)
+                        for i in range(5)]
+        cls.reply = Comment.objects.create(name="Replier", email="replier@email.com", comment="a reply",
+                                           parent_comment=cls.comments[4])
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, **params):
+        return self.client.get(reverse('blog:post_comments_view', args=[self.post.slug]), params)
+
+    @override_settings(BLOG_COMMENTS_PER_PAGE=2)
+    def test_pages_through_the_comments_the_post_page_does_not_render(self):
+        page = self.client.get(self.post.get_absolute_url())
+        self.assertEqual([comment.id for comment in page.context['comments']], [c.id for c in self.comments[:2]])
+
+        seen, cursor = [], page.context['comments_cursor']
+        while cursor:
+            data = self.get(after=cursor).json()
+            seen += data['comments']
+            cursor = data['next']
+        self.assertEqual([comment['id'] for comment in seen], [c.id for c in self.comments[2:]])
+        self.assertEqual(seen[-1]['replies'][0]['comment'], "a reply")
+        self.assertEqual(seen[-1]['replies'][0]['parent_comment_id'], self.comments[4].id)
+        self.assertFalse(data['has_more'])
+
+    def test_since_has_only_the_comments_and_replies_written_after(self):
+        since = self.client.get(self.post.get_absolute_url()).context['comments_since']
+        self.assertEqual(self.get(since=since).json()['comments'], [])
+
+        comment = Comment.objects.create(name="Late", email="late@email.com", comment="I'm new", post=self.post)
+        reply = Comment.objects.create(name="Later", email="later@email.com", comment="me too", parent_comment=self.comments[0])
+        data = self.get(since=since).json()
+        self.assertEqual([(c['id'], c['parent_comment_id']) for c in data['comments']],
+                         [(comment.id, None), (reply.id, self.comments[0].id)])
+        self.assertEqual(data['since'], encode_cursor(reply, 'created_on'))
+        self.assertEqual(self.get(since=data['since']).json()['comments'], [])
+
+    def test_since_does_not_skip_comments_written_in_the_same_instant(self):
+        since = self.client.get(self.post.get_absolute_url()).context['comments_since']
+        late = [Comment.objects.create(name="Late", email="late@email.com", comment=f"late {i}", post=self.post)
+                for i in range(2)]
+        Comment.objects.filter(id__in=[comment.id for comment in late]).update(created_on=self.reply.created_on)
+        with override_settings(BLOG_COMMENTS_PER_PAGE=1):
+            first = self.get(since=since).json()
+            second = self.get(since=first['since']).json()
+        self.assertEqual([c['id'] for c in first['comments'] + second['comments']], [comment.id for comment in late])
+
+    def test_new_comments_are_not_served_from_a_stale_cache(self):
+        self.get()
+        Comment.objects.create(name="Late", email="late@email.com", comment="I'm new", post=self.post)
+        self.assertEqual(len(self.get().json()['comments']), 6)
+
+    def test_invalid_cursors_and_unknown_posts_are_404(self):
+        self.assertEqual(self.get(after="not a cursor").status_code, 404)
+        self.assertEqual(self.get(since="yesterday").status_code, 404)
+        response = self.client.get(reverse('blog:post_comments_view', args=["no-such-post"]))
+        self.assertEqual(response.status_code, 404)
+
 class TestUnsubscribeViews(TestCase):
     @classmethod
     def setUpTestData(cls):
         cls.post = Post.objects.create(title="A Post", 
-                                      body="I am a post",)
+                                      body="I am a post",
+                                      slug="a-post",)
         cls.comment = Comment.objects.create(name="Someone", 
                                             email="someonesomeone@email.com", 
                                             comment="I am a comment", 
@@ -293,16 +633,193 @@ class TestUnsubscribeViews(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, "blog/successfully-unsubscribed.html")  
         # there's no longer a recipient with the given email
-        self.assertEqual(Recipient.objects.filter(recipient_email=new_recipient.recipient_email).count(), 0)                          
-        
-
-
-
+        self.assertEqual(Recipient.objects.filter(recipient_email=new_recipient.recipient_email).count(), 0)
+
+    def test_unsubscribe_from_comment_that_does_not_exist_is_404(self):
+        response = self.client.post(reverse('blog:unsubscribe_from_post_view', kwargs={'comment_id': self.comment.id + 1}),
+                                    {"email":self.comment.email})
+        self.assertEqual(response.status_code, 404)
+
+    def test_unsubscribe_from_all_posts_does_not_depend_on_the_number_of_recipients(self):
+        Recipient.objects.bulk_create(Recipient(recipient_email=f"person{i}@email.com") for i in range(500))
+        # find the recipient, delete its subscriptions and pending digest notifications, delete it
+        with self.assertNumQueries(4):
+            response = self.client.post(reverse('blog:unsubscribe_from_all_posts_view'),
+                                        {'email':"SomeoneSomeone@email.com"})
+        self.assertTemplateUsed(response, "blog/successfully-unsubscribed.html")
+        self.assertFalse(Recipient.objects.filter(recipient_email="someonesomeone@email.com").exists())
+
+    def test_one_click_unsubscribe_link_asks_to_confirm(self):
+        token = make_unsubscribe_token(self.comment.email, self.comment.id)
+        response = self.client.get(reverse('blog:one_click_unsubscribe_view', kwargs={'token': token}))
+        self.assertTemplateUsed(response, "blog/confirm-unsubscribe.html")
+        self.assertContains(response, '<form method="post">')
+        # a link scanner that follows it doesn't unsubscribe anyone
+        self.assertEqual(self.comment.recipients.all().count(), 1)
 
+    def test_one_click_unsubscribe_from_comment(self):
+        token = make_unsubscribe_token(self.comment.email, self.comment.id)
+        response = self.client.post(reverse('blog:one_click_unsubscribe_view', kwargs={'token': token}),
+                                    {'List-Unsubscribe': 'One-Click'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "blog/successfully-unsubscribed.html")
+        self.assertEqual(self.comment.recipients.all().count(), 0)
+        # they're still subscribed to everything else
+        self.assertTrue(Recipient.objects.filter(recipient_email=self.comment.email).exists())
 
+    def test_one_click_unsubscribe_from_all_posts(self):
+        token = make_unsubscribe_token(self.comment.email)
+        response = self.client.post(reverse('blog:one_click_unsubscribe_view', kwargs={'token': token}))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Recipient.objects.filter(recipient_email=self.comment.email).exists())
 
-        
-        
+    def test_one_click_unsubscribe_with_a_tampered_token_is_404(self):
+        token = make_unsubscribe_token("someone-else@email.com") + "x"
+        response = self.client.get(reverse('blog:one_click_unsubscribe_view', kwargs={'token': token}))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.comment.recipients.all().count(), 1)
 
+    def test_reply_notifications_carry_a_one_click_list_unsubscribe_header(self):
+        self.client.post(self.post.get_absolute_url(), {"name":"Person",
+                                                        "email":"replier@email.com",
+                                                        "comment":"I am a reply.",
+                                                        "parent_comment_id": self.comment.id,})
+        headers = OutgoingEmail.objects.get(to=self.comment.email).as_email_message().extra_headers
+        self.assertEqual(headers['List-Unsubscribe-Post'], 'List-Unsubscribe=One-Click')
+        url = re.fullmatch(r'<(.+)>', headers['List-Unsubscribe'])[1]
+        self.assertTrue(url.startswith(settings.VOILA_HOST))
+        # the mail provider POSTs to it, without a CSRF token
+        client = Client(enforce_csrf_checks=True)
+        response = client.post(url[len(settings.VOILA_HOST):], 'List-Unsubscribe=One-Click',
+                               content_type='application/x-www-form-urlencoded')
+        self.assertTemplateUsed(response, "blog/successfully-unsubscribed.html")
+        self.assertFalse(Recipient.objects.filter(recipient_email=self.comment.email).exists())
+
+    def test_reply_notifications_carry_one_click_unsubscribe_links(self):
+        self.client.post(self.post.get_absolute_url(), {"name":"Person", 
+                                                        "email":"replier@email.com",
+                                                        "comment":"I am a reply.", 
+                                                        "parent_comment_id": self.comment.id,})
+        notification = OutgoingEmail.objects.get(to=self.comment.email)
+        # the tokens are timestamped, read them back instead of signing new ones to compare with
+        prefix = reverse('blog:one_click_unsubscribe_view', kwargs={'token': 'TOKEN'}).replace('TOKEN', '')
+        tokens = re.findall(re.escape(prefix) + r'([^"]+)"', notification.html_body)
+        self.assertEqual([read_unsubscribe_token(token) for token in tokens],
+                         [(self.comment.email, self.comment.id), (self.comment.email, None)])
+
+    def reply(self):
+        self.client.post(self.post.get_absolute_url(), {"name":"Person", 
+                                                        "email":"replier@email.com",
+                                                        "comment":"I am a reply.", 
+                                                        "parent_comment_id": self.comment.id,})
+        return Comment.objects.get(email="replier@email.com")
+
+    def test_replies_to_digest_recipients_wait_for_the_digest(self):
+        Recipient.objects.update(digest_frequency=Recipient.DAILY)
+        reply = self.reply()
+        self.assertFalse(OutgoingEmail.objects.filter(to=self.comment.email).exists())
+        notification = ReplyNotification.objects.get()
+        self.assertEqual((notification.recipient, notification.reply), (self.recipient, reply))
+
+    def test_reply_notifications_link_to_the_reply_and_the_digest_choices(self):
+        reply = self.reply()
+        notification = OutgoingEmail.objects.get(to=self.comment.email)
+        self.assertIn(f"{self.post.get_absolute_url()}#comment-{reply.id}", notification.html_body)
+        self.assertIn(reverse('blog:digest_frequency_view', args=['TOKEN', 'daily']).split('TOKEN')[0], notification.html_body)
+
+    def test_digest_link_asks_to_confirm(self):
+        token = make_digest_token(self.comment.email)
+        response = self.client.get(reverse('blog:digest_frequency_view', args=[token, 'hourly']))
+        self.assertTemplateUsed(response, "blog/confirm-digest-frequency.html")
+        self.assertContains(response, "an hourly digest")
+        self.recipient.refresh_from_db()
+        self.assertEqual(self.recipient.digest_frequency, Recipient.IMMEDIATE)
+
+    def test_digest_link_changes_the_frequency(self):
+        token = make_digest_token(self.comment.email)
+        response = self.client.post(reverse('blog:digest_frequency_view', args=[token, 'hourly']))
+        self.assertTemplateUsed(response, "blog/digest-frequency-updated.html")
+        self.assertContains(response, "an hourly digest")
+        self.recipient.refresh_from_db()
+        self.assertEqual(self.recipient.digest_frequency, Recipient.HOURLY)
+
+    def test_digest_link_with_a_tampered_token_or_an_unknown_frequency_is_404(self):
+        token = make_digest_token(self.comment.email)
+        self.assertEqual(self.client.post(reverse('blog:digest_frequency_view', args=[token + "x", 'daily'])).status_code, 404)
+        self.assertEqual(self.client.post(reverse('blog:digest_frequency_view', args=[token, 'weekly'])).status_code, 404)
+        # an unsubscribe link's token can't change the frequency either
+        token = make_unsubscribe_token(self.comment.email)
+        self.assertEqual(self.client.post(reverse('blog:digest_frequency_view', args=[token, 'daily'])).status_code, 404)
+        self.recipient.refresh_from_db()
+        self.assertEqual(self.recipient.digest_frequency, Recipient.IMMEDIATE)
+
+    def test_unsubscribing_from_a_comment_drops_its_replies_from_the_digest(self):
+        Recipient.objects.update(digest_frequency=Recipient.DAILY)
+        self.reply()
+        token = make_unsubscribe_token(self.comment.email, self.comment.id)
+        self.client.post(reverse('blog:one_click_unsubscribe_view', kwargs={'token': token}))
+        self.assertFalse(ReplyNotification.objects.exists())
+
+
+class TestCommentThreads(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = Post.objects.create(title="A Post", body="I am a post.", slug="a-post")
+        cls.comment = Comment.objects.create(name="Someone", email="someone@email.com", comment="I am a comment",
+                                             post=cls.post)
+        cls.reply = Comment.objects.create(name="Replier", email="replier@email.com", comment="I am a reply",
+                                           parent_comment=cls.comment)
+
+    def setUp(self):
+        cache.clear()
+
+    def reply_to(self, comment, post=None):
+        return self.client.post((post or self.post).get_absolute_url(),
+                                {"name": "Person", "email": "person@email.com", "comment": "I am a deeper reply",
+                                 "parent_comment_id": comment.id})
+
+    def test_replies_to_replies_render_depth_first_with_their_depth(self):
+        self.reply_to(self.reply)
+        later = Comment.objects.create(name="Later", email="later@email.com", comment="I am a later reply",
+                                       parent_comment=self.comment)
+        deeper = Comment.objects.get(comment="I am a deeper reply")
+        self.assertEqual((deeper.post, deeper.depth, deeper.parent_comment), (self.post, 2, self.reply))
 
-       
+        response = self.client.get(self.post.get_absolute_url())
+        self.assertEqual(response.context['comments'][0].thread, [self.reply, deeper, later])
+        self.assertContains(response, f'style="margin-left: 2rem" id="comment-{deeper.id}" data-depth="2"')
+        # and everyone can be replied to
+        self.assertContains(response, f'name="parent_comment_id" value="{deeper.id}"')
+
+    def test_replying_to_a_reply_notifies_its_writer(self):
+        self.client.post(self.post.get_absolute_url(), {"name": "Replier", "email": "replier@email.com",
+                                                        "comment": "I am a reply", "parent_comment_id": self.comment.id})
+        self.reply_to(Comment.objects.filter(email="replier@email.com").last())
+        self.assertTrue(OutgoingEmail.objects.filter(to="replier@email.com", subject="A new reply from Voila").exists())
+
+    def test_replying_to_another_posts_comment_is_404(self):
+        other_post = Post.objects.create(title="Another Post", body="I am another post.", slug="another-post")
+        self.assertEqual(self.reply_to(self.reply, post=other_post).status_code, 404)
+
+    def test_the_deepest_comments_cannot_be_replied_to(self):
+        deepest = Comment.objects.create(name="Deep", email="deep@email.com", comment="I am deep",
+                                         parent_comment=self.reply)
+        Comment.objects.filter(id=deepest.id).update(depth=threads.MAX_DEPTH)
+        self.assertEqual(self.reply_to(deepest).status_code, 404)
+
+    def test_a_reply_at_the_deepest_level_is_rejected_by_the_view(self):
+        parent = self.reply
+        while parent.depth < threads.MAX_DEPTH:
+            parent = Comment.objects.create(name="Deep", email="deep@email.com", comment="I am deep", parent_comment=parent)
+        self.assertEqual(len(parent.path), (threads.MAX_DEPTH + 1) * threads.SEGMENT)
+        # one level up still takes replies
+        self.assertEqual(self.reply_to(parent.parent_comment).status_code, 302)
+        replies = Comment.objects.count()
+        self.assertEqual(self.reply_to(parent).status_code, 404)
+        self.assertEqual(Comment.objects.count(), replies)
+
+    def test_the_json_has_the_whole_thread_with_depths(self):
+        self.reply_to(self.reply)
+        data = self.client.get(reverse('blog:post_comments_view', args=[self.post.slug])).json()
+        self.assertEqual([(reply['parent_comment_id'], reply['depth']) for reply in data['comments'][0]['replies']],
+                         [(self.comment.id, 1), (self.reply.id, 2)])
@@ -0,0 +1,11 @@
+from django.template.defaultfilters import linebreaksbr
+
+EXCERPT_LENGTH = 400
+
+def make_excerpt(body):
+    ''' Return the beginning of a post's body that the listings show '''
+    return body[:EXCERPT_LENGTH]
+
+def render_body(body):
+    ''' Return the html of a post's body after its first character, which the templates style on its own '''
+    return linebreaksbr(body[1:], autoescape=True)
@@ -0,0 +1,79 @@
+'''
+Comment threads of any depth, stored as materialized paths.
+
+A comment's path is the id of its thread's top-level comment, then the ids of
+the replies down to it, then its own id, each one zero-padded to SEGMENT digits.
+Ordering a post's comments by path lists every thread depth first, with each
+reply after its parent and in the order the replies were written. So the
+replies under a page of comments are one query on blog_comment_post_path_idx,
+whatever their depth.
+
+Comment.save() fills in a new comment's path. It takes the id from the table's
+sequence with next_id() first, so the INSERT writes the whole comment and the
+post_save receivers see its path. fill_paths() fills in the paths of the
+comments written with bulk_create.
+'''
+from django.db import connections
+from django.db.models import CharField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Cast, Concat, LPad
+
+SEGMENT = 10
+# the deepest comments that fit in Comment.path, they can't be replied to
+MAX_DEPTH = 255 // SEGMENT - 1
+
+
+def segment(comment_id):
+    return f"{comment_id:0{SEGMENT}d}"
+
+def subtree_range(path):
+    ''' Return the bounds of the paths of the comment at path and everything under it, the upper one excluded '''
+    return path, path[:-SEGMENT] + segment(int(path[-SEGMENT:]) + 1)
+
+def replies_under(post, comments):
+    ''' Return the query for the replies under some of post's top-level comments, at any depth, depth first '''
+    ranges = Q()
+    for comment in comments:
+        lowest, highest = subtree_range(comment.path)
+        ranges |= Q(path__gt=lowest, path__lt=highest)
+    return post.comment_set.filter(ranges).order_by('path')
+
+def attach_replies(post, comments):
+    ''' Set .thread on each of post's top-level comments to the replies under it, depth first, in one query '''
+    for comment in comments:
+        comment.thread = []
+    threads = {comment.path: comment.thread for comment in comments if comment.path}
+    if threads:
+        for reply in replies_under(post, [comment for comment in comments if comment.path]):
+            threads[reply.path[:SEGMENT]].append(reply)
+
+def next_id(model, using):
+    ''' Take the next id of model's table ahead of its INSERT, or return None when the database can't '''
+    connection, table = connections[using], model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, %s))", [table, model._meta.pk.column])
+            return cursor.fetchone()[0]
+        if connection.vendor == 'sqlite':
+            # AUTOINCREMENT keeps the table's last id in sqlite_sequence, the UPDATE takes the write lock
+            cursor.execute("UPDATE sqlite_sequence SET seq = seq + 1 WHERE name = %s", [table])
+            if cursor.rowcount:
+                cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+                return cursor.fetchone()[0]
+    return None
+
+def fill_paths(Comment):
+    '''
+    Fill in the path, depth and post of every comment of the Comment model that has no path yet,
+    with an UPDATE per level of the threads rather than a query per comment.
+    '''
+    own_segment = LPad(Cast('id', CharField()), SEGMENT, Value('0'))
+    Comment.objects.filter(parent_comment=None, path='').update(path=own_segment, depth=0)
+    parents = Comment.objects.filter(id=OuterRef('parent_comment_id'))
+    while True:
+        # the replies whose parents have their paths now
+        filled = (Comment.objects.filter(path='').exclude(parent_comment=None).exclude(parent_comment__path='')
+                                 .update(path=Concat(Subquery(parents.values('path')), own_segment),
+                                         depth=Subquery(parents.values('depth')) + 1,
+                                         post=Subquery(parents.values('post'))))
+        if not filled:
+            return
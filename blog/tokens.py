@@ -0,0 +1,21 @@
+from django.core import signing
+
+UNSUBSCRIBE_SALT = 'blog.unsubscribe'
+DIGEST_SALT = 'blog.digest'
+
+def make_unsubscribe_token(email, comment_id=None):
+    ''' Return a signed token that unsubscribes email from one comment, or from everything when comment_id is None '''
+    return signing.dumps({'email': email, 'comment': comment_id}, salt=UNSUBSCRIBE_SALT)
+
+def read_unsubscribe_token(token):
+    ''' Return the (email, comment_id) pair signed in token, raise signing.BadSignature if it was tampered with '''
+    data = signing.loads(token, salt=UNSUBSCRIBE_SALT)
+    return data['email'], data['comment']
+
+def make_digest_token(email):
+    ''' Return a signed token that lets the links in email's notifications change how they're sent '''
+    return signing.dumps(email, salt=DIGEST_SALT)
+
+def read_digest_token(token):
+    ''' Return the email signed in token, raise signing.BadSignature if it was tampered with '''
+    return signing.loads(token, salt=DIGEST_SALT)
@@ -1,13 +1,27 @@
 from django.urls import path
-from . import views
+from . import feeds, views
 
 app_name = 'blog'
 urlpatterns = [
     path('', views.IndexView.as_view(), name="index_view"),
     # a link to all the posts that have <category> in their set of categories 
     path('hashtag/<category>', views.CategoryIndexView.as_view(), name="category_index_view"),
+    # the newest posts for feed readers, all of them or those of one hashtag
+    path('feed/rss', feeds.PostFeed.as_view(feed_class=feeds.RssFeed), name="rss_feed"),
+    path('feed/atom', feeds.PostFeed.as_view(feed_class=feeds.AtomFeed), name="atom_feed"),
+    path('hashtag/<category>/rss', feeds.CategoryFeed.as_view(feed_class=feeds.RssFeed), name="category_rss_feed"),
+    path('hashtag/<category>/atom', feeds.CategoryFeed.as_view(feed_class=feeds.AtomFeed), name="category_atom_feed"),
+    path('sitemap.xml', feeds.SitemapView.as_view(), name="sitemap"),
+    # full-text search over the posts' titles and bodies, ?q=<words>
+    path('search', views.SearchView.as_view(), name="search_view"),
     # a link to a specific post whose slug=<slug> 
     path('<slug>', views.PostDetailView.as_view(), name='post_detail_view'),  
+    # the post's comments as JSON, ?after=<cursor> pages through them and ?since=<date> has the new ones
+    path('<slug>/comments', views.PostCommentsView.as_view(), name='post_comments_view'),
+    # the one-click links in the notification emails, the token is the signed email (and comment id)
+    path('unsubscribe/one-click/<token>', views.one_click_unsubscribe, name="one_click_unsubscribe_view"),
+    # the links in the notification emails that choose between an email per reply and a digest
+    path('notifications/<token>/<frequency>', views.set_digest_frequency, name="digest_frequency_view"),
     path('unsubscribe/all-posts-on-voila', views.unsubscribe_from_all_posts, name="unsubscribe_from_all_posts_view"),
     # a link to unsubscribe from the comment whose id=<comment_id>
     # so that the commenter no longer recieve email notifications
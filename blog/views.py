@@ -1,84 +1,207 @@
-from django.shortcuts import render, get_object_or_404
+from django.conf import settings
+from django.shortcuts import render, redirect, get_object_or_404
 from django.views import generic
-from .models import Post, Comment, Recipient
+from django.db import transaction
+from django.db.models import Max, OuterRef, Subquery
+from .models import Post, Comment, Recipient, OutgoingEmail
 from .forms import CommentForm, ReplyForm, UnsubscribeForm
-from django.http import HttpResponse
+from .pagination import KeysetPaginationMixin, encode_cursor, encode_key, page_after
+from . import cache, notifications, outbox, search, threads
+from .metrics import COMMENTS_WRITTEN
+from .tokens import read_digest_token, read_unsubscribe_token
+from django.http import HttpResponse, Http404, JsonResponse
+from django.core import signing
+from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
-from django.core.mail import EmailMultiAlternatives, get_connection, send_mail
-from django.template import loader
-from voila.settings import VOILA_HOST, MY_EMAIL as my_email
+from voila.settings import MY_EMAIL as my_email
 
-class IndexView(generic.ListView):
+def newest(dates):
+    return max((date for date in dates if date), default=None)
+
+def get_index_last_modified():
+    '''
+    Return when a post was last edited or commented on, the index shows the comment counts.
+    One query, that reads the newest row of the updated_on and the comments' created_on indexes.
+    '''
+    newest_comment = Comment.objects.order_by('-created_on').values('created_on')[:1]
+    return newest(Post.objects.order_by('-updated_on')
+                              .annotate(newest_comment=Subquery(newest_comment))
+                              .values_list('updated_on', 'newest_comment')
+                              .first() or ())
+
+def get_category_last_modified(category):
+    '''
+    Return when one of the category's posts was last edited or commented on, in one query.
+    Each post's newest comment is a lookup on blog_comment_post_created_idx, so it costs as
+    much as the category has posts, not as the blog has comments.
+    '''
+    newest_comment = Comment.objects.filter(post=OuterRef('pk')).order_by('-created_on').values('created_on')[:1]
+    dates = (Post.objects.filter(categories__name__iexact=category)
+                         .aggregate(updated_on=Max('updated_on'), newest_comment=Max(Subquery(newest_comment))))
+    return newest(dates.values())
+
+class IndexView(cache.ConditionalGetMixin, cache.CachedResponseMixin, KeysetPaginationMixin, generic.ListView):
     template_name = 'blog/blog-index.html'
     context_object_name = 'posts'
     model = Post
     paginate_by = 5
+
+    def get_cache_scopes(self):
+        return [cache.INDEX]
+
+    def get_last_modified(self):
+        return get_index_last_modified()
+
     def get_queryset(self):
         ''' Return all the posts on blog ordered from newest to oldest '''
-        return Post.objects.all().order_by('-pub_date')
+        return (Post.objects.defer('body', 'body_html')
+                            .prefetch_related('categories')
+                            .order_by('-pub_date', '-id'))
 
-class CategoryIndexView(generic.ListView):
+class CategoryIndexView(cache.ConditionalGetMixin, cache.CachedResponseMixin, KeysetPaginationMixin, generic.ListView):
     template_name = 'blog/category-index-view.html'
     context_object_name = 'posts'
     model = Post
     paginate_by = 5
+
+    def get_cache_scopes(self):
+        return [cache.category_scope(self.kwargs['category'])]
+
+    def get_last_modified(self):
+        return get_category_last_modified(self.kwargs['category'])
+
     def get_queryset(self):
         '''Return every post that has <category> in its set of categories ordered from newest to oldest'''
         category = self.kwargs['category']
-        return Post.objects.filter(categories__name__iexact = category).order_by('-pub_date')
+        return (Post.objects.filter(categories__name__iexact = category)
+                            .defer('body', 'body_html')
+                            .prefetch_related('categories')
+                            .order_by('-pub_date', '-id'))
+
+class SearchView(generic.ListView):
+    template_name = 'blog/search-results.html'
+    context_object_name = 'posts'
+    model = Post
+    paginate_by = 5
+
+    def get_queryset(self):
+        '''Return the posts whose title or body match ?q=, the best matches first'''
+        query = self.request.GET.get('q', '').strip()
+        if not query:
+            return Post.objects.none()
+        return search.search_posts(query).defer('body', 'body_html').prefetch_related('categories')
 
-class PostDetailView(generic.DetailView):
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['search_query'] = self.request.GET.get('q', '').strip()
+        return context
+
+def get_comment_page(post, cursor=None):
+    ''' Return the BLOG_COMMENTS_PER_PAGE comments after cursor with their threads of replies, and whether there are more '''
+    comments, has_more = page_after(Comment.objects.filter(post=post, parent_comment=None), 'created_on', cursor,
+                                    settings.BLOG_COMMENTS_PER_PAGE)
+    threads.attach_replies(post, comments)
+    return comments, has_more
+
+def comment_as_json(comment, replies=True):
+    data = {
+        'id': comment.id,
+        'parent_comment_id': comment.parent_comment_id,
+        'name': comment.name,
+        'comment': comment.comment,
+        'created_on': comment.created_on.isoformat(),
+        'depth': comment.depth,
+        'can_be_replied_to': comment.can_be_replied_to,
+    }
+    if replies:
+        # the whole thread under the comment, depth first
+        data['replies'] = [comment_as_json(reply, replies=False) for reply in comment.thread]
+    return data
+
+class PostDetailView(cache.ConditionalGetMixin, cache.CachedResponseMixin, generic.DetailView):
     model = Post
     template_name = "blog/post-detail.html"
     comment_form, reply_form = CommentForm(), ReplyForm()
+    # the comment whose reply form didn't validate
+    reply_to = None
+
+    def get_cache_scopes(self):
+        return [cache.post_scope(self.kwargs['slug'])]
+
+    def get_last_modified(self):
+        '''
+        Return when the post or its newest comment or reply was written, in one query.
+        Also keep the cursor of that newest comment, ?since= fetches what's written after it.
+        '''
+        newest_comment = Comment.objects.filter(post=OuterRef('pk')).order_by('-created_on', '-id')
+        row = (Post.objects.filter(slug=self.kwargs.get('slug'))
+                           .annotate(newest_comment=Subquery(newest_comment.values('created_on')[:1]),
+                                     newest_comment_id=Subquery(newest_comment.values('id')[:1]))
+                           .values_list('updated_on', 'newest_comment', 'newest_comment_id')
+                           .first())
+        if row is None:
+            return None
+        updated_on, newest_comment, newest_comment_id = row
+        last_modified = max(date for date in (updated_on, newest_comment) if date)
+        # without comments, every one of them is new
+        self.comments_since = encode_key(newest_comment or last_modified, newest_comment_id or 0)
+        return last_modified
 
     def get_queryset(self, **kwargs):
         ''' Return the post where post.slug=slug''' 
         slug = self.kwargs.get('slug')
-        queryset = Post.objects.filter(slug=slug)
+        queryset = Post.objects.filter(slug=slug).defer('body')
         return queryset
 
     def get_context_data(self, *args, **kwargs):
         ''' Return context to be passed to a template '''  
-        post = self.get_queryset(**kwargs)[0]
-        comments = Comment.objects.filter(post=post).order_by('created_on')
-        comments_count = comments.count()
+        comments, more_comments = self.get_comment_tree(self.object)
+        comments_count = self.object.comment_count
         context = super(PostDetailView, self).get_context_data(**kwargs)
         context['comments'] = comments
         context['comments_count'] = comments_count
+        # the rest of the comments are loaded from PostCommentsView
+        context['comments_cursor'] = encode_cursor(comments[-1], 'created_on') if more_comments else None
+        context['comments_since'] = getattr(self, 'comments_since', None)
         context['comment_form'] = self.comment_form
+        context['reply_to'] = self.reply_to
         '''A reply form only exists if there's at least one comment on the post.'''
         if comments_count:
            context['reply_form']  = self.reply_form
         return context
 
+    def get_comment_tree(self, post):
+        ''' Return a page of the post's comments with their threads of replies, and whether there are more,
+            so a page costs two queries no matter how many comments and replies there are '''
+        return get_comment_page(post)
+
     def post(self, request, *args, **kwargs):
-        ''' Hadnel the http POST method '''  
-        post = self.get_queryset(**kwargs)[0]
-        self.object = self.get_object()  
-        comment_form = CommentForm(request.POST)
-        
-        if comment_form.is_valid():
-            name = comment_form.cleaned_data["name"]
-            email = comment_form.cleaned_data["email"]
-            comment_msg= comment_form.cleaned_data["comment"]
-
-            # check if it's a comment form or a reply form
-            try:           
-               parent_comment_id = int(request.POST.get('parent_comment_id'))
-            except: 
-               # it's a comment with no replies because the hidden input parent_comment_id wasn't submitted   
-               parent_comment_id = None  
-                
-           
-            if parent_comment_id:  # it's a reply because it has a parent id
-               reply_form = ReplyForm(request.POST)
-               self.save_valid_form(name, email, comment_msg, post, parent_comment_id)  
+        ''' Save a comment or a reply and redirect to it on the post's page (Post/Redirect/Get),
+            so a refresh doesn't post it again and the page itself is served from the cache '''
+        self.object = post = self.get_object()
+
+        # check if it's a comment form or a reply form
+        try:
+           parent_comment_id = int(request.POST.get('parent_comment_id'))
+        except (TypeError, ValueError):
+           # it's a comment with no replies because the hidden input parent_comment_id wasn't submitted
+           parent_comment_id = None
+
+        form = (ReplyForm if parent_comment_id else CommentForm)(request.POST)
+        if not form.is_valid():
+            # render the page again with the errors and what was typed in
+            if parent_comment_id:
+                self.reply_form, self.reply_to = form, parent_comment_id
             else:
-               self.save_valid_form(name, email, comment_msg, post)     
-        
-        return render(request, self.template_name, self.get_context_data(**kwargs))  
-        
+                self.comment_form = form
+            return self.render_to_response(self.get_context_data(object=post))
+
+        comment = self.save_valid_form(form.cleaned_data["name"], form.cleaned_data["email"],
+                                       form.cleaned_data["comment"], post, parent_comment_id)
+        COMMENTS_WRITTEN.labels('reply' if parent_comment_id else 'comment').inc()
+        return redirect(f"{post.get_absolute_url()}#comment-{comment.id}")
+
+    @transaction.atomic
     def save_valid_form(self, name, email, comment_msg, post, parent_comment_id=None):
         comment = Comment(name=name,
                           email= email,
@@ -91,84 +214,137 @@ class PostDetailView(generic.DetailView):
             comment.save()
             # and we're also adding the commenter to the recipient list of the comment
             self.add_new_recipient(comment, email) 
-            # An email message will be sent to my_email whenever someone comments on a post
+            # An email message will be sent to my_email whenever someone comments on a post,
+            # it's only queued here and the send_outbox worker delivers it
             message = f"Someone commented on {post.get_absolute_url()}"
-            send_mail("A new comment from Voila", message, my_email, [my_email], fail_silently=False)
+            outbox.enqueue(OutgoingEmail(subject="A new comment from Voila", body=message, from_email=my_email, to=my_email))
         else:
-            # when it's a reply we need to know to which comment this reply belongs
-            parent_comment = Comment.objects.get(id=parent_comment_id)  
+            # when it's a reply we need to know to which comment this reply belongs,
+            # it's in the same post and its thread isn't too deep already
+            parent_comment = get_object_or_404(Comment, id=parent_comment_id, post=post)
+            if not parent_comment.can_be_replied_to:
+                raise Http404("That comment can't be replied to.")
+            comment.post = post
             comment.parent_comment = parent_comment 
-            set_of_recipients = set(
-                 recipient.recipient_email for recipient in parent_comment.recipients.all() if recipient.recipient_email != email
-            )      
-   
-            if set_of_recipients:
-                self.notify_recipients_of_new_reply(set_of_recipients, post, name, parent_comment_id)
-
-            if email not in parent_comment.recipients.all():
-                self.add_new_recipient(parent_comment, email)  
-
             comment.save()
             parent_comment.replies.add(comment) 
+            recipients = list(parent_comment.recipients.exclude(recipient_email=email.lower()))
+   
+            if recipients:
+                self.notify_recipients_of_new_reply(recipients, post, comment)
+
+            self.add_new_recipient(parent_comment, email)  
+            # and to their reply, which can be replied to as well
+            self.add_new_recipient(comment, email)
 
             #if not parent_comment.replies.all or not Comment.objects.all:
                # Recipient.objects.filter(recipient_email__contains="@").delete() 
+        return comment
 
     def add_new_recipient(self, parent_comment, email):
         '''Add new recipients to comments for possible future email notifications'''
-        recipient = Recipient(recipient_email=email)
-        recipient.save()
-        parent_comment.recipients.add(recipient)  
+        Recipient.objects.subscribe(parent_comment, email)
                       
     
-    def notify_recipients_of_new_reply(self, set_of_recipients, post, name, parent_comment_id):
-        '''Send email notifications to all the people on the comment's recipients list'''
-
-        subject = "A new reply from Voila"
-        html_template = loader.get_template('blog/email-template.html')
-        context = {
-            "name": name,
-            "post": post,
-            "comment_id": parent_comment_id,
-            "VOILA_HOST": VOILA_HOST,
-        }
-        text_content = "Someone replied to your comment."
-        html_content = html_template.render(context)
-        messages = []
-        for recipient in set_of_recipients:
-            msg = EmailMultiAlternatives(subject, text_content, my_email, [recipient])
-            msg.attach_alternative(html_content, "text/html")
-            messages.append(msg)
-        return get_connection().send_messages(messages) 
+    def notify_recipients_of_new_reply(self, recipients, post, reply):
+        '''Queue email notifications, or digest entries, for all the people on the comment's recipients list'''
+        return notifications.notify_of_reply(recipients, reply, post)
+
+class PostCommentsView(cache.CachedResponseMixin, generic.View):
+    '''
+    The comments of a post as JSON, for the ones its page doesn't render.
+    ?after=<cursor> is the page of comments (with their replies) after the cursor,
+    ?since=<cursor> is every comment and reply written after the cursor's, oldest first.
+    '''
+    def get_cache_scopes(self):
+        return [cache.post_scope(self.kwargs['slug'])]
+
+    def get(self, request, slug):
+        post = get_object_or_404(Post.objects.only('id'), slug=slug)
+        since = request.GET.get('since')
+        try:
+            if since:
+                comments, has_more = self.get_comments_since(post, since)
+                return JsonResponse({
+                    'comments': [comment_as_json(comment, replies=False) for comment in comments],
+                    'has_more': has_more,
+                    # ?since=<since> is what's written after these
+                    'since': encode_cursor(comments[-1], 'created_on') if comments else since,
+                })
+            comments, has_more = get_comment_page(post, request.GET.get('after'))
+        except ValueError:
+            raise Http404("Invalid cursor.")
+        return JsonResponse({
+            'comments': [comment_as_json(comment) for comment in comments],
+            'has_more': has_more,
+            # ?after=<next> is the next page
+            'next': encode_cursor(comments[-1], 'created_on') if has_more else None,
+        })
+
+    def get_comments_since(self, post, since):
+        # a (created_on, id) cursor like the pages', comments written in the same instant aren't skipped
+        return page_after(Comment.objects.filter(post=post), 'created_on', since, settings.BLOG_COMMENTS_PER_PAGE)
 
 def unsubscribe_from_comment(request, comment_id):
-    comment = get_object_or_404(Comment, id=comment_id)
     email = unsubscribe(request)
     if email: 
-        if comment.recipients.filter(recipient_email=email):
-           # if a valid email and belongs to the recipients list of this comment
-           # delete it
-           comment.recipients.filter(recipient_email=email).delete() 
+        if Recipient.objects.unsubscribe(email, comment_id):
+           # it was a valid email and it belonged to the recipients list of this comment
            return rerender_or_success(request,"success")
-        else:
-           # else: display an error message to let the user know that
-           # the email they entered doesn't belong to the recipients list of this comment 
-           messages.error(request, "The email you entered is not subscribed to any post.")
+    if not Comment.objects.filter(id=comment_id).exists():
+        raise Http404("No comment matches the given query.")
+    if email:
+        # display an error message to let the user know that
+        # the email they entered doesn't belong to the recipients list of this comment 
+        messages.error(request, "The email you entered is not subscribed to any post.")
    
     return rerender_or_success(request,"rerender") 
 
 def unsubscribe_from_all_posts(request):
     email = unsubscribe(request)
     if email:
-       if email in [recipient.recipient_email for recipient in Recipient.objects.all()]:
-           # if a valid email and an object of Recipient model, delete it
-          Recipient.objects.filter(recipient_email=email).delete() 
+       if Recipient.objects.unsubscribe(email):
+          # it was a valid email and an object of Recipient model
           return rerender_or_success(request,"success") 
        else:
            messages.error(request, "The email you entered is not subscribed to any post.")  
 
     return rerender_or_success(request, "rerender")       
 
+# the signed token is what proves the request comes from the email, and the
+# mail clients' one-click POSTs (RFC 8058) don't have a CSRF token
+@csrf_exempt
+def one_click_unsubscribe(request, token):
+    '''
+    Unsubscribe the email signed in the token of an email notification's link, no email to type in.
+    A GET only asks to confirm, link scanners and prefetchers follow the links in emails, a POST unsubscribes.
+    '''
+    try:
+        email, comment_id = read_unsubscribe_token(token)
+    except signing.BadSignature:
+        raise Http404("Invalid unsubscribe link.")
+    if request.method != "POST":
+        return render(request, "blog/confirm-unsubscribe.html", {"email": email, "comment_id": comment_id})
+    Recipient.objects.unsubscribe(email, comment_id)
+    return rerender_or_success(request, "success")
+
+def set_digest_frequency(request, token, frequency):
+    '''
+    The links in the notification emails that switch between an email per reply and a digest.
+    Like the unsubscribe links, a GET only asks to confirm and the POST of its form makes the switch.
+    '''
+    try:
+        email = read_digest_token(token)
+    except signing.BadSignature:
+        raise Http404("Invalid link.")
+    choices = dict(Recipient.DIGEST_CHOICES)
+    if frequency not in choices:
+        raise Http404("Unknown frequency.")
+    if request.method != "POST":
+        return render(request, "blog/confirm-digest-frequency.html", {"email": email, "frequency": choices[frequency]})
+    Recipient.objects.filter(recipient_email=email.lower()).update(digest_frequency=frequency)
+    return render(request, "blog/digest-frequency-updated.html", {"frequency": choices[frequency]})
+
 def unsubscribe(request): 
     if request.method == "POST":
         unsubscribe_form = UnsubscribeForm(request.POST)
@@ -0,0 +1,22 @@
+'''
+gunicorn reads this file from the working directory, the Procfile's web process included.
+
+With PROMETHEUS_MULTIPROC_DIR set, every worker keeps its metrics in files in
+that directory and voila.metrics adds them up, see voila/metrics.py.
+'''
+import glob
+import os
+
+
+def on_starting(server):
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        # a previous run's counters would be added to this one's
+        for path in glob.glob(os.path.join(directory, '*.db')):
+            os.remove(path)
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,138 @@
+/*
+ The post's page only renders the first comments, the rest are loaded from
+ <slug>/comments: "Load more comments" pages through them with ?after=<cursor>,
+ and coming back to the tab fetches what was written meanwhile with ?since=<cursor>.
+*/
+(function () {
+    var comments = document.getElementById("comments");
+    var loadMore = document.getElementById("load-more-comments");
+    if (!comments) {
+        return;
+    }
+
+    function fetchComments(params) {
+        var url = comments.dataset.url + "?" + new URLSearchParams(params).toString();
+        return fetch(url, {headers: {"Accept": "application/json"}}).then(function (response) {
+            if (!response.ok) {
+                throw new Error("Couldn't load the comments: " + response.status);
+            }
+            return response.json();
+        });
+    }
+
+    function fill(element, comment) {
+        element.id = "comment-" + comment.id;
+        element.querySelector(".comment-name").textContent = comment.name;
+        element.querySelector(".comment-text").textContent = comment.comment;
+        element.querySelector(".comment-date").textContent = new Date(comment.created_on).toLocaleString();
+        return element;
+    }
+
+    function wireReplyForm(element, comment) {
+        var toggle = element.querySelector("[data-toggle='collapse']");
+        if (!toggle) {
+            return;
+        }
+        var form = element.querySelector(".reply-form");
+        if (!comment.can_be_replied_to) {
+            toggle.remove();
+            form.remove();
+            return;
+        }
+        form.id = "comment" + comment.id;
+        toggle.dataset.target = "#" + form.id;
+        form.querySelector("[name='parent_comment_id']").value = comment.id;
+    }
+
+    function renderReply(reply) {
+        // a thread's replies are listed depth first under its comment, indented by their depth
+        var parent = document.getElementById("comment-" + reply.parent_comment_id);
+        if (!parent || document.getElementById("comment-" + reply.id)) {
+            return;
+        }
+        var element = document.getElementById("reply-template").content.firstElementChild.cloneNode(true);
+        element.dataset.depth = reply.depth;
+        element.style.marginLeft = reply.depth + "rem";
+        wireReplyForm(element, reply);
+        fill(element, reply);
+        if (parent.dataset.depth === "0") {
+            parent.querySelector(".replies").appendChild(element);
+            return;
+        }
+        // after its parent and the replies under it
+        var next = parent.nextElementSibling;
+        while (next && Number(next.dataset.depth) > Number(parent.dataset.depth)) {
+            next = next.nextElementSibling;
+        }
+        parent.parentNode.insertBefore(element, next);
+    }
+
+    function renderComment(comment) {
+        if (document.getElementById("comment-" + comment.id)) {
+            return;
+        }
+        var element = document.getElementById("comment-template").content.firstElementChild.cloneNode(true);
+        element.dataset.depth = "0";
+        wireReplyForm(element, comment);
+        comments.appendChild(fill(element, comment));
+        (comment.replies || []).forEach(renderReply);
+    }
+
+    function loadNextPage() {
+        if (!comments.dataset.next) {
+            return Promise.resolve();
+        }
+        loadMore.disabled = true;
+        return fetchComments({after: comments.dataset.next}).then(function (page) {
+            page.comments.forEach(renderComment);
+            if (page.next) {
+                comments.dataset.next = page.next;
+                loadMore.disabled = false;
+            } else {
+                delete comments.dataset.next;
+                loadMore.remove();
+            }
+        });
+    }
+
+    function loadNewComments() {
+        if (!comments.dataset.since) {
+            return Promise.resolve();
+        }
+        return fetchComments({since: comments.dataset.since}).then(function (page) {
+            page.comments.forEach(function (comment) {
+                if (comment.parent_comment_id) {
+                    renderReply(comment);
+                } else if (!comments.dataset.next) {
+                    // with pages left to load it comes with the last one
+                    renderComment(comment);
+                }
+            });
+            comments.dataset.since = page.since;
+            if (page.has_more) {
+                return loadNewComments();
+            }
+        });
+    }
+
+    function showLinkedComment() {
+        // a link to #comment-<id>, like the redirect after commenting, may point past the first page
+        if (/^#comment-\d+$/.test(location.hash) && !document.querySelector(location.hash) && comments.dataset.next) {
+            return loadNextPage().then(showLinkedComment);
+        }
+        var linked = /^#comment-\d+$/.test(location.hash) && document.querySelector(location.hash);
+        if (linked) {
+            linked.scrollIntoView();
+        }
+    }
+
+    if (loadMore) {
+        loadMore.addEventListener("click", loadNextPage);
+    }
+    document.addEventListener("visibilitychange", function () {
+        if (document.visibilityState === "visible") {
+            loadNewComments();
+        }
+    });
+    showLinkedComment();
+})();
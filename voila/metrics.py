@@ -0,0 +1,102 @@
+'''
+Prometheus metrics: MetricsMiddleware measures every request, and /metrics
+serves them, and the blog's in blog.metrics, in the text exposition format.
+
+Every gunicorn worker is a process with its own counters. With
+PROMETHEUS_MULTIPROC_DIR set, before the app starts, prometheus_client keeps
+them in files in that directory and /metrics adds up every worker's. See
+gunicorn.conf.py for the cleanup that goes with it. Without it, as in the
+tests or under a single process, /metrics serves the process's own. The
+collectors in settings.VOILA_METRICS_COLLECTORS are read at every scrape, for
+what no web process counts, like the worker dyno's work.
+
+/metrics asks for "Authorization: Bearer <settings.VOILA_METRICS_TOKEN>", it's
+a 404 when no token is set, unless DEBUG is on. The middleware removes itself when settings.VOILA_METRICS_ENABLED is off,
+it's async capable otherwise, see voila.middleware.
+'''
+import asyncio
+import os
+import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.utils.module_loading import import_string
+from django.utils.deprecation import MiddlewareMixin
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from .middleware import aobserve_queries, observe_queries
+
+# anything else a client sends is counted as 'other', so that it can't add label values
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+REQUEST_DURATION = Histogram('voila_request_duration_seconds', "Time to respond to a request.", ['view', 'method'])
+RESPONSES = Counter('voila_responses', "Responses sent.", ['view', 'method', 'status'])
+DB_QUERIES = Counter('voila_db_queries', "SQL queries run while handling requests.", ['view'])
+DB_QUERY_SECONDS = Counter('voila_db_query_seconds', "Time spent in SQL queries while handling requests.", ['view'])
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count, self.duration = 0, 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    def __init__(self, get_response):
+        if not getattr(settings, 'VOILA_METRICS_ENABLED', False):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        queries = QueryCounter()
+        start = time.perf_counter()
+        with observe_queries(queries):
+            response = self.get_response(request)
+        return self.record(request, response, queries, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        queries = QueryCounter()
+        start = time.perf_counter()
+        async with aobserve_queries(queries):
+            response = await self.get_response(request)
+        return self.record(request, response, queries, time.perf_counter() - start)
+
+    def record(self, request, response, queries, duration):
+        # the url's name rather than its path, there's one per post
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        method = request.method if request.method in METHODS else 'other'
+        REQUEST_DURATION.labels(view, method).observe(duration)
+        RESPONSES.labels(view, method, str(response.status_code)).inc()
+        DB_QUERIES.labels(view).inc(queries.count)
+        DB_QUERY_SECONDS.labels(view).inc(queries.duration)
+        return response
+
+
+def metrics_view(request):
+    token = getattr(settings, 'VOILA_METRICS_TOKEN', None)
+    if not token and not settings.DEBUG:
+        # the per view latencies and counts aren't for everyone to read
+        raise Http404("No metrics token set.")
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden("Forbidden.")
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        # every worker's files, this process' registry only has its own
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    # read when scraped, they're the same in every process
+    collected = CollectorRegistry()
+    for path in getattr(settings, 'VOILA_METRICS_COLLECTORS', []):
+        collected.register(import_string(path)())
+    return HttpResponse(generate_latest(registry) + generate_latest(collected), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,205 @@
+'''
+Where did a request's time go? ServerTimingMiddleware adds up the time spent
+in SQL, template rendering and sending mail, and reports it as a Server-Timing
+header and one JSON log line per request on the 'voila.timing' logger.
+
+A request slower than settings.VOILA_SLOW_REQUEST_MS is logged as a warning
+with the SQL it ran. The middleware removes itself when
+settings.VOILA_TIMING_ENABLED is off, so it costs nothing then.
+
+The queries go through connection.execute_wrapper() for the length of the
+request. The templates are timed by the template backend in
+voila.template_backends, and the views that send mail wrap it in measure().
+
+It's async capable, under ASGI it stays on the event loop. Django 3.2's
+connections are per thread and a sync view runs in sync_to_async's thread, so
+aobserve_queries() puts the execute wrapper on that thread's connections.
+'''
+import asyncio
+import functools
+import json
+import logging
+import time
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+logger = logging.getLogger('voila.timing')
+
+# the RequestTiming of the request being handled, None outside of one
+current_timing = ContextVar('current_timing', default=None)
+# the execute wrappers the queries of the current context go through, see observe_queries()
+query_observers = ContextVar('query_observers', default=())
+# a slow request logs at most this many of its queries
+MAX_LOGGED_QUERIES = 100
+
+
+class RequestTiming:
+    def __init__(self):
+        self.durations = {'sql': 0.0, 'template': 0.0, 'mail': 0.0}
+        self.measuring = set()
+        self.queries = []
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.durations['sql'] += duration
+            # keep the references only, the SQL is formatted if the request turns out to be slow
+            self.queries.append((sql, params, duration))
+
+    def as_header(self, total):
+        return ', '.join([
+            f'sql;dur={self.durations["sql"] * 1000:.1f};desc="{len(self.queries)} queries"',
+            f'template;dur={self.durations["template"] * 1000:.1f}',
+            f'mail;dur={self.durations["mail"] * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+    def slowest_queries(self):
+        queries = sorted(self.queries, key=lambda query: query[2], reverse=True)[:MAX_LOGGED_QUERIES]
+        return [{'sql': sql, 'params': repr(params), 'ms': round(duration * 1000, 3)} for sql, params, duration in queries]
+
+
+@contextmanager
+def measure(name):
+    ''' Add the time spent in the block to the current request's <name> duration, once if blocks nest '''
+    timing = current_timing.get()
+    if timing is None or name in timing.measuring:
+        yield
+        return
+    timing.measuring.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.measuring.discard(name)
+        timing.durations[name] = timing.durations.get(name, 0.0) + time.perf_counter() - start
+
+
+def observed(execute, sql, params, many, context):
+    ''' The execute wrapper observe_queries() puts on the connections, it runs the query through the context's observers '''
+    observers = query_observers.get()
+    if not observers:
+        return execute(sql, params, many, context)
+    # the connections carry one of these per observe_queries() block, the query goes through the observers once
+    token = query_observers.set(())
+    try:
+        for observer in reversed(observers):
+            execute = functools.partial(observer, execute)
+        return execute(sql, params, many, context)
+    finally:
+        query_observers.reset(token)
+
+@contextmanager
+def watch_connections():
+    ''' Put observed() on this thread's connections for the block '''
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(observed))
+        yield
+
+@contextmanager
+def observe_queries(observer):
+    ''' Pass the queries this thread runs in the block through observer, an execute wrapper '''
+    token = query_observers.set((*query_observers.get(), observer))
+    try:
+        with watch_connections():
+            yield
+    finally:
+        query_observers.reset(token)
+
+@asynccontextmanager
+async def aobserve_queries(observer):
+    '''
+    observe_queries() for async middleware: the sync views run in sync_to_async's thread, so that's the
+    thread whose connections are watched. Other requests' queries on them skip observer, their context
+    doesn't have it.
+    '''
+    token = query_observers.set((*query_observers.get(), observer))
+    stack = ExitStack()
+    try:
+        await sync_to_async(stack.enter_context, thread_sensitive=True)(watch_connections())
+        try:
+            yield
+        finally:
+            await sync_to_async(stack.close, thread_sensitive=True)()
+    finally:
+        query_observers.reset(token)
+
+
+class ServerTimingMiddleware(MiddlewareMixin):
+    def __init__(self, get_response):
+        if not getattr(settings, 'VOILA_TIMING_ENABLED', False):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with self.measure() as timing:
+            with observe_queries(timing.execute_wrapper):
+                # the queries of a streamed response run after this, they aren't counted
+                response = self.get_response(request)
+        return self.report(request, response, timing)
+
+    async def __acall__(self, request):
+        with self.measure() as timing:
+            async with aobserve_queries(timing.execute_wrapper):
+                response = await self.get_response(request)
+        return self.report(request, response, timing)
+
+    @contextmanager
+    def measure(self):
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+        start = time.perf_counter()
+        try:
+            yield timing
+        finally:
+            current_timing.reset(token)
+        timing.total = time.perf_counter() - start
+
+    def report(self, request, response, timing):
+        response['Server-Timing'] = timing.as_header(timing.total)
+        self.log(request, response, timing, timing.total)
+        return response
+
+    def log(self, request, response, timing, total):
+        slow_ms = getattr(settings, 'VOILA_SLOW_REQUEST_MS', None)
+        slow = slow_ms is not None and total * 1000 >= slow_ms
+        line = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 3),
+            'queries': len(timing.queries),
+            **{f'{name}_ms': round(duration * 1000, 3) for name, duration in timing.durations.items()},
+            'slow': slow,
+        }
+        if slow:
+            line['slowest_queries'] = timing.slowest_queries()
+            logger.warning(json.dumps(line))
+        else:
+            logger.info(json.dumps(line))
+
+
+class StaticFilesMiddleware(MiddlewareMixin, WhiteNoiseMiddleware):
+    '''
+    WhiteNoise, but async capable: a sync only middleware would make every ASGI
+    request hold a thread for as long as it takes. Looking a path up in
+    WhiteNoise's index of the static files doesn't block, so it runs on the loop.
+    '''
+    def __init__(self, get_response):
+        WhiteNoiseMiddleware.__init__(self, get_response)
+        self._async_check()
+
+    async def __acall__(self, request):
+        return self.process_request(request) or await self.get_response(request)
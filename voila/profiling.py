@@ -0,0 +1,174 @@
+'''
+Profile one request in production.
+
+ProfilerMiddleware runs a request under cProfile when it carries an
+"X-Voila-Profile: <token>" header with a token from make_profile_token(), or
+a ?profile query flag and it's from a staff member. It writes the profile
+(<name>.prof, for pstats or snakeviz) and the SQL it ran (<name>.sql) to
+settings.VOILA_PROFILE_DIR, keeps the newest settings.VOILA_PROFILE_KEEP of
+them, and names them in the response's X-Voila-Profile header. One request
+is profiled at a time per process: cProfile can't run twice at once, so a
+request that asks while another is profiled is served as is, with
+"X-Voila-Profile: busy".
+
+The profiles are files on the local disk, so on Heroku they live on one dyno's
+ephemeral filesystem: /admin/profiles only lists the ones of the dyno that
+serves it, and they're gone when the dyno restarts. Profile on a single web
+dyno, or point VOILA_PROFILE_DIR at a shared volume.
+
+/admin/profiles lists them for download, along with a fresh token. The
+middleware removes itself when VOILA_PROFILE_DIR isn't set, and otherwise
+only looks for the header and the flag on every other request.
+'''
+import cProfile
+import os
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import FileResponse, Http404
+from django.shortcuts import render
+from django.utils import timezone
+from django.utils.text import slugify
+
+HEADER = 'X-Voila-Profile'
+QUERY_FLAG = 'profile'
+TOKEN_SALT = 'voila.profile'
+EXTENSIONS = ('.prof', '.sql')
+# the X-Voila-Profile of a request that wasn't profiled because another one was
+BUSY = 'busy'
+# held while a request is profiled
+profiling = threading.Lock()
+
+
+def make_profile_token():
+    ''' Return a token for the X-Voila-Profile header, good for settings.VOILA_PROFILE_TOKEN_MAX_AGE seconds '''
+    return signing.dumps('profile', salt=TOKEN_SALT)
+
+def is_profile_token(token):
+    try:
+        return signing.loads(token, salt=TOKEN_SALT, max_age=settings.VOILA_PROFILE_TOKEN_MAX_AGE) == 'profile'
+    except signing.BadSignature:
+        return False
+
+
+class SQLLog:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, params, time.perf_counter() - start))
+
+    def write(self, path, request, response, total):
+        sql_total = sum(duration for sql, params, duration in self.queries)
+        with open(path, 'w') as log:
+            log.write(f"{request.method} {request.get_full_path()} -> {response.status_code}\n")
+            log.write(f"{total * 1000:.1f}ms, {len(self.queries)} queries in {sql_total * 1000:.1f}ms\n\n")
+            for sql, params, duration in self.queries:
+                log.write(f"-- {duration * 1000:.3f}ms {params!r}\n{sql};\n\n")
+
+
+class ProfilerMiddleware:
+    # cProfile profiles the thread it's enabled in, an async request's sync views run in another one
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'VOILA_PROFILE_DIR', None):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.directory = settings.VOILA_PROFILE_DIR
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __call__(self, request):
+        if not self.wants_profile(request):
+            return self.get_response(request)
+        if not profiling.acquire(blocking=False):
+            response = self.get_response(request)
+            response[HEADER] = BUSY
+            return response
+        try:
+            return self.profile(request)
+        finally:
+            profiling.release()
+
+    def profile(self, request):
+        profiler, sql_log = cProfile.Profile(), SQLLog()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(sql_log))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        total = time.perf_counter() - start
+
+        name = f"{timezone.now():%Y%m%d-%H%M%S-%f}-{request.method.lower()}-{slugify(request.path)[:60]}-{uuid.uuid4().hex[:6]}"
+        profiler.dump_stats(os.path.join(self.directory, name + '.prof'))
+        sql_log.write(os.path.join(self.directory, name + '.sql'), request, response, total)
+        self.prune()
+        response[HEADER] = name
+        return response
+
+    def wants_profile(self, request):
+        token = request.headers.get(HEADER)
+        if token is not None:
+            return is_profile_token(token)
+        # request.user loads the session, only the flagged requests pay for that
+        return QUERY_FLAG in request.GET and request.user.is_staff
+
+    def prune(self):
+        ''' Delete all but the newest settings.VOILA_PROFILE_KEEP profiles '''
+        for name in list_profiles(self.directory)[settings.VOILA_PROFILE_KEEP:]:
+            for extension in EXTENSIONS:
+                path = os.path.join(self.directory, name + extension)
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+def list_profiles(directory):
+    ''' Return the names of the profiles in directory, the newest first '''
+    names = {filename[:-len('.prof')] for filename in os.listdir(directory) if filename.endswith('.prof')}
+    # the names start with their timestamp
+    return sorted(names, reverse=True)
+
+
+@staff_member_required
+def profiles_view(request):
+    directory = getattr(settings, 'VOILA_PROFILE_DIR', None)
+    profiles = []
+    if directory and os.path.isdir(directory):
+        for name in list_profiles(directory):
+            files = [name + extension for extension in EXTENSIONS if os.path.exists(os.path.join(directory, name + extension))]
+            profiles.append({'name': name, 'files': files})
+    return render(request, 'admin/profiles.html', {
+        **admin.site.each_context(request),
+        'title': "Request profiles",
+        'profiles': profiles,
+        'enabled': bool(directory),
+        'header': HEADER,
+        'query_flag': QUERY_FLAG,
+        'token': make_profile_token(),
+        'token_max_age': settings.VOILA_PROFILE_TOKEN_MAX_AGE,
+    })
+
+@staff_member_required
+def download_profile_view(request, filename):
+    directory = getattr(settings, 'VOILA_PROFILE_DIR', None)
+    # only the files that are listed, never a path out of the directory
+    if (not directory or not os.path.isdir(directory) or not filename.endswith(EXTENSIONS)
+            or filename not in os.listdir(directory)):
+        raise Http404("No such profile.")
+    return FileResponse(open(os.path.join(directory, filename), 'rb'), as_attachment=True, filename=filename)
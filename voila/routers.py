@@ -0,0 +1,110 @@
+'''
+Send the reads of the blog and projects pages to a read replica.
+
+settings.VOILA_REPLICA_DATABASE names the replica's alias, reads go to the
+primary ('default') when it's None. ReplicaPinningMiddleware decides per
+request: only GET and HEAD requests of the blog and projects views read from
+the replica, and only until they write something.
+
+Read-your-writes: a request that writes sets a short lived cookie, and the
+requests that carry it read from the primary for settings.VOILA_REPLICA_PIN_SECONDS,
+long enough for the replica to catch up. A visitor who just commented sees
+their comment on the page they're redirected to.
+
+The page cache is shared by every visitor, so a page rendered from a lagging
+replica right after a write can be cached until the next write or
+BLOG_CACHE_TIMEOUT. Keep the pin window above the replica's usual lag.
+'''
+import asyncio
+from contextvars import ContextVar
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+PIN_COOKIE = 'voila_primary'
+REPLICATED_APPS = {'blog', 'projects'}
+SAFE_METHODS = ('GET', 'HEAD')
+
+# the RequestRouting of the request being handled, None outside of one
+current_routing = ContextVar('current_routing', default=None)
+
+
+class RequestRouting:
+    # a mutable object rather than ContextVar values, an async view's thread writes to the same one
+    def __init__(self, request):
+        pinned = PIN_COOKIE in request.COOKIES
+        self.request = request
+        self.may_use_replica = request.method in SAFE_METHODS and not pinned
+        self.wrote = False
+
+    @property
+    def view_is_replicated(self):
+        # resolved by the time the view reads anything
+        match = self.request.resolver_match
+        return match is not None and match.func.__module__.split('.')[0] in REPLICATED_APPS
+
+    def read_database(self):
+        if self.may_use_replica and not self.wrote and self.view_is_replicated:
+            return settings.VOILA_REPLICA_DATABASE
+        return None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = current_routing.get()
+        if routing is None or not getattr(settings, 'VOILA_REPLICA_DATABASE', None):
+            return None
+        if model._meta.app_label not in REPLICATED_APPS:
+            return None
+        return routing.read_database()
+
+    def db_for_write(self, model, **hints):
+        routing = current_routing.get()
+        # a session or cache write doesn't make the replica's blog stale
+        if routing is not None and model._meta.app_label in REPLICATED_APPS:
+            routing.wrote = True
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica has the same rows as the primary
+        databases = {'default', getattr(settings, 'VOILA_REPLICA_DATABASE', None)}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica gets its tables from the primary
+        if db == getattr(settings, 'VOILA_REPLICA_DATABASE', None):
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware(MiddlewareMixin):
+    # async capable, and without a process_view(), so that under ASGI it doesn't send the request through a thread
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        routing = RequestRouting(request)
+        token = current_routing.set(routing)
+        try:
+            # the queries of a streamed response run after this, they read from the primary
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.pin(routing, response)
+
+    async def __acall__(self, request):
+        # a sync view's thread gets a copy of this context, and the same RequestRouting
+        routing = RequestRouting(request)
+        token = current_routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.pin(routing, response)
+
+    def pin(self, routing, response):
+        if routing.wrote and getattr(settings, 'VOILA_REPLICA_DATABASE', None):
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.VOILA_REPLICA_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
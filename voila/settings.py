@@ -49,12 +49,20 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so that it times everything the other middlewares do too
+    'voila.middleware.ServerTimingMiddleware',
+    # the request latency, query and response metrics served at /metrics
+    'voila.metrics.MetricsMiddleware',
+    # before anything reads from the database, it picks the replica or the primary for the request
+    'voila.routers.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'voila.middleware.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # after AuthenticationMiddleware, the ?profile flag is for staff only
+    'voila.profiling.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -63,7 +71,8 @@ ROOT_URLCONF = 'voila.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # the Django engine, timed for the Server-Timing header
+        'BACKEND': 'voila.template_backends.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, "templates")],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -73,6 +82,10 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # voila isn't an installed app, its template tags are registered here
+            'libraries': {
+                'responsive_images': 'voila.templatetags.responsive_images',
+            },
         },
     },
 ]
@@ -93,6 +106,27 @@ DATABASES = {
         'PORT': '5432',
     }
 }
+# the tables were all created with 32 bit ids
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# every gunicorn worker has its own local memory cache, point CACHE_BACKEND and
+# CACHE_LOCATION at a shared cache (memcached, or the database cache after
+# `manage.py createcachetable`) when running more than one of them
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'voila'),
+    }
+}
+
+# how long the rendered blog pages are cached for, writes invalidate them before that (0 turns it off).
+# A write only invalidates the pages in its own worker's local memory cache, the other workers would
+# serve their stale copies until the timeout, so the pages are only cached when CACHE_BACKEND is shared
+BLOG_CACHE_TIMEOUT = int(os.environ.get('BLOG_CACHE_TIMEOUT', 60 * 60 if os.environ.get('CACHE_BACKEND') else 0))
 
 
 # Password validation
@@ -132,6 +166,11 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 VOILA_HOST = "https://voilaa.herokuapp.com"
 
+# page the blog listings with (pub_date, id) cursors instead of ?page=<number>
+BLOG_KEYSET_PAGINATION = False
+# the post pages render this many comments, the rest are loaded from <slug>/comments
+BLOG_COMMENTS_PER_PAGE = 20
+
 MY_EMAIL = 'voilamagicmail@gmail.com'
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -139,11 +178,58 @@ EMAIL_USE_TLS = True
 EMAIL_PORT = 587
 EMAIL_HOST_USER = MY_EMAIL
 EMAIL_HOST_PASSWORD = 'jlvik]djlvik]d'
+# blog emails are queued in the outbox and sent by `manage.py send_outbox`,
+# a failed email is retried after 1, 2, 4... minutes until it's given up on
+BLOG_OUTBOX_MAX_ATTEMPTS = 5
+BLOG_OUTBOX_RETRY_DELAY = 60
+# how long a worker has to send the batch it claimed before the others can claim it again
+BLOG_OUTBOX_CLAIM_TIMEOUT = 10 * 60
+
+# Server-Timing headers and a JSON log line per request, see voila/middleware.py
+VOILA_TIMING_ENABLED = os.environ.get('VOILA_TIMING_ENABLED', '') == '1'
+# requests slower than this (ms) are logged as warnings along with their SQL
+VOILA_SLOW_REQUEST_MS = int(os.environ.get('VOILA_SLOW_REQUEST_MS', 500))
+
+# Prometheus metrics at /metrics, see voila/metrics.py
+VOILA_METRICS_ENABLED = os.environ.get('VOILA_METRICS_ENABLED', '1') == '1'
+# /metrics needs an "Authorization: Bearer <token>" header, it's a 404 without a token unless DEBUG is on
+VOILA_METRICS_TOKEN = os.environ.get('VOILA_METRICS_TOKEN') or None
+# the collectors /metrics reads at every scrape, by their dotted path
+VOILA_METRICS_COLLECTORS = ['blog.metrics.OutboxCollector']
+
+# where the requests profiled on demand write their profiles, profiling is off when it's unset, see voila/profiling.py
+VOILA_PROFILE_DIR = os.environ.get('VOILA_PROFILE_DIR') or None
+VOILA_PROFILE_KEEP = int(os.environ.get('VOILA_PROFILE_KEEP', 50))
+VOILA_PROFILE_TOKEN_MAX_AGE = int(os.environ.get('VOILA_PROFILE_TOKEN_MAX_AGE', 60 * 60))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'voila.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
 
 # Heroku: Update database configuration from $DATABASE_URL.
 import dj_database_url
 db_from_env = dj_database_url.config(conn_max_age=500)
 DATABASES['default'].update(db_from_env)
 
-# compress static files
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
\ No newline at end of file
+# the blog and projects pages read from this replica when it's set, see voila/routers.py
+if os.environ.get('REPLICA_DATABASE_URL'):
+    DATABASES['replica'] = dj_database_url.parse(os.environ['REPLICA_DATABASE_URL'], conn_max_age=500)
+    # the tests read the replica's rows from the test database
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+VOILA_REPLICA_DATABASE = 'replica' if 'replica' in DATABASES else None
+# after a write the visitor reads from the primary for this long, while the replica catches up
+VOILA_REPLICA_PIN_SECONDS = int(os.environ.get('VOILA_REPLICA_PIN_SECONDS', 5))
+DATABASE_ROUTERS = ['voila.routers.ReplicaRouter']
+TEST_RUNNER = 'voila.test_runner.ReplicaMirrorTestRunner'
+
+# compress static files, and write smaller AVIF/WebP variants of the images
+STATICFILES_STORAGE = 'voila.storage.OptimizedStaticFilesStorage'
+# the widths the images are resized to for {% picture %}'s srcset
+VOILA_IMAGE_WIDTHS = (480, 960, 1440)
\ No newline at end of file
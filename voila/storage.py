@@ -0,0 +1,118 @@
+'''
+Static files storage that also writes smaller variants of the static images.
+
+At collectstatic time every PNG/JPEG gets AVIF and WebP copies, plus resized
+copies in all three formats at settings.VOILA_IMAGE_WIDTHS. They are written
+before the files are hashed, so they get hashed names in the manifest like
+any other static file. The {% picture %} tag in voila.templatetags picks them
+up from the manifest.
+'''
+import io
+import logging
+import os
+import re
+from functools import cached_property
+from django.conf import settings
+from django.core.files.base import ContentFile
+from whitenoise.compress import Compressor
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+else:
+    try:
+        # Pillow 10.4, the last release for Python 3.8, reads and writes AVIF with this plugin
+        import pillow_avif  # noqa: F401
+    except ImportError:
+        pass
+
+logger = logging.getLogger(__name__)
+
+SOURCE_FORMATS = {'.png': 'png', '.jpg': 'jpeg', '.jpeg': 'jpeg'}
+# smallest first, the <source> elements are listed in this order
+VARIANT_FORMATS = ('avif', 'webp')
+VARIANT_RE = re.compile(r'^(?P<stem>.+)-(?P<width>\d+)w\.(?P<format>avif|webp|png|jpeg)$')
+
+
+def variant_name(name, width, format):
+    ''' images/magic-wand.png at 480px as WebP is images/magic-wand-480w.webp '''
+    return f'{os.path.splitext(name)[0]}-{width}w.{format}'
+
+
+def variant_formats():
+    ''' The VARIANT_FORMATS this Pillow can write '''
+    Image.init()
+    return [format for format in VARIANT_FORMATS if format.upper() in Image.SAVE]
+
+
+def image_variants(name, image_width, formats, widths):
+    ''' (width, format, variant name) of the variants written for the image name, image_width pixels wide '''
+    source_format = SOURCE_FORMATS[os.path.splitext(name)[1].lower()]
+    for width in [w for w in widths if w < image_width] + [image_width]:
+        # the full width image is already there in its own format
+        for format in formats + ([source_format] if width < image_width else []):
+            yield width, format, variant_name(name, width, format)
+
+
+class OptimizedStaticFilesStorage(CompressedManifestStaticFilesStorage):
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            paths = dict(paths)
+            paths.update(self.write_image_variants(paths))
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+
+    def create_compressor(self, **kwargs):
+        # AVIF is as compressed as it gets, don't bother gzipping it
+        if kwargs.get('extensions') is None:
+            kwargs['extensions'] = (*Compressor.SKIP_COMPRESS_EXTENSIONS, 'avif')
+        return super().create_compressor(**kwargs)
+
+    def write_image_variants(self, paths):
+        ''' Write the variants of the images in paths, return them in the same form as paths '''
+        if Image is None:
+            logger.warning("Pillow isn't installed, the static images won't get smaller variants.")
+            return {}
+        formats, widths = variant_formats(), getattr(settings, 'VOILA_IMAGE_WIDTHS', (480, 960, 1440))
+        variants = {}
+        for name, (storage, path) in paths.items():
+            if os.path.splitext(name)[1].lower() not in SOURCE_FORMATS or VARIANT_RE.match(name):
+                continue
+            source_modified = storage.get_modified_time(path)
+            with storage.open(path) as source:
+                # Pillow reads the header here, the pixels only if a variant has to be written
+                image = Image.open(source)
+                for width, format, variant in image_variants(name, image.width, formats, widths):
+                    if not self.exists(variant) or self.get_modified_time(variant) < source_modified:
+                        self.write_variant(variant, image, width, format)
+                    variants[variant] = (self, variant)
+        return variants
+
+    def write_variant(self, name, image, width, format):
+        if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA')
+        if width < image.width:
+            image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        if format == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        content = io.BytesIO()
+        image.save(content, format=format.upper(), optimize=format in ('png', 'jpeg'), quality=80)
+        if self.exists(name):
+            self.delete(name)
+        self._save(name, ContentFile(content.getvalue()))
+
+    @cached_property
+    def image_variants(self):
+        ''' {'images/magic-wand': {'webp': [(480, 'images/magic-wand-480w.webp'), ...], ...}} from the manifest '''
+        variants = {}
+        for name in self.hashed_files:
+            match = VARIANT_RE.match(name)
+            if match:
+                widths = variants.setdefault(match['stem'], {}).setdefault(match['format'], [])
+                widths.append((int(match['width']), name))
+        for formats in variants.values():
+            for widths in formats.values():
+                widths.sort()
+        return variants
@@ -0,0 +1,23 @@
+'''
+The Django template engine, with the time spent rendering added to the
+request's Server-Timing, see voila.middleware.
+
+Only the templates a view renders through the engine are timed. The ones they
+include or extend render inside them, so they're counted once.
+'''
+from django.template.backends.django import DjangoTemplates, Template
+from .middleware import measure
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with measure('template'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
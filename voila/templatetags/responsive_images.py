@@ -0,0 +1,35 @@
+'''
+{% picture 'images/magic-wand.png' alt="A magic wand" %} renders a static image
+as a <picture> with the AVIF/WebP variants and resized copies that
+voila.storage.OptimizedStaticFilesStorage wrote at collectstatic time, so that
+browsers download the smallest one that fits. Without variants, like under
+runserver, it's a plain <img>.
+'''
+import os
+from django import template
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+from voila.storage import SOURCE_FORMATS, VARIANT_FORMATS
+
+register = template.Library()
+
+
+def srcset(widths):
+    return ', '.join(f'{static(name)} {width}w' for width, name in widths)
+
+@register.simple_tag
+def picture(name, alt="", sizes="100vw", **attrs):
+    ''' Any other keyword argument, like loading="lazy", is an attribute of the <img> '''
+    img_attrs = format_html_join('', ' {}="{}"', attrs.items())
+    stem, extension = os.path.splitext(name)
+    variants = getattr(staticfiles_storage, 'image_variants', {}).get(stem)
+    if not variants:
+        return format_html('<img src="{}" alt="{}"{}>', static(name), alt, img_attrs)
+
+    full_width = max(width for widths in variants.values() for width, _ in widths)
+    fallback = [*variants.get(SOURCE_FORMATS.get(extension.lower()), []), (full_width, name)]
+    sources = format_html_join('', '<source type="image/{}" srcset="{}" sizes="{}">',
+                               ((format, srcset(variants[format]), sizes) for format in VARIANT_FORMATS if format in variants))
+    return format_html('<picture>{}<img src="{}" srcset="{}" sizes="{}" alt="{}"{}></picture>',
+                       sources, static(name), srcset(fallback), sizes, alt, img_attrs)
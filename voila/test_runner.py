@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class ReplicaMirrorTestRunner(DiscoverRunner):
+    '''
+    The replica is a TEST MIRROR in voila/settings.py: another connection to the test
+    database, which can't see the rows a TestCase writes in its transaction. The tests
+    read from the primary, voila/tests/test_routers.py tests the routing itself.
+    '''
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.replica_database, settings.VOILA_REPLICA_DATABASE = settings.VOILA_REPLICA_DATABASE, None
+
+    def teardown_test_environment(self, **kwargs):
+        settings.VOILA_REPLICA_DATABASE = self.replica_database
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,13 @@
+from django.test import TestCase
+from blog.models import Post
+
+class TestASGIApplication(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = Post.objects.create(title="A Post", body="I am a post.", slug="a-post")
+
+    async def test_pages_are_served_through_the_async_middleware_stack(self):
+        response = await self.async_client.get('/blog/')
+        self.assertContains(response, self.post.get_absolute_url())
+        response = await self.async_client.get(self.post.get_absolute_url())
+        self.assertContains(response, '"A Post"')
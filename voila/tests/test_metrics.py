@@ -0,0 +1,105 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import ResolverMatch
+from prometheus_client import REGISTRY
+from blog.models import Comment, OutgoingEmail, Post, Recipient, ReplyNotification
+from voila.metrics import MetricsMiddleware
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+@override_settings(VOILA_METRICS_TOKEN='secret')
+class TestMetrics(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = Post.objects.create(title="A Post", body="I am a post.", slug="a-post")
+
+    def test_requests_are_timed_per_view_with_their_queries(self):
+        before = sample('voila_request_duration_seconds_count', view='blog:index_view', method='GET')
+        queries = sample('voila_db_queries_total', view='blog:index_view')
+        self.client.get('/blog/')
+        self.assertEqual(sample('voila_request_duration_seconds_count', view='blog:index_view', method='GET'), before + 1)
+        self.assertGreater(sample('voila_db_queries_total', view='blog:index_view'), queries)
+
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertContains(response, 'voila_request_duration_seconds_bucket{le="0.005",method="GET",view="blog:index_view"}')
+        self.assertContains(response, 'voila_responses_total{method="GET",status="200",view="blog:index_view"}')
+        self.assertContains(response, 'voila_db_query_seconds_total{view="blog:index_view"}')
+
+    def test_async_requests_count_the_queries_of_their_sync_views(self):
+        @sync_to_async
+        def view(request):
+            request.resolver_match = ResolverMatch(view, (), {}, url_name='async_view')
+            return HttpResponse(Post.objects.count())
+        middleware = MetricsMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        queries = sample('voila_db_queries_total', view='async_view')
+        async_to_sync(middleware)(RequestFactory().get('/blog/'))
+        self.assertEqual(sample('voila_db_queries_total', view='async_view'), queries + 1)
+
+    def test_unknown_paths_and_methods_do_not_add_label_values(self):
+        before = sample('voila_responses_total', view='unmatched', method='other', status='404')
+        self.client.generic('BREW', '/no-such-page-123')
+        self.assertEqual(sample('voila_responses_total', view='unmatched', method='other', status='404'), before + 1)
+
+    @override_settings(BLOG_CACHE_TIMEOUT=60 * 60)
+    def test_page_cache_lookups(self):
+        hits, misses = sample('blog_page_cache_lookups_total', result='hit'), sample('blog_page_cache_lookups_total', result='miss')
+        cache.clear()
+        self.client.get('/blog/')
+        self.client.get('/blog/')
+        self.assertEqual(sample('blog_page_cache_lookups_total', result='miss'), misses + 1)
+        self.assertEqual(sample('blog_page_cache_lookups_total', result='hit'), hits + 1)
+
+    def test_comments_posted(self):
+        comments = sample('blog_comments_written_total', kind='comment')
+        self.client.post(self.post.get_absolute_url(), {"name": "Someone", "email": "someone@email.com",
+                                                        "comment": "I am a comment."})
+        self.assertEqual(sample('blog_comments_written_total', kind='comment'), comments + 1)
+
+    def test_the_outbox_is_read_from_the_database_when_scraped(self):
+        OutgoingEmail.objects.create(subject="Sent", body="Sent.", from_email="a@email.com", to="b@email.com",
+                                     status=OutgoingEmail.SENT)
+        # a comment queues emails, a reply to a daily digest's recipient waits for the digest
+        self.client.post(self.post.get_absolute_url(), {"name": "Someone", "email": "someone@email.com",
+                                                        "comment": "I am a comment."})
+        recipient = Recipient.objects.create(recipient_email="c@email.com", digest_frequency=Recipient.DAILY)
+        reply = Comment.objects.create(name="Replier", email="replier@email.com", comment="I am a reply.", post=self.post)
+        ReplyNotification.objects.create(recipient=recipient, reply=reply)
+        pending = OutgoingEmail.objects.filter(status=OutgoingEmail.PENDING).count()
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertContains(response, f'blog_outbox_emails{{status="pending"}} {pending:.1f}')
+        self.assertContains(response, 'blog_outbox_emails{status="sent"} 1.0')
+        self.assertContains(response, 'blog_outbox_emails{status="failed"} 0.0')
+        self.assertContains(response, 'blog_pending_notifications 1.0')
+
+    def test_the_token_guards_the_metrics(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    @override_settings(VOILA_METRICS_TOKEN=None)
+    def test_the_metrics_are_not_served_without_a_token_unless_debugging(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_adds_up_the_metrics_of_every_worker_process(self):
+        increment = ("from prometheus_client import Counter; "
+                     "Counter('blog_comments_written', '', ['kind']).labels('comment').inc(2)")
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': directory}):
+                for worker in range(2):
+                    subprocess.run([sys.executable, '-c', increment], check=True)
+                response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertContains(response, 'blog_comments_written_total{kind="comment"} 4.0')
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import re
+from asgiref.sync import async_to_sync, sync_to_async
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import reverse
+from blog.models import Post
+from voila.middleware import ServerTimingMiddleware, StaticFilesMiddleware
+
+def durations(response):
+    return {name: float(duration) for name, duration in re.findall(r'(\w+);dur=([\d.]+)', response['Server-Timing'])}
+
+@override_settings(VOILA_TIMING_ENABLED=True, VOILA_SLOW_REQUEST_MS=60000, BLOG_CACHE_TIMEOUT=0)
+class TestServerTimingMiddleware(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Post.objects.create(title="A Post", body="I am a post.", slug="a-post")
+
+    def test_server_timing_header_splits_sql_and_template_time(self):
+        with self.assertLogs('voila.timing', 'INFO') as logs:
+            response = self.client.get(reverse('blog:index_view'))
+        timing = durations(response)
+        self.assertEqual(set(timing), {'sql', 'template', 'mail', 'total'})
+        self.assertGreater(timing['template'], 0)
+        self.assertLessEqual(timing['sql'] + timing['template'], timing['total'])
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['path'], reverse('blog:index_view'))
+        self.assertEqual(line['status'], 200)
+        self.assertFalse(line['slow'])
+        self.assertIn(f'desc="{line["queries"]} queries"', response['Server-Timing'])
+        self.assertGreater(line['queries'], 0)
+
+    def test_mail_time_is_measured(self):
+        with self.assertLogs('voila.timing', 'INFO') as logs:
+            response = self.client.post(reverse('base_view'), {"name": "Person", "email": "person@email.com",
+                                                               "message": "Hello there."})
+        self.assertGreater(durations(response)['mail'], 0)
+        self.assertGreater(json.loads(logs.records[0].getMessage())['mail_ms'], 0)
+
+    @override_settings(VOILA_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_their_sql(self):
+        with self.assertLogs('voila.timing', 'WARNING') as logs:
+            self.client.get(reverse('blog:post_detail_view', kwargs={'slug': 'a-post'}))
+        line = json.loads(logs.records[0].getMessage())
+        self.assertTrue(line['slow'])
+        self.assertTrue(any('"blog_post"' in query['sql'] for query in line['slowest_queries']))
+
+    def test_async_requests_count_the_queries_of_their_sync_views(self):
+        @sync_to_async
+        def view(request):
+            # in another thread than the middleware's, with connections of its own
+            return HttpResponse(Post.objects.count())
+        middleware = ServerTimingMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        with self.assertLogs('voila.timing', 'INFO'):
+            response = async_to_sync(middleware)(RequestFactory().get(reverse('blog:index_view')))
+        self.assertEqual(response.content, b"1")
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+    @override_settings(VOILA_TIMING_ENABLED=False)
+    def test_disabled_middleware_is_left_out(self):
+        response = self.client.get(reverse('blog:index_view'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+class TestStaticFilesMiddleware(TestCase):
+    def test_async_requests_stay_on_the_event_loop(self):
+        async def get_response(request):
+            return HttpResponse("from the view")
+        middleware = StaticFilesMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().get(reverse('blog:index_view')))
+        self.assertEqual(response.content, b"from the view")
+
+    def test_sync_requests_still_work(self):
+        middleware = StaticFilesMiddleware(lambda request: HttpResponse("from the view"))
+        self.assertFalse(asyncio.iscoroutinefunction(middleware))
+        self.assertEqual(middleware(RequestFactory().get(reverse('blog:index_view'))).content, b"from the view")
@@ -0,0 +1,90 @@
+import os
+import pstats
+import shutil
+import tempfile
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from blog.models import Post
+from voila.profiling import BUSY, HEADER, make_profile_token, profiling
+
+class TestProfilerMiddleware(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = Post.objects.create(title="A Post", body="I am a post.", slug="a-post")
+        cls.staff = User.objects.create_user("staff", "staff@email.com", "password", is_staff=True)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = override_settings(VOILA_PROFILE_DIR=self.directory, VOILA_PROFILE_KEEP=2, BLOG_CACHE_TIMEOUT=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_a_signed_header_profiles_the_request(self):
+        response = self.client.get(self.post.get_absolute_url(), HTTP_X_VOILA_PROFILE=make_profile_token())
+        name = response[HEADER]
+        self.assertEqual(sorted(os.listdir(self.directory)), [name + '.prof', name + '.sql'])
+        stats = pstats.Stats(os.path.join(self.directory, name + '.prof'))
+        self.assertTrue(any(function == 'get' for filename, line, function in stats.stats))
+        with open(os.path.join(self.directory, name + '.sql')) as log:
+            sql = log.read()
+        self.assertTrue(sql.startswith(f"GET {self.post.get_absolute_url()} -> 200"))
+        self.assertIn('FROM "blog_post"', sql)
+
+    def test_requests_without_a_valid_header_or_flag_are_not_profiled(self):
+        for headers in [{}, {'HTTP_X_VOILA_PROFILE': make_profile_token() + "x"}]:
+            response = self.client.get(self.post.get_absolute_url(), **headers)
+            self.assertNotIn(HEADER, response)
+        # the flag is for staff only
+        self.client.get(self.post.get_absolute_url(), {'profile': ''})
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_the_query_flag_profiles_staff_requests(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(self.post.get_absolute_url(), {'profile': ''})
+        self.assertIn(HEADER, response)
+
+    def test_a_request_is_not_profiled_while_another_one_is(self):
+        with profiling:
+            response = self.client.get(self.post.get_absolute_url(), HTTP_X_VOILA_PROFILE=make_profile_token())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response[HEADER], BUSY)
+        self.assertEqual(os.listdir(self.directory), [])
+        # and the next one is
+        response = self.client.get(self.post.get_absolute_url(), HTTP_X_VOILA_PROFILE=make_profile_token())
+        self.assertNotEqual(response[HEADER], BUSY)
+
+    def test_keeps_the_newest_profiles(self):
+        names = [self.client.get(self.post.get_absolute_url(), HTTP_X_VOILA_PROFILE=make_profile_token())[HEADER]
+                 for i in range(3)]
+        self.assertEqual(len(os.listdir(self.directory)), 4)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, names[-1] + '.prof')))
+
+    def test_staff_list_and_download_the_profiles(self):
+        name = self.client.get(self.post.get_absolute_url(), HTTP_X_VOILA_PROFILE=make_profile_token())[HEADER]
+        self.assertEqual(self.client.get(reverse('profiles_view')).status_code, 302)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('profiles_view'))
+        self.assertContains(response, reverse('download_profile_view', args=[name + '.sql']))
+        response = self.client.get(reverse('download_profile_view', args=[name + '.sql']))
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="{name}.sql"')
+        self.assertIn(b'FROM "blog_post"', b''.join(response.streaming_content))
+        self.assertEqual(self.client.get(reverse('download_profile_view', args=['settings.py'])).status_code, 404)
+        self.assertEqual(self.client.get('/admin/profiles/..%2Fsettings.prof').status_code, 404)
+
+    def test_asgi_requests_are_profiled_in_sync_mode(self):
+        async def get():
+            # Django 3.2's AsyncClient sends its extra keywords as the request's headers
+            return await self.async_client.get(self.post.get_absolute_url(), **{'X-Voila-Profile': make_profile_token()})
+        response = async_to_sync(get)()
+        stats = pstats.Stats(os.path.join(self.directory, response[HEADER] + '.prof'))
+        # the view ran in the profiled thread
+        self.assertTrue(any(function == 'get' for filename, line, function in stats.stats))
+
+    @override_settings(VOILA_PROFILE_DIR=None)
+    def test_profiling_is_off_without_a_directory(self):
+        response = self.client.get(self.post.get_absolute_url(), HTTP_X_VOILA_PROFILE=make_profile_token())
+        self.assertNotIn(HEADER, response)
@@ -0,0 +1,90 @@
+import asyncio
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.db import router
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import ResolverMatch
+from blog import views as blog_views
+from blog.models import Post, Comment
+from projects import views as projects_views
+from voila.routers import ReplicaPinningMiddleware, PIN_COOKIE
+
+@override_settings(VOILA_REPLICA_DATABASE='replica', VOILA_REPLICA_PIN_SECONDS=5)
+class TestReplicaRouting(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def route(self, request, view=blog_views.IndexView.as_view(), write=False, model=Post):
+        ''' Return where the request reads model from, and its response '''
+        def get_response(request):
+            request.resolver_match = ResolverMatch(view, (), {})
+            if write:
+                router.db_for_write(Post)
+            return HttpResponse(router.db_for_read(model))
+        middleware = ReplicaPinningMiddleware(get_response)
+        response = middleware(request)
+        return response.content.decode(), response
+
+    def test_blog_and_projects_pages_read_from_the_replica(self):
+        self.assertEqual(self.route(self.factory.get('/blog/'))[0], 'replica')
+        self.assertEqual(self.route(self.factory.head('/blog/'))[0], 'replica')
+        self.assertEqual(self.route(self.factory.get('/projects/'), view=projects_views.projects_index)[0], 'replica')
+
+    def test_other_views_and_apps_read_from_the_primary(self):
+        self.assertEqual(self.route(self.factory.get('/admin/'), view=lambda request: None)[0], 'default')
+        self.assertEqual(self.route(self.factory.get('/blog/'), model=User)[0], 'default')
+
+    def test_posts_read_from_the_primary(self):
+        self.assertEqual(self.route(self.factory.post('/blog/a-post'))[0], 'default')
+
+    def test_writing_pins_the_visitor_to_the_primary(self):
+        database, response = self.route(self.factory.post('/blog/a-post'), write=True)
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 5)
+        self.assertTrue(response.cookies[PIN_COOKIE]['httponly'])
+
+        request = self.factory.get('/blog/a-post')
+        request.COOKIES[PIN_COOKIE] = '1'
+        self.assertEqual(self.route(request)[0], 'default')
+
+    def test_reads_after_a_write_in_the_same_request_use_the_primary(self):
+        database, response = self.route(self.factory.get('/blog/'), write=True)
+        self.assertEqual(database, 'default')
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_async_requests_route_their_sync_views_and_pin_their_writes(self):
+        @sync_to_async
+        def get_response(request):
+            request.resolver_match = ResolverMatch(blog_views.IndexView.as_view(), (), {})
+            database = router.db_for_read(Post)
+            router.db_for_write(Post)
+            return HttpResponse(database)
+        middleware = ReplicaPinningMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(self.factory.get('/blog/'))
+        self.assertEqual(response.content, b'replica')
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_reads_outside_of_a_request_use_the_primary(self):
+        self.assertEqual(router.db_for_read(Post), 'default')
+
+    @override_settings(VOILA_REPLICA_DATABASE=None)
+    def test_everything_uses_the_primary_without_a_replica(self):
+        database, response = self.route(self.factory.get('/blog/'), write=True)
+        self.assertEqual(database, 'default')
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_the_replica_is_never_migrated(self):
+        self.assertFalse(router.allow_migrate('replica', 'blog'))
+        self.assertTrue(router.allow_migrate('default', 'blog'))
+
+    def test_commenting_pins_the_commenter_and_the_page_they_are_sent_to_reads_the_primary(self):
+        post = Post.objects.create(title="A Post", body="I am a post.", slug="a-post")
+        response = self.client.post(post.get_absolute_url(), {"name": "Someone", "email": "someone@email.com",
+                                                              "comment": "I am a comment."})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(PIN_COOKIE, response.cookies)
+        # there's no replica database in the tests, a read from it would fail
+        response = self.client.get(response.url)
+        self.assertContains(response, "I am a comment.")
+        self.assertEqual(Comment.objects.count(), 1)
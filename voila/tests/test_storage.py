@@ -0,0 +1,102 @@
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+from io import StringIO
+from unittest import skipIf
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import SimpleTestCase, override_settings
+from voila.storage import SOURCE_FORMATS, VARIANT_RE, Image, image_variants, variant_formats
+
+@skipIf(Image is None, "Pillow isn't installed")
+class TestOptimizedStaticFilesStorage(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.source, cls.root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.source)
+        cls.addClassCleanup(shutil.rmtree, cls.root)
+        os.makedirs(os.path.join(cls.source, 'images'))
+        Image.new('RGBA', (1000, 200), (255, 0, 0, 128)).save(os.path.join(cls.source, 'images', 'wand.png'))
+        with open(os.path.join(cls.source, 'site.css'), 'w') as css:
+            css.write('body { background-image: url("images/wand-1000w.webp"); }\n' * 20)
+        settings = override_settings(STATICFILES_DIRS=[cls.source], STATIC_ROOT=cls.root,
+                                     STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+                                     VOILA_IMAGE_WIDTHS=(480, 960, 1440))
+        settings.enable()
+        cls.addClassCleanup(settings.disable)
+        call_command('collectstatic', interactive=False, verbosity=0, stdout=StringIO())
+
+    def collected(self, *path):
+        return sorted(os.listdir(os.path.join(self.root, *path)))
+
+    def test_images_get_resized_avif_and_webp_variants(self):
+        images = self.collected('images')
+        for width in (480, 960):
+            for format in ('avif', 'webp', 'png'):
+                self.assertIn(f'wand-{width}w.{format}', images)
+        # no upscaling and no copy of the original at its own size
+        self.assertIn('wand-1000w.webp', images)
+        self.assertNotIn('wand-1000w.png', images)
+        self.assertFalse(any(name.startswith('wand-1440w') for name in images))
+
+    def test_variants_are_hashed_and_referenced_from_css(self):
+        images = self.collected('images')
+        self.assertTrue(any(name.startswith('wand-480w.') and name.endswith('.webp') and name != 'wand-480w.webp'
+                            for name in images))
+        css = [name for name in self.collected() if name.startswith('site.') and name.endswith('.css')][0]
+        with open(os.path.join(self.root, css)) as hashed_css:
+            self.assertRegex(hashed_css.read(), r'images/wand-1000w\.\w{12}\.webp')
+
+    def test_css_is_precompressed_with_brotli(self):
+        try:
+            import brotli
+        except ImportError:
+            self.skipTest("Brotli isn't installed")
+        self.assertIn('site.css.br', self.collected())
+
+    def test_picture_tag_offers_the_smallest_variants(self):
+        html = Template("{% load responsive_images %}{% picture 'images/wand.png' alt='A wand' loading='lazy' %}").render(Context())
+        self.assertTrue(html.startswith('<picture><source type="image/avif" srcset="/static/images/wand-480w.'))
+        self.assertIn('<source type="image/webp"', html)
+        self.assertRegex(html, r'<img src="/static/images/wand\.\w{12}\.png" srcset="[^"]*960w, /static/images/wand\.\w{12}\.png 1000w"')
+        self.assertIn('alt="A wand" loading="lazy"></picture>', html)
+
+    def test_picture_tag_without_variants_is_a_plain_img(self):
+        html = Template("{% load responsive_images %}{% picture 'site.css' %}").render(Context())
+        self.assertRegex(html, r'^<img src="/static/site\.\w{12}\.css" alt="">$')
+
+
+@skipIf(Image is None, "Pillow isn't installed")
+class TestStaticCss(SimpleTestCase):
+    def image_set_urls(self):
+        ''' (css file, static path) of every url() in the image-set()s of the static CSS '''
+        for finder in finders.get_finders():
+            for css, storage in finder.list([]):
+                if not css.endswith('.css'):
+                    continue
+                with storage.open(css) as source:
+                    for image_set in re.findall(r'image-set\(([^;]+)\)', source.read().decode()):
+                        for url in re.findall(r'url\("([^"]+)"\)', image_set):
+                            yield css, posixpath.normpath(posixpath.join(posixpath.dirname(css), url))
+
+    def test_every_image_set_url_is_collected(self):
+        # the variants' names are typed in by hand in the CSS, they have to be ones collectstatic writes
+        formats = variant_formats()
+        urls = list(self.image_set_urls())
+        self.assertTrue(urls)
+        for css, path in urls:
+            with self.subTest(css=css, path=path):
+                if finders.find(path):
+                    continue
+                match = VARIANT_RE.match(path)
+                self.assertIsNotNone(match, f"{path} isn't a static file")
+                sources = [match['stem'] + extension for extension in SOURCE_FORMATS if finders.find(match['stem'] + extension)]
+                self.assertTrue(sources, f"{path} has no image to be made from")
+                with Image.open(finders.find(sources[0])) as image:
+                    variants = [name for _, _, name in image_variants(sources[0], image.width, formats, settings.VOILA_IMAGE_WIDTHS)]
+                self.assertIn(path, variants)
@@ -1,13 +1,18 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls import handler404
-from . import views
+from . import metrics, profiling, views
 
 urlpatterns = [
+    # the profiles of the requests voila.profiling.ProfilerMiddleware profiled, for staff
+    path('admin/profiles/', profiling.profiles_view, name="profiles_view"),
+    path('admin/profiles/<filename>', profiling.download_profile_view, name="download_profile_view"),
     path('admin/', admin.site.urls),
     path('', views.base_view, name="base_view"),
     path('projects/', include('projects.urls')),
     path('blog/', include('blog.urls')),
+    # Prometheus' scrapes, see voila/metrics.py
+    path('metrics', metrics.metrics_view, name="metrics"),
 ]
 
 handler404 = views.page_not_found
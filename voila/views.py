@@ -2,6 +2,7 @@ from django.shortcuts import render
 from django.http import HttpResponse
 from django.core.mail import EmailMessage
 from .forms import ContactForm 
+from .middleware import measure
 from voila.settings import MY_EMAIL as my_email
 
 
@@ -21,7 +22,8 @@ def base_view(request):
             email_to = my_email
             message= form.cleaned_data['message']
             email = EmailMessage(subject=subject, body=message, from_email=email_from, to=[email_to], reply_to=[email_from])
-            email.send()
+            with measure('mail'):
+                email.send()
             return render(request,'thanks-for-your-email.html',{"name":name})    
     form = ContactForm()
     return render(request, 'base.html', {'form': form})